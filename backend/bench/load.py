@@ -0,0 +1,419 @@
+# End-to-end load test: N users in M groups each, a configurable HTTP send rate
+# and many socket.io clients subscribed via autojoin. Reports send throughput,
+# send -> socket receive latency percentiles and DB queries per operation (from
+# /metrics), and writes everything to JSON for before/after comparisons.
+#
+#   python bench/load.py --users 200 --groups 50 --groups-per-user 5 \
+#       --sockets 2000 --rate 200 --seconds 30 --output results/after.json
+#
+# Without --base-url a server is started on --port against DATABASE_URL (a
+# fresh SQLite file if unset) with every rate limit raised; a server given with
+# --base-url needs the same. Group memberships are added by each group's
+# creator through POST /groups/{id}/members, so members get read cursors as in
+# production. Thousands of sockets need `ulimit -n` raised.
+#
+# Compare delivery settings with --server-env, e.g. the coalescing window:
+#   python bench/load.py --server-env SOCKET_COALESCE_MS=0 --output results/direct.json
+#   python bench/load.py --server-env SOCKET_COALESCE_MS=20 --output results/coalesced.json
+# and look at delivery.bytes_per_delivery and server.cpu_ms_per_delivery.
+#
+# Wire size per message: --encoding compact connects the sockets with the
+# compact binary encoding (compare delivery.bytes_per_delivery with a json
+# run), and history.bytes_per_message compares a history page sent plain and
+# gzipped.
+import argparse
+import asyncio
+import gzip
+import json
+import os
+import random
+import re
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+from collections import defaultdict
+from pathlib import Path
+
+import aiohttp
+import requests
+import socketio
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(BACKEND_DIR))
+
+from realtime.compact import MESSAGE_FIELDS, unpack  # noqa: E402
+
+COMPACT_CONTENT_INDEX = MESSAGE_FIELDS["dm"].index("content")
+assert all(fields.index("content") == COMPACT_CONTENT_INDEX for fields in MESSAGE_FIELDS.values())
+
+MAX_MEMBERS_PER_CALL = 5000  # GroupMembersUpdate.user_ids
+
+METRIC_LINE = re.compile(r'^(http_request_db_queries_(?:sum|count))\{method="(\w+)",route="([^"]*)"\} (\S+)$')
+CPU_LINE = re.compile(r"^process_cpu_seconds_total (\S+)$")
+
+
+def start_server(port: int, database_url: str, extra_env: list[str]) -> subprocess.Popen:
+    from core.ratelimit import DEFAULT_POLICIES
+
+    env = os.environ.copy()
+    env["DATABASE_URL"] = database_url
+    env.setdefault("SECRET_KEY", "bench-secret")
+    for policy in DEFAULT_POLICIES:
+        env["RATE_LIMIT_" + policy.replace(":", "_").upper()] = "1000000/1000000"
+    env.update(item.split("=", 1) for item in extra_env)
+    return subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--port", str(port), "--log-level", "warning"],
+        cwd=BACKEND_DIR,
+        env=env,
+    )
+
+
+def wait_ready(base: str, timeout: float = 30) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if requests.get(f"{base}/health", timeout=1).ok:
+                return
+        except requests.ConnectionError:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError(f"{base} did not start")
+
+
+def create_users(base: str, count: int) -> list[dict]:
+    users = []
+    session = requests.Session()
+    for _ in range(count):
+        name = f"load_{uuid.uuid4().hex[:10]}"
+        user = session.post(
+            f"{base}/auth/register", json={"username": name, "email": f"{name}@bench", "password": "pw"}
+        )
+        user.raise_for_status()
+        token = session.post(f"{base}/auth/login", json={"username": name, "password": "pw"}).json()["access_token"]
+        users.append({"id": user.json()["id"], "token": token, "headers": {"Authorization": f"Bearer {token}"}})
+    return users
+
+
+def create_groups(base: str, users: list[dict], count: int) -> list[tuple[int, int]]:
+    # (group_id, owner index)
+    session = requests.Session()
+    groups = []
+    for i in range(count):
+        owner = i % len(users)
+        r = session.post(f"{base}/groups", json={"name": f"load-{i}"}, headers=users[owner]["headers"])
+        r.raise_for_status()
+        groups.append((r.json()["id"], owner))
+    return groups
+
+
+def add_members(base: str, users: list[dict], groups: list[tuple[int, int]], memberships: list[tuple[int, int]]) -> None:
+    # Only a group's creator may add members
+    creator = dict(groups)
+    by_group = defaultdict(list)
+    for group_id, user_id in memberships:
+        by_group[group_id].append(user_id)
+    session = requests.Session()
+    for group_id, user_ids in by_group.items():
+        for start in range(0, len(user_ids), MAX_MEMBERS_PER_CALL):
+            r = session.post(
+                f"{base}/groups/{group_id}/members",
+                json={"user_ids": user_ids[start:start + MAX_MEMBERS_PER_CALL]},
+                headers=users[creator[group_id]]["headers"],
+            )
+            r.raise_for_status()
+
+
+def assign_groups(users: list[dict], groups: list[tuple[int, int]], per_user: int, rng: random.Random):
+    """Each user ends up in `per_user` groups (owners are already members of theirs)."""
+    member_of = defaultdict(set)
+    for group_id, owner in groups:
+        member_of[owner].add(group_id)
+    new = []
+    group_ids = [g for g, _ in groups]
+    for i, user in enumerate(users):
+        candidates = [g for g in group_ids if g not in member_of[i]]
+        rng.shuffle(candidates)
+        for group_id in candidates[: max(0, per_user - len(member_of[i]))]:
+            member_of[i].add(group_id)
+            new.append((group_id, user["id"]))
+    return member_of, new
+
+
+def scrape_metrics(base: str) -> tuple[dict, float]:
+    """(DB query totals per route, server CPU seconds) from /metrics."""
+    totals = defaultdict(lambda: [0.0, 0.0])
+    cpu = 0.0
+    for line in requests.get(f"{base}/metrics").text.splitlines():
+        match = METRIC_LINE.match(line)
+        if match:
+            name, method, route, value = match.groups()
+            totals[f"{method} {route}"][0 if name.endswith("_sum") else 1] = float(value)
+        elif match := CPU_LINE.match(line):
+            cpu = float(match.group(1))
+    return totals, cpu
+
+
+def queries_per_op(before: dict, after: dict) -> dict:
+    result = {}
+    for op, (queries, requests_) in after.items():
+        prev_queries, prev_requests = before.get(op, (0.0, 0.0))
+        if requests_ - prev_requests:
+            result[op] = round((queries - prev_queries) / (requests_ - prev_requests), 3)
+    return result
+
+
+def percentile(samples: list[float], p: float) -> float:
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * p))]
+
+
+def dm_partners(index: int, count: int) -> set[int]:
+    # DMs go around a ring so each socket only needs two DM subscriptions
+    return {(index - 1) % count, (index + 1) % count} - {index}
+
+
+def latency_summary(samples: list[float]) -> dict:
+    ms = [s * 1000 for s in samples]
+    return {
+        "count": len(ms),
+        "p50_ms": round(percentile(ms, 0.50), 3),
+        "p90_ms": round(percentile(ms, 0.90), 3),
+        "p99_ms": round(percentile(ms, 0.99), 3),
+        "max_ms": round(max(ms), 3) if ms else 0.0,
+    }
+
+
+class Recorder:
+    def __init__(self):
+        self.sent_at: dict[str, float] = {}
+        self.deliveries: list[float] = []
+        self.unknown = 0
+        self.events = 0
+        self.bytes = 0  # Engine.IO packet payloads, framing prefixes included
+
+    def received(self, data, batch: bool) -> None:
+        now = time.perf_counter()
+        self.events += 1
+        if isinstance(data, bytes):
+            data = unpack(data)
+        items = data.get("data")
+        for message in items if batch else [items]:
+            # compact payloads carry messages as arrays in field order
+            content = message.get("content") if isinstance(message, dict) else message[COMPACT_CONTENT_INDEX]
+            sent = self.sent_at.get(content)
+            if sent is None:
+                self.unknown += 1
+            else:
+                self.deliveries.append(now - sent)
+
+
+class CountingClient(socketio.AsyncClient):
+    def __init__(self, recorder: Recorder, **kwargs):
+        super().__init__(**kwargs)
+        self.recorder = recorder
+
+    async def _handle_eio_message(self, data):
+        self.recorder.bytes += len(data)
+        await super()._handle_eio_message(data)
+
+
+async def connect_sockets(
+    base: str, users: list[dict], count: int, recorder: Recorder, encoding: str, batch: int = 100
+):
+    clients = []
+
+    async def connect(index: int) -> None:
+        user = users[index]
+        client = CountingClient(recorder, reconnection=False)
+        client.on("message", lambda data: recorder.received(data, batch=False))
+        client.on("messages", lambda data: recorder.received(data, batch=True))
+        auth = {"token": user["token"], "autojoin": True, "encoding": encoding}
+        await client.connect(base, auth=auth, transports=["websocket"])
+        rooms = []
+        for other in dm_partners(index, len(users)):
+            a, b = sorted((user["id"], users[other]["id"]))
+            rooms.append(f"dm:{a}:{b}")
+        await client.emit("subscribe_many", {"rooms": rooms})
+        clients.append(client)
+
+    for start in range(0, count, batch):
+        await asyncio.gather(*(connect(i % len(users)) for i in range(start, min(count, start + batch))))
+    return clients
+
+
+async def run_load(base: str, users: list[dict], member_of: dict, args, recorder: Recorder) -> dict:
+    rng = random.Random(args.seed)
+    total = int(args.rate * args.seconds)
+    inflight = asyncio.Semaphore(args.max_inflight)
+    send_latency: list[float] = []
+    errors = defaultdict(int)
+
+    async def send(session: aiohttp.ClientSession, i: int) -> None:
+        sender_index = rng.randrange(len(users))
+        sender = users[sender_index]
+        content = f"load:{i}:{uuid.uuid4().hex[:8]}"
+        if rng.random() < args.dm_ratio or not member_of[sender_index]:
+            receiver = users[rng.choice(sorted(dm_partners(sender_index, len(users))))]
+            url, body = f"{base}/messages/private", {"receiver_id": receiver["id"], "content": content}
+        else:
+            group_id = rng.choice(sorted(member_of[sender_index]))
+            url, body = f"{base}/groups/{group_id}/messages", {"content": content}
+
+        async with inflight:
+            start = time.perf_counter()
+            recorder.sent_at[content] = start
+            try:
+                async with session.post(url, json=body, headers=sender["headers"]) as response:
+                    await response.read()
+                    if response.status != 200:
+                        errors[str(response.status)] += 1
+                        return
+            except aiohttp.ClientError as exc:
+                errors[type(exc).__name__] += 1
+                return
+            send_latency.append(time.perf_counter() - start)
+
+    connector = aiohttp.TCPConnector(limit=args.max_inflight)
+    async with aiohttp.ClientSession(connector=connector) as session:
+        tasks = []
+        started = time.perf_counter()
+        # Open loop: sends are scheduled on the clock, not after the previous reply
+        for i in range(total):
+            delay = started + i / args.rate - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            tasks.append(asyncio.create_task(send(session, i)))
+        await asyncio.gather(*tasks)
+        elapsed = time.perf_counter() - started
+
+    await asyncio.sleep(args.drain)
+    return {
+        "scheduled": total,
+        "sent_ok": len(send_latency),
+        "errors": dict(errors),
+        "elapsed_s": round(elapsed, 3),
+        "send_throughput_per_s": round(len(send_latency) / elapsed, 2) if elapsed else 0.0,
+        "send_latency": latency_summary(send_latency),
+    }
+
+
+async def bench(base: str, args) -> dict:
+    rng = random.Random(args.seed)
+    users = create_users(base, args.users)
+    groups = create_groups(base, users, args.groups)
+    member_of, new_memberships = assign_groups(users, groups, args.groups_per_user, rng)
+    add_members(base, users, groups, new_memberships)
+
+    recorder = Recorder()
+    connect_start = time.perf_counter()
+    clients = await connect_sockets(base, users, args.sockets, recorder, args.encoding)
+    connect_elapsed = time.perf_counter() - connect_start
+
+    recorder.bytes = 0  # count only the load phase
+    before, cpu_before = scrape_metrics(base)
+    load = await run_load(base, users, member_of, args, recorder)
+    after, cpu_after = scrape_metrics(base)
+
+    for client in clients:
+        await client.disconnect()
+    history = history_bandwidth(base, users, member_of)
+
+    elapsed = load["elapsed_s"] + args.drain
+    delivered = len(recorder.deliveries)
+    cpu = cpu_after - cpu_before
+    return {
+        "config": {k: v for k, v in vars(args).items() if k != "output"},
+        "setup": {"sockets": len(clients), "socket_connect_s": round(connect_elapsed, 3)},
+        "http": load,
+        "delivery": {
+            **latency_summary(recorder.deliveries),
+            "deliveries_per_s": round(delivered / elapsed, 2) if elapsed else 0.0,
+            "socket_events": recorder.events,
+            "bytes_received": recorder.bytes,
+            "bytes_per_delivery": round(recorder.bytes / delivered, 1) if delivered else 0.0,
+            "unmatched_events": recorder.unknown,
+        },
+        "server": {
+            "cpu_s": round(cpu, 3),
+            "cpu_ms_per_delivery": round(cpu * 1000 / delivered, 4) if delivered else 0.0,
+        },
+        "history": history,
+        "db_queries_per_op": queries_per_op(before, after),
+    }
+
+
+def history_bandwidth(base: str, users: list[dict], member_of: dict, limit: int = 100) -> dict:
+    """Bytes per message of one history page, uncompressed and gzipped."""
+    index = next(i for i in range(len(users)) if member_of[i])
+    url = f"{base}/groups/{min(member_of[index])}/messages"
+    result = {}
+    for encoding in ("identity", "gzip"):
+        headers = {**users[index]["headers"], "Accept-Encoding": encoding}
+        response = requests.get(url, params={"limit": limit}, headers=headers, stream=True)
+        wire = response.raw.read(decode_content=False)
+        body = gzip.decompress(wire) if response.headers.get("Content-Encoding") == "gzip" else wire
+        messages = len(json.loads(body)["items"])
+        result[encoding] = round(len(wire) / messages, 1) if messages else 0.0
+    return {"page_size": limit, "bytes_per_message": result}
+
+
+def git_revision() -> str:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=BACKEND_DIR, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--base-url", help="use a running server instead of starting one")
+    parser.add_argument("--port", type=int, default=8200)
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--groups", type=int, default=20)
+    parser.add_argument("--groups-per-user", type=int, default=3)
+    parser.add_argument("--sockets", type=int, default=500, help="socket.io clients, spread over the users")
+    parser.add_argument("--rate", type=float, default=50, help="messages per second over HTTP")
+    parser.add_argument("--seconds", type=float, default=10)
+    parser.add_argument("--dm-ratio", type=float, default=0.2, help="share of sends that are DMs")
+    parser.add_argument("--max-inflight", type=int, default=100)
+    parser.add_argument("--drain", type=float, default=2, help="seconds to wait for late deliveries")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--encoding", choices=("json", "compact"), default="json", help="socket payload encoding")
+    parser.add_argument("--output", default="bench-results.json")
+    parser.add_argument(
+        "--server-env", action="append", default=[], metavar="KEY=VALUE", help="extra env for the spawned server"
+    )
+    args = parser.parse_args()
+    if args.users < 2:
+        parser.error("--users must be at least 2")
+
+    if not os.getenv("DATABASE_URL"):
+        os.environ["DATABASE_URL"] = f"sqlite+aiosqlite:///{tempfile.mkdtemp()}/bench.db"
+
+    server = None
+    base = args.base_url
+    if base is None:
+        base = f"http://127.0.0.1:{args.port}"
+        server = start_server(args.port, os.environ["DATABASE_URL"], args.server_env)
+    try:
+        wait_ready(base)
+        results = asyncio.run(bench(base, args))
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+
+    results["revision"] = git_revision()
+    output = Path(args.output)
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(results, indent=2))
+    print(json.dumps({k: results[k] for k in ("http", "delivery", "server", "history", "db_queries_per_op")}, indent=2))
+    print(f"results written to {output}")
+
+
+if __name__ == "__main__":
+    main()
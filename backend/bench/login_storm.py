@@ -0,0 +1,84 @@
+# Measures event-loop responsiveness while logins are hammering argon2.
+#
+#   python bench/login_storm.py --base-url http://127.0.0.1:8000 --storm 32 --seconds 15
+#
+# Run it once against a server started from the baseline commit and once against
+# this one; p99 of /health and message sends should stay flat with the pool.
+# Start the server with RATE_LIMIT_AUTH_IP and RATE_LIMIT_MESSAGE_USER raised
+# (e.g. 10000/10000) so the limiter does not turn the storm into cheap 429s.
+import argparse
+import statistics
+import threading
+import time
+import uuid
+
+import requests
+
+
+def percentile(samples: list[float], p: float) -> float:
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * p))]
+
+
+def summary(name: str, samples: list[float]) -> str:
+    ms = [s * 1000 for s in samples]
+    return (
+        f"{name:<14} n={len(ms):<6} p50={percentile(ms, 0.50):7.1f}ms "
+        f"p99={percentile(ms, 0.99):7.1f}ms mean={statistics.fmean(ms) if ms else 0:7.1f}ms"
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--base-url", default="http://127.0.0.1:8000")
+    parser.add_argument("--storm", type=int, default=32, help="concurrent login threads")
+    parser.add_argument("--seconds", type=float, default=15)
+    args = parser.parse_args()
+    base = args.base_url
+
+    name = f"bench_{uuid.uuid4().hex[:8]}"
+    requests.post(f"{base}/auth/register", json={"username": name, "email": f"{name}@bench", "password": "pw"}).raise_for_status()
+    token = requests.post(f"{base}/auth/login", json={"username": name, "password": "pw"}).json()["access_token"]
+    headers = {"Authorization": f"Bearer {token}"}
+    group_id = requests.post(f"{base}/groups", json={"name": name}, headers=headers).json()["id"]
+
+    deadline = time.monotonic() + args.seconds
+    health: list[float] = []
+    sends: list[float] = []
+    logins = {"ok": 0, "busy": 0}
+
+    def storm() -> None:
+        session = requests.Session()
+        while time.monotonic() < deadline:
+            r = session.post(f"{base}/auth/login", json={"username": name, "password": "pw"})
+            logins["ok" if r.ok else "busy"] += 1
+
+    def probe(url: str, samples: list[float], **kwargs) -> None:
+        session = requests.Session()
+        while time.monotonic() < deadline:
+            start = time.perf_counter()
+            session.request(url=url, **kwargs)
+            samples.append(time.perf_counter() - start)
+            time.sleep(0.01)
+
+    threads = [threading.Thread(target=storm) for _ in range(args.storm)]
+    threads.append(threading.Thread(target=probe, args=(f"{base}/health", health), kwargs={"method": "GET"}))
+    threads.append(threading.Thread(
+        target=probe,
+        args=(f"{base}/groups/{group_id}/messages", sends),
+        kwargs={"method": "POST", "json": {"content": "ping"}, "headers": headers},
+    ))
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    print(f"logins ok={logins['ok']} rejected(429/503)={logins['busy']}")
+    print(summary("/health", health))
+    print(summary("message send", sends))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+# Multi-worker fan-out check: starts two uvicorn workers on separate ports that
+# share DATABASE_URL and SIO_MESSAGE_QUEUE, connects one socket to each, posts
+# through worker A and asserts the message reaches both sockets.
+#
+#   DATABASE_URL=postgresql+asyncpg://... SIO_MESSAGE_QUEUE=database \
+#       SECRET_KEY=... python bench/multiworker.py
+#
+# Exits non-zero if any subscriber misses the message.
+import asyncio
+import os
+import subprocess
+import sys
+import time
+import uuid
+from pathlib import Path
+
+import requests
+import socketio
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+
+
+def start_worker(port: int) -> subprocess.Popen:
+    return subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--port", str(port), "--log-level", "warning"],
+        cwd=BACKEND_DIR,
+        env=os.environ.copy(),
+    )
+
+
+def wait_ready(base: str, timeout: float = 20) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if requests.get(f"{base}/health", timeout=1).ok:
+                return
+        except requests.ConnectionError:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError(f"{base} did not start")
+
+
+def register(base: str) -> tuple[str, dict]:
+    name = f"mw_{uuid.uuid4().hex[:8]}"
+    requests.post(f"{base}/auth/register", json={"username": name, "email": f"{name}@bench", "password": "pw"}).raise_for_status()
+    token = requests.post(f"{base}/auth/login", json={"username": name, "password": "pw"}).json()["access_token"]
+    return token, {"Authorization": f"Bearer {token}"}
+
+
+async def check(bases: list[str]) -> bool:
+    token, headers = register(bases[0])
+    group_id = requests.post(f"{bases[0]}/groups", json={"name": "multiworker"}, headers=headers).json()["id"]
+    room = f"group:{group_id}"
+
+    received = {base: asyncio.Event() for base in bases}
+    clients = []
+    for base in bases:
+        client = socketio.AsyncClient()
+        client.on("message", lambda data, base=base: received[base].set())
+        await client.connect(base, auth={"token": token}, transports=["websocket"])
+        await client.emit("subscribe", {"room": room})
+        clients.append(client)
+    await asyncio.sleep(0.5)
+
+    requests.post(f"{bases[0]}/groups/{group_id}/messages", json={"content": "fan-out"}, headers=headers).raise_for_status()
+    try:
+        await asyncio.wait_for(asyncio.gather(*(e.wait() for e in received.values())), timeout=5)
+    except asyncio.TimeoutError:
+        pass
+
+    ok = True
+    for base, event in received.items():
+        print(f"{base}: {'received' if event.is_set() else 'MISSED'}")
+        ok &= event.is_set()
+    for client in clients:
+        await client.disconnect()
+    return ok
+
+
+def main() -> None:
+    ports = [8101, 8102]
+    bases = [f"http://127.0.0.1:{port}" for port in ports]
+    workers = []
+    try:
+        # One at a time so startup migrations don't race each other
+        for port, base in zip(ports, bases):
+            workers.append(start_worker(port))
+            wait_ready(base)
+        ok = asyncio.run(check(bases))
+    finally:
+        for worker in workers:
+            worker.terminate()
+            worker.wait()
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,204 @@
+# Search latency over a large synthetic message history. Seeds DATABASE_URL
+# (a fresh SQLite file if unset) with --messages DMs and group messages drawn
+# from a Zipf vocabulary, then times first pages and follow-up pages of
+# GET /search queries for random users, split by how common the terms are.
+#
+#   DATABASE_URL=postgresql+asyncpg://... python bench/search.py --messages 1000000
+#   python bench/search.py --messages 1000000 --output results/search-memory.json
+#
+# The backend follows SEARCH_BACKEND as in the server (tsvector/GIN on
+# Postgres, the in-process index otherwise); the in-process index is built
+# from the seeded rows first and its build time is reported. --reuse skips
+# seeding when the database already holds enough messages.
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(BACKEND_DIR))
+
+VOCABULARY = 20_000
+WORDS_PER_MESSAGE = 8
+INSERT_BATCH = 10_000
+TERM_CLASSES = {
+    # Zipf ranks: common terms match a large share of the history, rare ones a handful
+    "common": range(1, 20),
+    "medium": range(200, 1_000),
+    "rare": range(5_000, VOCABULARY),
+}
+
+
+def percentiles(samples: list[float]) -> dict:
+    samples = sorted(samples)
+    pick = lambda q: samples[min(len(samples) - 1, int(q * len(samples)))] * 1000  # noqa: E731
+    return {"n": len(samples), "p50_ms": pick(0.50), "p95_ms": pick(0.95), "p99_ms": pick(0.99), "mean_ms": statistics.fmean(samples) * 1000}
+
+
+RANKS = range(1, VOCABULARY + 1)
+ZIPF_WEIGHTS = list(itertools.accumulate(1 / rank for rank in RANKS))
+
+
+def zipf_words(rng: random.Random, n: int) -> list[str]:
+    return [f"w{rank}" for rank in rng.choices(RANKS, cum_weights=ZIPF_WEIGHTS, k=n)]
+
+
+async def seed(args, rng: random.Random) -> tuple[list[int], dict[int, list[int]]]:
+    from sqlalchemy import func, insert, select
+
+    from database import AsyncSessionLocal
+    from models import Group, GroupMember, GroupMessage, PrivateMessage, User, conversation_key
+
+    async with AsyncSessionLocal() as db:
+        existing = (await db.execute(select(func.count()).select_from(PrivateMessage))).scalar_one()
+        existing += (await db.execute(select(func.count()).select_from(GroupMessage))).scalar_one()
+        if args.reuse and existing >= args.messages:
+            user_ids = list((await db.execute(select(User.id))).scalars())
+            members = {}
+            for group_id, user_id in (await db.execute(select(GroupMember.group_id, GroupMember.user_id))).all():
+                members.setdefault(group_id, []).append(user_id)
+            print(f"reusing {existing} messages", file=sys.stderr)
+            return user_ids, members
+
+        tag = f"{int(time.time())}{rng.randrange(1000)}"
+        now = datetime.now(timezone.utc)
+        users = [{"username": f"s{tag}_{i}", "email": f"s{tag}_{i}@bench", "hashed_password": "x", "created_at": now} for i in range(args.users)]
+        user_ids = list((await db.execute(insert(User).returning(User.id, sort_by_parameter_order=True), users)).scalars())
+        groups = [{"name": f"g{i}", "created_by": user_ids[0], "created_at": now} for i in range(args.groups)]
+        group_ids = list((await db.execute(insert(Group).returning(Group.id, sort_by_parameter_order=True), groups)).scalars())
+        members = {group_id: [] for group_id in group_ids}
+        for user_id in user_ids:
+            for group_id in rng.sample(group_ids, min(args.groups_per_user, len(group_ids))):
+                members[group_id].append(user_id)
+        await db.execute(insert(GroupMember), [
+            {"group_id": g, "user_id": u, "joined_at": now} for g, us in members.items() for u in us
+        ])
+        await db.commit()
+
+        start = time.perf_counter()
+        base = now - timedelta(days=365)
+        populated = [g for g in group_ids if members[g]]
+        for offset in range(0, args.messages, INSERT_BATCH):
+            n = min(INSERT_BATCH, args.messages - offset)
+            words = zipf_words(rng, n * WORDS_PER_MESSAGE)
+            dms, group_msgs = [], []
+            for i in range(n):
+                content = " ".join(words[i * WORDS_PER_MESSAGE:(i + 1) * WORDS_PER_MESSAGE])
+                created_at = base + timedelta(seconds=(offset + i) * 30)
+                if rng.random() < 0.5:
+                    # each user talks to a handful of neighbours
+                    index = rng.randrange(len(user_ids))
+                    sender, receiver = user_ids[index], user_ids[(index + rng.randint(1, 5)) % len(user_ids)]
+                    dms.append({
+                        "sender_id": sender, "receiver_id": receiver, "conversation_key": conversation_key(sender, receiver),
+                        "content": content, "created_at": created_at,
+                    })
+                else:
+                    group_id = rng.choice(populated)
+                    group_msgs.append({
+                        "group_id": group_id, "sender_id": rng.choice(members[group_id]),
+                        "content": content, "created_at": created_at,
+                    })
+            if dms:
+                await db.execute(insert(PrivateMessage), dms)
+            if group_msgs:
+                await db.execute(insert(GroupMessage), group_msgs)
+            await db.commit()
+            print(f"seeded {offset + n}/{args.messages}", file=sys.stderr, end="\r")
+        print(f"\nseeded in {time.perf_counter() - start:.1f}s", file=sys.stderr)
+        return user_ids, members
+
+
+async def run(args) -> dict:
+    from database import AsyncSessionLocal, engine
+    from migrate import run_migrations
+    from core.search import active_backend, rebuild_index, search_index, search_messages
+
+    rng = random.Random(args.seed)
+    async with engine.connect() as conn:
+        await conn.run_sync(run_migrations)
+    user_ids, _ = await seed(args, rng)
+
+    result = {"backend": active_backend(), "messages": args.messages, "queries": {}}
+    if result["backend"] == "memory":
+        start = time.perf_counter()
+        async with AsyncSessionLocal() as db:
+            await rebuild_index(db)
+        result["index_build_s"] = time.perf_counter() - start
+        result["index_terms"] = len(search_index.postings)
+
+    shapes = {
+        **{name: [name] for name in TERM_CLASSES},
+        "common+medium": ["common", "medium"],
+        "medium+rare": ["medium", "rare"],
+    }
+    async with AsyncSessionLocal() as db:
+        for shape, classes in shapes.items():
+            first, follow, hits = [], [], []
+            for _ in range(args.queries):
+                q = " ".join(f"w{rng.choice(TERM_CLASSES[c])}" for c in classes)
+                user_id = rng.choice(user_ids)
+                start = time.perf_counter()
+                page = await search_messages(db, user_id, q, None, args.limit + 1)
+                first.append(time.perf_counter() - start)
+                hits.append(len(page))
+                if len(page) > args.limit:
+                    start = time.perf_counter()
+                    await search_messages(db, user_id, q, None, args.limit + 1, page[args.limit - 1])
+                    follow.append(time.perf_counter() - start)
+            result["queries"][shape] = {
+                "first_page": percentiles(first),
+                "next_page": percentiles(follow) if follow else None,
+                "full_pages": sum(h > args.limit for h in hits) / len(hits),
+            }
+            print(f"{shape:<14} p50 {result['queries'][shape]['first_page']['p50_ms']:8.2f} ms"
+                  f"  p99 {result['queries'][shape]['first_page']['p99_ms']:8.2f} ms", file=sys.stderr)
+    await engine.dispose()
+    return result
+
+
+def git_revision() -> str:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=BACKEND_DIR, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--messages", type=int, default=1_000_000)
+    parser.add_argument("--users", type=int, default=2_000)
+    parser.add_argument("--groups", type=int, default=200)
+    parser.add_argument("--groups-per-user", type=int, default=5)
+    parser.add_argument("--queries", type=int, default=200, help="per query shape")
+    parser.add_argument("--limit", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--reuse", action="store_true", help="skip seeding if enough messages exist")
+    parser.add_argument("--output")
+    args = parser.parse_args()
+
+    if not os.getenv("DATABASE_URL"):
+        path = Path(tempfile.mkdtemp()) / "search.db"
+        os.environ["DATABASE_URL"] = f"sqlite+aiosqlite:///{path}"
+    os.environ.setdefault("SECRET_KEY", "bench")
+
+    result = asyncio.run(run(args))
+    result["revision"] = git_revision()
+    text = json.dumps(result, indent=2)
+    print(text)
+    if args.output:
+        Path(args.output).parent.mkdir(parents=True, exist_ok=True)
+        Path(args.output).write_text(text)
+
+
+if __name__ == "__main__":
+    main()
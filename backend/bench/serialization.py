@@ -0,0 +1,43 @@
+# Per-message serialization cost for a message create: the HTTP response plus
+# the socket.io payload.
+#
+#   SECRET_KEY=x DATABASE_URL=sqlite+aiosqlite:// python bench/serialization.py
+import json
+import sys
+import timeit
+from datetime import datetime, timezone
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from core.serialization import RawJSON, group_message_json, socket_json  # noqa: E402
+from models import GroupMessage  # noqa: E402
+from schemas import GroupMessageOut  # noqa: E402
+
+message = GroupMessage(id=123456, group_id=42, sender_id=7, content="gg wp " * 8, created_at=datetime.now(timezone.utc))
+room = "group:42"
+
+
+def before() -> None:
+    # socket emit: validate + dump + json encode of the envelope
+    payload = GroupMessageOut.model_validate(message).model_dump(mode="json")
+    json.dumps({"room": room, "data": payload}, separators=(",", ":"))
+    # FastAPI response_model: validate + dump again, then JSONResponse render
+    body = GroupMessageOut.model_validate(message).model_dump(mode="json")
+    json.dumps(body, separators=(",", ":")).encode()
+
+
+def after() -> None:
+    body = group_message_json(message)
+    socket_json.dumps({"room": room, "data": RawJSON(body)})
+
+
+def main() -> None:
+    n = 50_000
+    for name, fn in (("before", before), ("after", after)):
+        best = min(timeit.repeat(fn, number=n, repeat=5))
+        print(f"{name:<7} {best / n * 1e6:6.2f} us/message")
+
+
+if __name__ == "__main__":
+    main()
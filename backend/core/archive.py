@@ -0,0 +1,194 @@
+import asyncio
+import gzip
+import json
+import os
+from datetime import datetime, timezone
+from pathlib import Path
+from types import SimpleNamespace
+from typing import Iterable, Optional
+
+# Archived months of a message table, one pair of files per month:
+#
+#   <ARCHIVE_DIR>/<table>/<YYYY-MM>.ndjson.gz   gzip, one member per room
+#   <ARCHIVE_DIR>/<table>/<YYYY-MM>.rooms.json  room -> [offset, length, rows]
+#
+# The first gzip member is a header line ({"table", "month", "columns"}); every
+# other line is a JSON array of column values in that order, so field names are
+# not repeated per row. Each room's rows (oldest first) form their own gzip
+# member, which lets a history read seek straight to one room instead of
+# inflating the whole month; `zcat` still reads the file end to end. The
+# .rooms.json index is written last and marks the archive as complete.
+ARCHIVE_DIR = Path(os.getenv("ARCHIVE_DIR", "archive"))
+ARCHIVE_FORMAT = "ndjson-gzip/1"
+
+Key = tuple[datetime, int]  # (created_at, id), the history keyset
+
+
+def archive_paths(table: str, month: datetime) -> tuple[Path, Path]:
+    base = ARCHIVE_DIR / table / f"{month:%Y-%m}"
+    return base.with_suffix(".ndjson.gz"), base.with_suffix(".rooms.json")
+
+
+def _json_default(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(f"Cannot archive {type(value).__name__}")
+
+
+def _line(values) -> bytes:
+    return json.dumps(values, separators=(",", ":"), default=_json_default).encode() + b"\n"
+
+
+def _fsync_replace(tmp: Path, path: Path) -> None:
+    with open(tmp, "rb+") as f:
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+class ArchiveWriter:
+    """Writes one month of `table`, fed with (room, values) rows ordered by
+    room, created_at, id. Blocking (file I/O and gzip): call write and close
+    from a worker thread, not the event loop."""
+
+    def __init__(self, table: str, month: datetime, columns: list[str]):
+        self.table, self.month, self.columns = table, month, columns
+        self.data_path, self.index_path = archive_paths(table, month)
+        self.data_path.parent.mkdir(parents=True, exist_ok=True)
+        self._tmp = self.data_path.with_name(self.data_path.name + ".tmp")
+        self._file = open(self._tmp, "wb")
+        self._file.write(gzip.compress(_line({"table": table, "month": f"{month:%Y-%m}", "columns": columns})))
+        self._member, self._room, self._offset, self._count = None, None, 0, 0
+        self.rooms: dict[str, list[int]] = {}
+        self.total = 0
+
+    def write(self, rows: Iterable[tuple[str, tuple]]) -> None:
+        f = self._file
+        for row_room, values in rows:
+            if row_room != self._room:
+                self._end_member()
+                self._room, self._offset, self._count = row_room, f.tell(), 0
+                self._member = gzip.GzipFile(fileobj=f, mode="wb")
+            self._member.write(_line(values))
+            self._count += 1
+            self.total += 1
+
+    def _end_member(self) -> None:
+        if self._member is not None:
+            self._member.close()  # ends the gzip member, not the file
+            self.rooms[self._room] = [self._offset, self._file.tell() - self._offset, self._count]
+            self._member = None
+
+    def close(self) -> int:
+        """Finish both files; returns the number of rows written."""
+        self._end_member()
+        self._file.close()
+        _fsync_replace(self._tmp, self.data_path)
+
+        index = {"format": ARCHIVE_FORMAT, "table": self.table, "month": f"{self.month:%Y-%m}",
+                 "columns": self.columns, "rows": self.total, "rooms": self.rooms}
+        tmp = self.index_path.with_name(self.index_path.name + ".tmp")
+        tmp.write_text(json.dumps(index, separators=(",", ":")))
+        _fsync_replace(tmp, self.index_path)
+        return self.total
+
+    def abort(self) -> None:
+        self._file.close()
+        self._tmp.unlink(missing_ok=True)
+
+
+class ArchiveReader:
+    """Reads archived history; month indexes are cached until their file changes."""
+
+    def __init__(self):
+        self._months: dict[str, tuple[int, list[datetime]]] = {}
+        self._indexes: dict[Path, tuple[int, dict]] = {}
+
+    def months(self, table: str) -> list[datetime]:
+        directory = ARCHIVE_DIR / table
+        try:
+            mtime = directory.stat().st_mtime_ns
+        except FileNotFoundError:
+            return []
+        cached = self._months.get(table)
+        if cached is None or cached[0] != mtime:
+            months = sorted(datetime.strptime(p.name[:7], "%Y-%m") for p in directory.glob("*.rooms.json"))
+            cached = self._months[table] = (mtime, months)
+        return cached[1]
+
+    def _index(self, path: Path) -> dict:
+        mtime = path.stat().st_mtime_ns
+        cached = self._indexes.get(path)
+        if cached is None or cached[0] != mtime:
+            cached = self._indexes[path] = (mtime, json.loads(path.read_text()))
+        return cached[1]
+
+    def has_room(self, table: str, room: str) -> bool:
+        return any(room in self._index(archive_paths(table, month)[1])["rooms"] for month in self.months(table))
+
+    def read_room(self, table: str, month: datetime, room: str) -> list[SimpleNamespace]:
+        """One room's archived rows for a month, oldest first."""
+        data_path, index_path = archive_paths(table, month)
+        index = self._index(index_path)
+        location = index["rooms"].get(room)
+        if location is None:
+            return []
+        offset, length, _ = location
+        with open(data_path, "rb") as f:
+            f.seek(offset)
+            data = gzip.decompress(f.read(length))
+        columns = index["columns"]
+        rows = []
+        for line in data.splitlines():
+            row = SimpleNamespace(**dict(zip(columns, json.loads(line))))
+            row.created_at = datetime.fromisoformat(row.created_at)
+            rows.append(row)
+        return rows
+
+    def page(self, table: str, room: str, limit: int, before: Optional[Key] = None, after: Optional[Key] = None) -> list:
+        """Up to `limit` archived rows of `room`: newest first older than `before`,
+        or oldest first newer than `after` (exactly one of them, or neither)."""
+        months = self.months(table)
+        rows = []
+        if after is not None:
+            after = (_utc(after[0]), after[1])
+            for month in months:
+                if _month_end(month) <= after[0].replace(tzinfo=None):
+                    continue
+                rows.extend(r for r in self.read_room(table, month, room) if (_utc(r.created_at), r.id) > after)
+                if len(rows) >= limit:
+                    break
+            return rows[:limit]
+
+        if before is not None:
+            before = (_utc(before[0]), before[1])
+        for month in reversed(months):
+            if before is not None and month > before[0].replace(tzinfo=None):
+                continue
+            older = self.read_room(table, month, room)
+            rows.extend(r for r in reversed(older) if before is None or (_utc(r.created_at), r.id) < before)
+            if len(rows) >= limit:
+                break
+        return rows[:limit]
+
+
+def _utc(ts: datetime) -> datetime:
+    # month names are UTC; naive timestamps (SQLite) are taken as UTC
+    return ts.astimezone(timezone.utc) if ts.tzinfo else ts.replace(tzinfo=timezone.utc)
+
+
+def _month_end(month: datetime) -> datetime:
+    return month.replace(year=month.year + month.month // 12, month=month.month % 12 + 1)
+
+
+archive = ArchiveReader()
+
+
+async def archived_room(table: str, room: str) -> bool:
+    """Whether `room` has archived months (stats and index reads off the loop)."""
+    return await asyncio.to_thread(archive.has_room, table, room)
+
+
+async def archived_page(table: str, room: str, limit: int, before: Optional[Key] = None, after: Optional[Key] = None) -> list:
+    if not archive.months(table):
+        return []
+    return await asyncio.to_thread(archive.page, table, room, limit, before, after)
@@ -0,0 +1,97 @@
+import time
+from contextvars import ContextVar
+from typing import Optional
+
+from sqlalchemy import event
+
+from core.metrics import SIZE_BUCKETS, registry
+
+http_requests = registry.counter("http_requests_total", "HTTP requests", ("method", "route", "status"))
+http_latency = registry.histogram("http_request_duration_seconds", "HTTP request latency", ("method", "route"))
+request_queries = registry.histogram(
+    "http_request_db_queries", "DB queries issued per HTTP request", ("method", "route"), SIZE_BUCKETS
+)
+request_db_time = registry.histogram(
+    "http_request_db_seconds", "Time spent in DB queries per HTTP request", ("method", "route")
+)
+db_queries = registry.histogram("db_query_duration_seconds", "DB query latency", ("statement",))
+
+# [query count, query seconds] for the request being served; a list so that
+# tasks copying the context still add to the same totals
+_request_db: ContextVar[Optional[list]] = ContextVar("request_db", default=None)
+
+
+def _route_label(scope: dict, root_path: str) -> str:
+    # FastAPI stores the matched route in the scope; use its template, never
+    # the raw path, so label cardinality stays bounded
+    template = getattr(scope.get("route"), "path", None)
+    if template is None:
+        # Mounted sub-apps (engine.io polling) only extend root_path
+        mount = scope.get("root_path", "")[len(root_path):]
+        return mount or "unmatched"
+    # Routes of included routers carry their path relative to the router;
+    # put the (static) prefix segments back from the request path
+    segments = [s for s in scope["path"].split("/") if s]
+    depth = len(segments) - len([s for s in template.split("/") if s])
+    return "/" + "/".join(segments[:depth]) + template if depth > 0 else template or "/"
+
+
+class MetricsMiddleware:
+    """Pure ASGI middleware timing every HTTP request per route template."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        status = 500
+        totals = [0, 0.0]
+        token = _request_db.set(totals)
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        root_path = scope.get("root_path", "")
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            elapsed = time.perf_counter() - start
+            _request_db.reset(token)
+            method, route = scope["method"], _route_label(scope, root_path)
+            http_requests.labels(method, route, str(status)).inc()
+            http_latency.labels(method, route).observe(elapsed)
+            request_queries.labels(method, route).observe(totals[0])
+            request_db_time.labels(method, route).observe(totals[1])
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info["query_start"].pop()
+    db_queries.labels(statement.split(None, 1)[0].upper()).observe(elapsed)
+    totals = _request_db.get()
+    if totals is not None:
+        totals[0] += 1
+        totals[1] += elapsed
+
+
+def _handle_error(context):
+    # a failed statement never reaches after_cursor_execute
+    starts = context.connection.info.get("query_start") if context.connection is not None else None
+    if starts:
+        starts.pop()
+
+
+def instrument_engine(engine) -> None:
+    sync_engine = getattr(engine, "sync_engine", engine)
+    event.listen(sync_engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(sync_engine, "after_cursor_execute", _after_cursor_execute)
+    event.listen(sync_engine, "handle_error", _handle_error)
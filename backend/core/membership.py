@@ -0,0 +1,68 @@
+import os
+
+from sqlalchemy import select, and_
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from core.cache import TTLCache
+from models import GroupMember
+
+MEMBERSHIP_CACHE_SIZE = int(os.getenv("MEMBERSHIP_CACHE_SIZE", "100000"))
+MEMBERSHIP_CACHE_TTL = float(os.getenv("MEMBERSHIP_CACHE_TTL", "60"))
+
+# (group_id, user_id) -> True. Only memberships are cached: a user who was
+# just added must not be refused for a TTL on workers that looked them up
+# before. Removals call invalidate_membership, and then
+# realtime.fanout.members_changed so other workers drop their entries too.
+membership_cache = TTLCache(MEMBERSHIP_CACHE_SIZE, MEMBERSHIP_CACHE_TTL)
+
+
+async def is_member(db: AsyncSession, group_id: int, user_id: int) -> bool:
+    key = (group_id, user_id)
+    cached = membership_cache.get(key)
+    if cached is not None:
+        return cached
+
+    result = await db.execute(
+        select(GroupMember.id).where(
+            and_(GroupMember.group_id == group_id, GroupMember.user_id == user_id)
+        )
+    )
+    member = result.scalar_one_or_none() is not None
+    if member:
+        membership_cache.set(key, True)
+    return member
+
+
+async def member_group_ids(db: AsyncSession, user_id: int, group_ids) -> set[int]:
+    """Set-based variant of is_member: which of `group_ids` the user belongs to."""
+    allowed, unknown = set(), []
+    for group_id in set(group_ids):
+        if membership_cache.get((group_id, user_id)):
+            allowed.add(group_id)
+        else:
+            unknown.append(group_id)
+
+    if unknown:
+        result = await db.execute(
+            select(GroupMember.group_id).where(
+                and_(GroupMember.user_id == user_id, GroupMember.group_id.in_(unknown))
+            )
+        )
+        found = set(result.scalars())
+        for group_id in found:
+            membership_cache.set((group_id, user_id), True)
+        allowed |= found
+
+    return allowed
+
+
+async def user_group_ids(db: AsyncSession, user_id: int) -> list[int]:
+    result = await db.execute(select(GroupMember.group_id).where(GroupMember.user_id == user_id))
+    group_ids = list(result.scalars())
+    for group_id in group_ids:
+        membership_cache.set((group_id, user_id), True)
+    return group_ids
+
+
+def invalidate_membership(group_id: int, user_id: int) -> None:
+    membership_cache.pop((group_id, user_id))
@@ -0,0 +1,167 @@
+import asyncio
+import logging
+import os
+from collections import defaultdict
+
+from sqlalchemy import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from core.read_state import record_messages
+from database import AsyncSessionLocal
+
+logger = logging.getLogger(__name__)
+
+# "direct": one transaction per message. "batched": creates are queued and a
+# background writer flushes them with multi-row INSERT ... RETURNING. Either
+# way the room's read cursors are updated in the message's transaction; the
+# writer does it once per room per batch, so concurrent sends to a large
+# group don't each rewrite every member's cursor row.
+MESSAGE_WRITE_MODE = os.getenv("MESSAGE_WRITE_MODE", "direct")
+MESSAGE_BATCH_SIZE = int(os.getenv("MESSAGE_BATCH_SIZE", "256"))
+MESSAGE_BATCH_WAIT_MS = float(os.getenv("MESSAGE_BATCH_WAIT_MS", "5"))
+
+
+class MessageWriter:
+    def __init__(self, max_batch: int, max_wait: float):
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.batches = 0
+        self.rows = 0
+        self._queue: asyncio.Queue | None = None
+        self._task: asyncio.Task | None = None
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None
+
+    def start(self) -> None:
+        self._queue = asyncio.Queue()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is None:
+            return
+        # New sends go direct from here on; the writer flushes what it holds
+        # and exits when it reaches the sentinel
+        task, self._task = self._task, None
+        await self._queue.put(None)
+        await task
+
+        # Rows submitted while the sentinel was queued
+        pending = []
+        while not self._queue.empty():
+            item = self._queue.get_nowait()
+            if item is not None:
+                pending.append(item)
+        if pending:
+            await self._flush(pending)
+
+    async def submit(self, model, room: str, values: dict):
+        """Queue one row and wait until the batch holding it has committed."""
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((model, room, values, future))
+        return await future
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        stopping = False
+        while not stopping:
+            item = await self._queue.get()
+            if item is None:
+                return
+            batch = [item]
+            deadline = loop.time() + self.max_wait
+            while len(batch) < self.max_batch:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(self._queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                if item is None:
+                    stopping = True
+                    break
+                batch.append(item)
+            await self._flush(batch)
+
+    async def _flush(self, batch: list) -> None:
+        try:
+            try:
+                results = await self._write(batch)
+            except Exception:
+                if len(batch) == 1:
+                    raise
+                # One bad row fails the whole INSERT; retry the rows alone so
+                # only its sender gets the error
+                logger.exception("Message batch of %d rows failed, retrying rows one by one", len(batch))
+                results = []
+                for item in batch:
+                    try:
+                        results += await self._write([item])
+                    except Exception as e:
+                        logger.exception("Message row failed")
+                        if not item[3].done():
+                            item[3].set_exception(e)
+        except Exception as e:
+            logger.exception("Message batch of %d rows failed", len(batch))
+            for *_, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        except BaseException:
+            # Cancelled mid-flush: never leave a sender waiting on its future
+            for *_, future in batch:
+                future.cancel()
+            raise
+
+        self.batches += 1
+        self.rows += len(results)
+        for future, row, unread in results:
+            if not future.done():
+                future.set_result((row, unread))
+
+    async def _write(self, batch: list) -> list:
+        """Insert `batch` and update its rooms' cursors in one transaction;
+        returns [future, row, unread] per row."""
+        by_model = defaultdict(list)
+        for item in batch:
+            by_model[item[0]].append(item)
+
+        results = []
+        by_room = defaultdict(list)
+        async with AsyncSessionLocal() as db:
+            for model, items in by_model.items():
+                table = model.__table__
+                stmt = insert(table).returning(*table.c, sort_by_parameter_order=True)
+                rows = (await db.execute(stmt, [values for _, _, values, _ in items])).all()
+                for item, row in zip(items, rows):
+                    results.append([item[3], row, []])
+                    by_room[item[1]].append(results[-1])
+            for room, created in by_room.items():
+                # Only the room's last sender reports the unread counts
+                created[-1][2] = await record_messages(db, room, [row for _, row, _ in created])
+            await db.commit()
+        return results
+
+
+message_writer = MessageWriter(MESSAGE_BATCH_SIZE, MESSAGE_BATCH_WAIT_MS / 1000)
+
+
+async def persist_message(db: AsyncSession, model, room: str, **values):
+    """Insert one message into `room`, update its read cursors in the same
+    transaction and return (message, unread counts) once durable.
+
+    The message is the ORM instance in direct mode and a Row (same attribute
+    names) when the batched writer is running.
+    """
+    if message_writer.running:
+        return await message_writer.submit(model, room, values)
+
+    message = model(**values)
+    db.add(message)
+    await db.flush()
+    unread = await record_messages(db, room, [message])
+    await db.commit()
+    await db.refresh(message)
+    return message, unread
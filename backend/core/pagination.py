@@ -0,0 +1,67 @@
+import base64
+import json
+from datetime import datetime
+from typing import Optional
+
+from fastapi import HTTPException
+from sqlalchemy import tuple_
+
+MAX_PAGE_SIZE = 200
+
+
+# Cursors are opaque to clients: base64 of a JSON keyset position
+def encode_token(values: list) -> str:
+    raw = json.dumps(values, separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_token(cursor: str) -> list:
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded))
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    if not isinstance(values, list):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return values
+
+
+def encode_cursor(created_at: datetime, message_id: int) -> str:
+    return encode_token([created_at.isoformat(), message_id])
+
+
+def decode_cursor(cursor: str) -> tuple[datetime, int]:
+    try:
+        created_at, message_id = decode_token(cursor)
+        return datetime.fromisoformat(created_at), int(message_id)
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+def keyset_page(query, model, limit: int, before: Optional[str] = None, after: Optional[str] = None):
+    """Apply a (created_at, id) keyset window to `query`.
+
+    `before` (and the default) walks backwards from the newest message, `after`
+    walks forwards. One extra row is fetched so callers can tell if there is a next page.
+    """
+    if before and after:
+        raise HTTPException(status_code=400, detail="Use either before or after, not both")
+
+    key = tuple_(model.created_at, model.id)
+    if after:
+        query = query.where(key > tuple_(*decode_cursor(after)))
+        query = query.order_by(model.created_at, model.id)
+    else:
+        if before:
+            query = query.where(key < tuple_(*decode_cursor(before)))
+        query = query.order_by(model.created_at.desc(), model.id.desc())
+
+    return query.limit(limit + 1)
+
+
+def split_page(rows: list, limit: int) -> tuple[list, Optional[str]]:
+    if len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    last = rows[-1]
+    return rows, encode_cursor(last.created_at, last.id)
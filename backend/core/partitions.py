@@ -0,0 +1,270 @@
+# Monthly range partitioning of the message tables on created_at (Postgres).
+#
+# Converting an existing table copies every row under an ACCESS EXCLUSIVE
+# lock, blocking message writes meanwhile, so it is never done by the app:
+# run `python -m core.partitions` once (in a maintenance window for large
+# tables) before enabling MESSAGE_PARTITIONING=monthly. The app then runs
+# maintenance at startup and every PARTITION_MAINTENANCE_SECONDS:
+#   - partitions exist from the current month to PARTITION_MONTHS_AHEAD ahead,
+#     with a default partition as a safety net
+#   - with ARCHIVE_AFTER_MONTHS > 0, months older than that are exported with
+#     core.archive and their partitions dropped; history reads past the
+#     horizon are served from the archive. ARCHIVE_DIR must then be storage
+#     shared by every host: the export happens on whichever worker holds the
+#     maintenance lock, and a host that cannot see an archived month refuses
+#     to start (check_archive_storage).
+#
+# The primary key becomes (id, created_at), as Postgres requires the partition
+# key in every unique constraint; ids still come from the table's sequence.
+import asyncio
+import logging
+import os
+import re
+from datetime import datetime, timezone
+from typing import Optional
+
+from sqlalchemy import String, cast, column, func, insert, literal, select, table, text
+from sqlalchemy.engine import Connection
+from sqlalchemy.ext.asyncio import AsyncConnection
+from sqlalchemy.schema import AddConstraint
+
+from core.archive import ArchiveWriter, archive_paths
+from database import engine
+from models import GroupMessage, MessageArchive, PrivateMessage
+
+logger = logging.getLogger(__name__)
+
+MESSAGE_PARTITIONING = os.getenv("MESSAGE_PARTITIONING", "off")  # off | monthly
+PARTITION_MONTHS_AHEAD = int(os.getenv("PARTITION_MONTHS_AHEAD", "3"))
+ARCHIVE_AFTER_MONTHS = int(os.getenv("ARCHIVE_AFTER_MONTHS", "0"))  # 0 = never archive
+PARTITION_MAINTENANCE_SECONDS = float(os.getenv("PARTITION_MAINTENANCE_SECONDS", "3600"))
+ARCHIVE_READ_BATCH = 10_000
+
+if MESSAGE_PARTITIONING not in ("off", "monthly"):
+    raise RuntimeError(f"Unsupported MESSAGE_PARTITIONING: {MESSAGE_PARTITIONING}")
+
+# Only one worker runs maintenance at a time
+_ADVISORY_LOCK = 0x63686174
+
+PARTITIONED_MODELS = (PrivateMessage, GroupMessage)
+_PARTITION_NAME = re.compile(r"_p(\d{4})_(\d{2})$")
+
+
+def month_start(ts: datetime) -> datetime:
+    ts = ts.astimezone(timezone.utc) if ts.tzinfo else ts.replace(tzinfo=timezone.utc)
+    return ts.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+
+
+def add_months(month: datetime, n: int) -> datetime:
+    index = month.year * 12 + month.month - 1 + n
+    return month.replace(year=index // 12, month=index % 12 + 1)
+
+
+def partition_name(table_name: str, month: datetime) -> str:
+    return f"{table_name}_p{month:%Y_%m}"
+
+
+def _room(model, columns):
+    if model is PrivateMessage:
+        return columns.conversation_key
+    return literal("group:") + cast(columns.group_id, String)
+
+
+def is_partitioned(conn: Connection, table_name: str) -> bool:
+    return conn.execute(text(
+        "SELECT 1 FROM pg_partitioned_table pt JOIN pg_class c ON c.oid = pt.partrelid "
+        "WHERE c.relname = :name AND c.relnamespace = current_schema()::regnamespace"
+    ), {"name": table_name}).first() is not None
+
+
+def monthly_partitions(conn: Connection, table_name: str) -> dict[datetime, str]:
+    names = conn.execute(text(
+        "SELECT c.relname FROM pg_inherits i "
+        "JOIN pg_class c ON c.oid = i.inhrelid JOIN pg_class p ON p.oid = i.inhparent "
+        "WHERE p.relname = :name AND p.relnamespace = current_schema()::regnamespace"
+    ), {"name": table_name}).scalars()
+    partitions = {}
+    for name in names:
+        match = _PARTITION_NAME.search(name)
+        if match:
+            partitions[datetime(int(match[1]), int(match[2]), 1, tzinfo=timezone.utc)] = name
+    return partitions
+
+
+def create_partition(conn: Connection, table_name: str, month: datetime) -> None:
+    conn.execute(text(
+        f"CREATE TABLE IF NOT EXISTS {partition_name(table_name, month)} PARTITION OF {table_name} "
+        f"FOR VALUES FROM ('{month.isoformat()}') TO ('{add_months(month, 1).isoformat()}')"
+    ))
+
+
+def convert_table(conn: Connection, model, now: datetime) -> None:
+    """Swap a plain message table for a partitioned one holding the same rows."""
+    name = model.__tablename__
+    legacy = f"{name}_unpartitioned"
+    sequence = conn.execute(text("SELECT pg_get_serial_sequence(:t, 'id')"), {"t": name}).scalar_one()
+    oldest = conn.execute(select(func.min(model.created_at))).scalar_one()
+
+    conn.execute(text(f"ALTER TABLE {name} RENAME TO {legacy}"))
+    conn.execute(text(f"ALTER TABLE {legacy} RENAME CONSTRAINT {name}_pkey TO {legacy}_pkey"))
+    conn.execute(text(
+        f"CREATE TABLE {name} (LIKE {legacy} INCLUDING DEFAULTS INCLUDING CONSTRAINTS) "
+        "PARTITION BY RANGE (created_at)"
+    ))
+    conn.execute(text(f"ALTER TABLE {name} ADD CONSTRAINT {name}_pkey PRIMARY KEY (id, created_at)"))
+    for constraint in model.__table__.foreign_key_constraints:
+        conn.execute(AddConstraint(constraint))
+    if sequence:
+        conn.execute(text(f"ALTER SEQUENCE {sequence} OWNED BY {name}.id"))
+
+    month = month_start(oldest or now)
+    while month <= add_months(month_start(now), PARTITION_MONTHS_AHEAD):
+        create_partition(conn, name, month)
+        month = add_months(month, 1)
+    conn.execute(text(f"CREATE TABLE IF NOT EXISTS {name}_pdefault PARTITION OF {name} DEFAULT"))
+
+    conn.execute(text(f"INSERT INTO {name} SELECT * FROM {legacy}"))
+    conn.execute(text(f"DROP TABLE {legacy}"))
+    # Indexes on the parent cascade to every partition, current and future
+    for index in model.__table__.indexes:
+        index.create(conn)
+    logger.info("Converted %s to monthly partitions", name)
+
+
+async def archive_partition(conn: AsyncConnection, model, month: datetime, partition: str) -> int:
+    """Export one month to the archive, then drop its partition.
+
+    Rows are streamed from the database on the event loop; compressing and
+    writing them happens in a worker thread so the loop keeps serving.
+    """
+    columns = [c.name for c in model.__table__.columns]
+    source = table(partition, *(column(name) for name in columns))
+    room = _room(model, source.c).label("room")
+    query = select(room, *source.c).order_by(room, source.c.created_at, source.c.id)
+    writer = await asyncio.to_thread(ArchiveWriter, model.__tablename__, month.replace(tzinfo=None), columns)
+    try:
+        result = await conn.stream(query)
+        async for rows in result.partitions(ARCHIVE_READ_BATCH):
+            await asyncio.to_thread(writer.write, [(row[0], tuple(row[1:])) for row in rows])
+    except BaseException:
+        await asyncio.to_thread(writer.abort)
+        raise
+    written = await asyncio.to_thread(writer.close)
+
+    stored = (await conn.execute(select(func.count()).select_from(source))).scalar_one()
+    if written != stored:
+        raise RuntimeError(f"Archive of {partition} has {written} rows, the partition {stored}")
+    await conn.execute(insert(MessageArchive).values(
+        table_name=model.__tablename__, month=f"{month:%Y-%m}", rows=written, archived_at=datetime.now(timezone.utc),
+    ))
+    await conn.execute(text(f"ALTER TABLE {model.__tablename__} DETACH PARTITION {partition}"))
+    await conn.execute(text(f"DROP TABLE {partition}"))
+    await conn.commit()
+    logger.info("Archived %s (%d rows)", partition, written)
+    return written
+
+
+async def maintain(conn: AsyncConnection, now: Optional[datetime] = None, convert: bool = False) -> dict:
+    """Extend and archive the message tables (converting them first only with
+    `convert`, the CLI); returns what was done."""
+    now = now or datetime.now(timezone.utc)
+    report = {"converted": [], "created": [], "archived": []}
+    if conn.dialect.name != "postgresql":
+        logger.warning("Message partitioning needs Postgres; skipping maintenance")
+        return report
+    if not (await conn.execute(text("SELECT pg_try_advisory_lock(:id)"), {"id": _ADVISORY_LOCK})).scalar_one():
+        return report
+    try:
+        current = month_start(now)
+        for model in PARTITIONED_MODELS:
+            name = model.__tablename__
+            if not await conn.run_sync(is_partitioned, name):
+                if not convert:
+                    logger.error("%s is not partitioned yet; run `python -m core.partitions` first", name)
+                    continue
+                await conn.run_sync(convert_table, model, now)
+                await conn.commit()
+                report["converted"].append(name)
+
+            existing = await conn.run_sync(monthly_partitions, name)
+            for n in range(PARTITION_MONTHS_AHEAD + 1):
+                month = add_months(current, n)
+                if month not in existing:
+                    await conn.run_sync(create_partition, name, month)
+                    report["created"].append(partition_name(name, month))
+            await conn.commit()
+
+            if ARCHIVE_AFTER_MONTHS > 0:
+                horizon = add_months(current, -ARCHIVE_AFTER_MONTHS)
+                for month, partition in sorted(existing.items()):
+                    if add_months(month, 1) <= horizon:
+                        await archive_partition(conn, model, month, partition)
+                        report["archived"].append(partition)
+    finally:
+        # After a failure the transaction is aborted and would refuse the
+        # unlock, and a rollback alone doesn't release a session lock
+        await conn.rollback()
+        await conn.execute(text("SELECT pg_advisory_unlock(:id)"), {"id": _ADVISORY_LOCK})
+        await conn.commit()
+    return report
+
+
+async def check_archive_storage() -> None:
+    """Fail if an archived month is missing from this host's ARCHIVE_DIR,
+    i.e. the directory is not the storage the archiving worker wrote to."""
+    async with engine.connect() as conn:
+        archived = (await conn.execute(select(MessageArchive.table_name, MessageArchive.month))).all()
+    missing = [
+        f"{name}/{month}" for name, month in archived
+        if not archive_paths(name, datetime.strptime(month, "%Y-%m"))[1].exists()
+    ]
+    if missing:
+        raise RuntimeError(
+            f"Archived months missing from ARCHIVE_DIR: {', '.join(missing)}. "
+            "ARCHIVE_DIR must be storage shared by every host."
+        )
+
+
+class PartitionMaintainer:
+    def __init__(self, interval: float):
+        self.interval = interval
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self) -> None:
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    async def run_once(self, convert: bool = False) -> dict:
+        async with engine.connect() as conn:
+            return await maintain(conn, convert=convert)
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                report = await self.run_once()
+                if any(report.values()):
+                    logger.info("Partition maintenance: %s", report)
+            except Exception:
+                logger.exception("Partition maintenance failed")
+            await asyncio.sleep(self.interval)
+
+
+partition_maintainer = PartitionMaintainer(PARTITION_MAINTENANCE_SECONDS)
+
+
+async def main() -> None:
+    print(await partition_maintainer.run_once(convert=True))
+    await engine.dispose()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
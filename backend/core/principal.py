@@ -0,0 +1,166 @@
+import asyncio
+import logging
+import os
+import time
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+
+from jose import JWTError
+from sqlalchemy import select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from core.cache import TTLCache
+from core.metrics import registry
+from core.security import ACCESS_TOKEN_EXPIRE_MINUTES, decode_access_claims
+from database import AsyncSessionLocal
+from models import User
+
+# "stateless": trust the identity claims signed into the token and skip the DB
+#              (revocations, including deactivation, are still honoured).
+# "db": always resolve the user through the cache/DB (picks up renames sooner).
+AUTH_MODE = os.getenv("AUTH_MODE", "db")
+USER_CACHE_SIZE = int(os.getenv("USER_CACHE_SIZE", "50000"))
+USER_CACHE_TTL = float(os.getenv("USER_CACHE_TTL", "30"))
+REVOCATION_REFRESH_SECONDS = float(os.getenv("REVOCATION_REFRESH_SECONDS", "5"))
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True, slots=True)
+class Principal:
+    id: int
+    username: str
+
+
+user_cache = TTLCache(USER_CACHE_SIZE, USER_CACHE_TTL)
+
+auth_decode_latency = registry.histogram("auth_token_decode_seconds", "JWT decode and verify time")
+auth_lookup_latency = registry.histogram("auth_user_lookup_seconds", "User lookup time on cache miss")
+auth_resolutions = registry.counter("auth_resolutions_total", "Principal resolutions by source", ("source",))
+
+
+def token_claims(user: User) -> dict:
+    return {"username": user.username}
+
+
+class RevocationList:
+    """user id -> time at or before which the user's tokens are rejected.
+
+    Mirrors users.tokens_valid_after for the last token lifetime, which is
+    all that can still reject anything. A plain dict, so an entry is never
+    evicted before the tokens it covers have expired; other workers' writes
+    arrive with the periodic refresh.
+    """
+
+    def __init__(self, lifetime: float, refresh_interval: float):
+        self.lifetime = lifetime
+        self.refresh_interval = refresh_interval
+        self.entries: dict[int, float] = {}
+        self._task: Optional[asyncio.Task] = None
+
+    def revoke(self, user_id: int, at: float) -> None:
+        self.entries[user_id] = max(at, self.entries.get(user_id, 0.0))
+        user_cache.pop(user_id)
+
+    def is_revoked(self, user_id: int, issued_at: float) -> bool:
+        revoked_at = self.entries.get(user_id)
+        return revoked_at is not None and issued_at <= revoked_at
+
+    def prune(self, now: float) -> None:
+        cutoff = now - self.lifetime
+        self.entries = {user_id: at for user_id, at in self.entries.items() if at > cutoff}
+
+    async def refresh(self) -> None:
+        cutoff = datetime.now(timezone.utc) - timedelta(seconds=self.lifetime)
+        async with AsyncSessionLocal() as db:
+            result = await db.execute(
+                select(User.id, User.tokens_valid_after).where(User.tokens_valid_after > cutoff)
+            )
+            rows = result.all()
+        for user_id, at in rows:
+            if at.tzinfo is None:
+                at = at.replace(tzinfo=timezone.utc)  # SQLite returns naive UTC
+            if self.entries.get(user_id, 0.0) < at.timestamp():
+                self.revoke(user_id, at.timestamp())
+        self.prune(time.time())
+
+    def start(self) -> None:
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    async def _run(self) -> None:
+        # The lifespan does the first refresh before serving
+        while True:
+            await asyncio.sleep(self.refresh_interval)
+            try:
+                await self.refresh()
+            except Exception:
+                logger.exception("Token revocation refresh failed")
+
+
+revocations = RevocationList(ACCESS_TOKEN_EXPIRE_MINUTES * 60, REVOCATION_REFRESH_SECONDS)
+
+
+async def revoke_user(db: AsyncSession, user_id: int, deactivate: bool = False) -> None:
+    """Reject every token issued to the user so far, optionally deactivating
+    the account too, and commit."""
+    now = datetime.now(timezone.utc)
+    values = {"tokens_valid_after": now}
+    if deactivate:
+        values["is_active"] = False
+    await db.execute(update(User).where(User.id == user_id).values(**values))
+    await db.commit()
+    revocations.revoke(user_id, now.timestamp())
+
+
+async def resolve_principal(token: str) -> Optional[Principal]:
+    start = time.perf_counter()
+    try:
+        claims = decode_access_claims(token)
+        user_id = int(claims["sub"])
+    except (JWTError, ValueError):
+        auth_resolutions.labels("invalid").inc()
+        return None
+    finally:
+        auth_decode_latency.observe(time.perf_counter() - start)
+
+    # Stateless mode relies on this too: deactivation revokes every token
+    issued_at = claims.get("iat", claims["exp"] - revocations.lifetime)
+    if revocations.is_revoked(user_id, issued_at):
+        auth_resolutions.labels("revoked").inc()
+        return None
+
+    if AUTH_MODE == "stateless" and "username" in claims:
+        auth_resolutions.labels("token").inc()
+        return Principal(id=user_id, username=claims["username"])
+
+    principal = user_cache.get(user_id)
+    if principal is not None:
+        auth_resolutions.labels("cache").inc()
+        return principal
+
+    start = time.perf_counter()
+    async with AsyncSessionLocal() as db:
+        result = await db.execute(
+            select(User.id, User.username, User.is_active).where(User.id == user_id)
+        )
+        row = result.one_or_none()
+    auth_lookup_latency.observe(time.perf_counter() - start)
+    auth_resolutions.labels("db").inc()
+
+    if row is None or row.is_active is False:
+        return None
+
+    principal = Principal(id=row.id, username=row.username)
+    user_cache.set(user_id, principal)
+    return principal
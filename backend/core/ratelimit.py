@@ -0,0 +1,161 @@
+import asyncio
+import os
+import time
+from collections import Counter
+from typing import Optional
+
+# Token buckets as "rate/burst": refill `rate` tokens per second up to `burst`
+DEFAULT_POLICIES = {
+    "message:user": "5/20",  # message sends per user
+    "message:room": "50/200",  # message sends into one room, all senders
+    "message:ip": "20/60",
+    "batch:user": "1/5",  # POST /messages/batch calls per user
+    "message:batch": "50/500",  # messages inside batch calls per user; burst is the largest batch
+    "search:user": "2/10",  # GET /search calls per user
+    "members:user": "2/10",  # bulk group membership changes per user
+    "auth:ip": "2/10",  # login/register attempts (argon2 is expensive)
+    "socket:user": "20/60",  # subscribe-style socket events
+    "socket:connect": "5/20",  # socket connects per ip
+}
+# "memory" (per worker) or a redis:// URL to share buckets between workers
+RATE_LIMIT_BACKEND = os.getenv("RATE_LIMIT_BACKEND", "memory")
+# Memory: how often refilled buckets are swept. Redis: TTL of idle keys
+RATE_LIMIT_IDLE_SECONDS = float(os.getenv("RATE_LIMIT_IDLE_SECONDS", "300"))
+
+
+def _parse(spec: str) -> tuple[float, float]:
+    rate, burst = spec.split("/")
+    return float(rate), float(burst)
+
+
+def load_policies() -> dict[str, tuple[float, float]]:
+    # RATE_LIMIT_MESSAGE_USER=10/30 overrides "message:user", and so on
+    return {
+        name: _parse(os.getenv("RATE_LIMIT_" + name.replace(":", "_").upper(), spec))
+        for name, spec in DEFAULT_POLICIES.items()
+    }
+
+
+class MemoryBuckets:
+    def __init__(self, idle_seconds: float):
+        self.idle_seconds = idle_seconds
+        # key -> [tokens, last refill, time by which it has surely refilled]
+        self._buckets: dict[str, list[float]] = {}
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self) -> None:
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    async def take(self, key: str, rate: float, burst: float, cost: float) -> float:
+        """Take `cost` tokens; returns 0 on success, else seconds until it would succeed."""
+        now = time.monotonic()
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = [burst, now, now]
+        else:
+            bucket[0] = min(burst, bucket[0] + (now - bucket[1]) * rate)
+            bucket[1] = now
+        bucket[2] = now + burst / rate
+
+        if bucket[0] >= cost:
+            bucket[0] -= cost
+            return 0.0
+        return (cost - bucket[0]) / rate
+
+    def _cleanup(self, now: float) -> None:
+        # A bucket that has refilled completely is the same as no bucket
+        self._buckets = {k: b for k, b in self._buckets.items() if b[2] > now}
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.idle_seconds)
+            self._cleanup(time.monotonic())
+
+    def __len__(self) -> int:
+        return len(self._buckets)
+
+
+_TAKE_SCRIPT = """
+local rate, burst, cost, now = tonumber(ARGV[1]), tonumber(ARGV[2]), tonumber(ARGV[3]), tonumber(ARGV[4])
+local b = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(b[1]) or burst
+local ts = tonumber(b[2]) or now
+tokens = math.min(burst, tokens + (now - ts) * rate)
+local wait = 0
+if tokens >= cost then tokens = tokens - cost else wait = (cost - tokens) / rate end
+redis.call('HSET', KEYS[1], 'tokens', tokens, 'ts', now)
+redis.call('EXPIRE', KEYS[1], ARGV[5])
+return tostring(wait)
+"""
+
+
+class RedisBuckets:
+    def __init__(self, url: str, idle_seconds: float):
+        import redis.asyncio as redis
+
+        self.idle_seconds = idle_seconds
+        self._redis = redis.from_url(url)
+        self._script = self._redis.register_script(_TAKE_SCRIPT)
+
+    async def take(self, key: str, rate: float, burst: float, cost: float) -> float:
+        wait = await self._script(
+            keys=[f"ratelimit:{key}"], args=[rate, burst, cost, time.time(), int(self.idle_seconds)]
+        )
+        return float(wait)
+
+    def start(self) -> None:
+        pass  # idle keys expire in Redis
+
+    async def stop(self) -> None:
+        pass
+
+    def __len__(self) -> int:
+        return 0  # not tracked locally
+
+
+class RateLimiter:
+    def __init__(self, backend, policies: dict[str, tuple[float, float]]):
+        self.backend = backend
+        self.policies = policies
+        self.allowed = Counter()
+        self.rejected = Counter()
+
+    def start(self) -> None:
+        self.backend.start()
+
+    async def stop(self) -> None:
+        await self.backend.stop()
+
+    async def check(self, policy: str, key, cost: float = 1.0) -> float:
+        """0 if allowed, otherwise the suggested retry delay in seconds."""
+        rate, burst = self.policies[policy]
+        wait = await self.backend.take(f"{policy}:{key}", rate, burst, cost)
+        (self.rejected if wait else self.allowed)[policy] += 1
+        return wait
+
+    def stats(self) -> dict:
+        return {
+            "backend": type(self.backend).__name__,
+            "buckets": len(self.backend),
+            "allowed": dict(self.allowed),
+            "rejected": dict(self.rejected),
+        }
+
+
+def _create_backend():
+    if RATE_LIMIT_BACKEND.startswith(("redis://", "rediss://")):
+        return RedisBuckets(RATE_LIMIT_BACKEND, RATE_LIMIT_IDLE_SECONDS)
+    return MemoryBuckets(RATE_LIMIT_IDLE_SECONDS)
+
+
+rate_limiter = RateLimiter(_create_backend(), load_policies())
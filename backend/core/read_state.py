@@ -0,0 +1,139 @@
+import os
+from datetime import datetime, timezone
+
+from sqlalchemy import and_, case, func, select, tuple_, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import aliased
+
+from database import dialect_insert
+from models import ReadCursor
+
+# Unread counts after a partial read are recounted, but never past this many
+UNREAD_COUNT_CAP = int(os.getenv("UNREAD_COUNT_CAP", "999"))
+
+_cursors = ReadCursor.__table__
+_EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+
+async def record_messages(db: AsyncSession, room: str, messages: list) -> list[tuple[int, int]]:
+    """Update the room's read cursors for new `messages` (rows of one room,
+    oldest first) in the caller's transaction.
+
+    DMs: each sender's cursor moves to their last message and counts only
+    what came after it, the other person's unread counter grows by
+    len(messages), and both cursors' last_message_id / last_activity_at point
+    at the newest message. The first message creates the cursors.
+
+    Groups: only the senders' cursors move (never backwards). Other members'
+    rows are not written, so a send costs the same in any group size; their
+    unread counts and newest message are derived when read (unread_after).
+
+    Returns [(user_id, unread_count)] of the cursors that now have something
+    unread (DMs only).
+    """
+    last = messages[-1]
+    # sender -> (their last message id, messages after it)
+    senders = {message.sender_id: (message.id, len(messages) - i - 1) for i, message in enumerate(messages)}
+
+    if not room.startswith("dm:"):
+        await db.execute(
+            update(_cursors)
+            .where(_cursors.c.conversation_key == room, _cursors.c.user_id.in_(senders))
+            .values(last_read_message_id=case(
+                *[(and_(_cursors.c.user_id == user_id, _cursors.c.last_read_message_id < read_id), read_id)
+                  for user_id, (read_id, _) in senders.items()],
+                else_=_cursors.c.last_read_message_id,
+            ))
+        )
+        return []
+
+    values = []
+    # Rows in user_id order, so two people sending at once lock them in the
+    # same order instead of deadlocking
+    for user_id in sorted((last.sender_id, last.receiver_id)):
+        read_id, unread = senders.get(user_id, (0, len(messages)))
+        values.append({
+            "user_id": user_id, "conversation_key": room, "last_read_message_id": read_id,
+            "unread_count": unread, "last_message_id": last.id, "last_activity_at": last.created_at,
+        })
+    insert = dialect_insert(db)
+    stmt = insert(_cursors).values(values)
+    sent = stmt.excluded.last_read_message_id > 0
+    # Concurrent sends may commit out of order; the newest message wins
+    newer = last.id > func.coalesce(_cursors.c.last_message_id, 0)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[_cursors.c.user_id, _cursors.c.conversation_key],
+        set_={
+            "unread_count": case(
+                (sent, stmt.excluded.unread_count), else_=_cursors.c.unread_count + stmt.excluded.unread_count
+            ),
+            "last_read_message_id": case(
+                (stmt.excluded.last_read_message_id > _cursors.c.last_read_message_id,
+                 stmt.excluded.last_read_message_id),
+                else_=_cursors.c.last_read_message_id,
+            ),
+            "last_message_id": case((newer, last.id), else_=_cursors.c.last_message_id),
+            "last_activity_at": case((newer, last.created_at), else_=_cursors.c.last_activity_at),
+        },
+    )
+
+    result = await db.execute(stmt.returning(_cursors.c.user_id, _cursors.c.unread_count))
+    return [(user_id, unread) for user_id, unread in result.all() if unread]
+
+
+def unread_after(model, in_room, read_id):
+    """Count of `in_room` messages after message `read_id` (0: none read),
+    capped at UNREAD_COUNT_CAP, correlated with a ReadCursor row of the
+    enclosing query; one range scan of the room index."""
+    read = aliased(model)
+    read_at = select(read.created_at).where(read.id == read_id).correlate(ReadCursor).scalar_subquery()
+    newer = (
+        select(model.id)
+        .where(in_room, tuple_(model.created_at, model.id) > tuple_(func.coalesce(read_at, _EPOCH), read_id))
+        .correlate(ReadCursor)
+        .limit(UNREAD_COUNT_CAP)
+        .subquery()
+    )
+    return select(func.count()).select_from(newer).correlate(ReadCursor).scalar_subquery()
+
+
+async def mark_read(db: AsyncSession, user_id: int, room: str, model, in_room, message_id: int):
+    """Move the user's cursor up to `message_id` (never backwards) and commit.
+
+    `in_room` is the clause selecting the conversation's rows of `model`.
+    Returns the cursor row, or None if the message is not part of the conversation.
+    """
+    message = (
+        await db.execute(select(model.id, model.created_at).where(model.id == message_id, in_room))
+    ).one_or_none()
+    if message is None:
+        return None
+
+    newer = (
+        select(model.id)
+        .where(in_room, tuple_(model.created_at, model.id) > tuple_(message.created_at, message.id))
+        .limit(UNREAD_COUNT_CAP)
+        .subquery()
+    )
+    unread = (await db.execute(select(func.count()).select_from(newer))).scalar_one()
+
+    insert = dialect_insert(db)
+    stmt = insert(_cursors).values(
+        user_id=user_id,
+        conversation_key=room,
+        last_read_message_id=message_id,
+        unread_count=unread,
+        updated_at=datetime.now(timezone.utc),
+    )
+    advances = stmt.excluded.last_read_message_id >= _cursors.c.last_read_message_id
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[_cursors.c.user_id, _cursors.c.conversation_key],
+        set_={
+            "last_read_message_id": case((advances, stmt.excluded.last_read_message_id), else_=_cursors.c.last_read_message_id),
+            "unread_count": case((advances, stmt.excluded.unread_count), else_=_cursors.c.unread_count),
+            "updated_at": case((advances, stmt.excluded.updated_at), else_=_cursors.c.updated_at),
+        },
+    ).returning(_cursors.c.conversation_key, _cursors.c.last_read_message_id, _cursors.c.unread_count)
+    cursor = (await db.execute(stmt)).one()
+    await db.commit()
+    return cursor
@@ -0,0 +1,195 @@
+import os
+import time
+from collections import OrderedDict, deque
+from datetime import datetime
+from typing import Callable, Optional
+
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from core.archive import archived_page, archived_room
+from core.pagination import decode_cursor, encode_cursor, keyset_page, split_page
+from core.serialization import page_json
+
+ROOM_CACHE_SIZE = int(os.getenv("ROOM_CACHE_SIZE", "100"))  # messages kept per room
+ROOM_CACHE_BUDGET_BYTES = int(os.getenv("ROOM_CACHE_BUDGET_BYTES", str(64 * 1024 * 1024)))
+# Messages sent through other workers arrive via pub/sub (realtime.pubsub);
+# re-reading each room this often bounds staleness if a notification is lost
+ROOM_CACHE_TTL_SECONDS = float(os.getenv("ROOM_CACHE_TTL_SECONDS", "300"))
+
+# (created_at, id, encoded message)
+Entry = tuple[datetime, int, bytes]
+
+
+class _Room:
+    __slots__ = ("entries", "complete", "size", "expires")
+
+    def __init__(self, entries: deque, complete: bool, expires: float):
+        self.entries = entries  # oldest -> newest
+        self.complete = complete  # True when the room has no older messages than these
+        self.size = sum(len(e[2]) for e in entries)
+        self.expires = expires
+
+
+def _page(entries, complete: bool, limit: int) -> tuple[list[bytes], Optional[str]]:
+    newest = [entries[-i] for i in range(1, min(limit, len(entries)) + 1)]
+    more = len(entries) > limit or not complete
+    next_cursor = encode_cursor(newest[-1][0], newest[-1][1]) if more and newest else None
+    return [e[2] for e in newest], next_cursor
+
+
+class RecentMessageCache:
+    """Ring buffer of the newest encoded messages per room, LRU-evicted under a byte budget."""
+
+    def __init__(self, per_room: int, budget_bytes: int, ttl: float):
+        self.per_room = per_room
+        self.budget_bytes = budget_bytes
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.size = 0
+        self._rooms: OrderedDict[str, _Room] = OrderedDict()
+        # room -> [warmers in flight, appends seen while warming]
+        self._warming: dict[str, list[int]] = {}
+
+    def _get(self, room: str) -> Optional[_Room]:
+        cached = self._rooms.get(room)
+        if cached is not None and cached.expires <= time.monotonic():
+            del self._rooms[room]
+            self.size -= cached.size
+            return None
+        return cached
+
+    def get_page(self, room: str, limit: int) -> Optional[tuple[list[bytes], Optional[str]]]:
+        cached = self._get(room)
+        if cached is None or (limit > len(cached.entries) and not cached.complete):
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._rooms.move_to_end(room)
+        return _page(cached.entries, cached.complete, limit)
+
+    def entries_after(self, room: str, message_id: int) -> Optional[list[Entry]]:
+        """Messages newer than `message_id`, or None if the buffer may not cover the gap."""
+        cached = self._get(room)
+        if cached is None or not cached.entries:
+            return None
+        if not cached.complete and cached.entries[0][1] > message_id:
+            return None
+        self._rooms.move_to_end(room)
+        return [entry for entry in cached.entries if entry[1] > message_id]
+
+    def append(self, room: str, created_at: datetime, message_id: int, body: bytes) -> None:
+        cached = self._rooms.get(room)
+        if cached is None:
+            # Cold room: nothing to update, but a concurrent warm-up may have
+            # read the table before this row committed
+            if room in self._warming:
+                self._warming[room][1] += 1
+            return
+
+        entries = cached.entries
+        position = len(entries)
+        while position and (entries[position - 1][0], entries[position - 1][1]) > (created_at, message_id):
+            position -= 1
+        if position and entries[position - 1][1] == message_id:
+            return  # already read by the warm-up, or delivered twice
+        entries.insert(position, (created_at, message_id, body))
+        cached.size += len(body)
+        self.size += len(body)
+
+        while len(entries) > self.per_room:
+            dropped = entries.popleft()
+            cached.size -= len(dropped[2])
+            self.size -= len(dropped[2])
+            cached.complete = False
+        self._rooms.move_to_end(room)
+        self._evict()
+
+    def begin_warm(self, room: str) -> int:
+        state = self._warming.setdefault(room, [0, 0])
+        state[0] += 1
+        return state[1]
+
+    def finish_warm(self, room: str, token: int, entries: list[Entry], complete: bool) -> None:
+        state = self._warming[room]
+        state[0] -= 1
+        if state[0] == 0:
+            del self._warming[room]
+        if state[1] != token or room in self._rooms:
+            return  # raced with a write or another warm-up; next read retries
+
+        cached = _Room(deque(entries), complete, time.monotonic() + self.ttl)
+        self._rooms[room] = cached
+        self.size += cached.size
+        self._evict()
+
+    def _evict(self) -> None:
+        while self.size > self.budget_bytes and self._rooms:
+            _, cached = self._rooms.popitem(last=False)
+            self.size -= cached.size
+            self.evictions += 1
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "rooms": len(self._rooms),
+            "bytes": self.size,
+            "budget_bytes": self.budget_bytes,
+            "evictions": self.evictions,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+        }
+
+
+recent_messages = RecentMessageCache(ROOM_CACHE_SIZE, ROOM_CACHE_BUDGET_BYTES, ROOM_CACHE_TTL_SECONDS)
+
+
+async def history_page(
+    db: AsyncSession,
+    room: str,
+    query,
+    model,
+    encode: Callable[..., bytes],
+    limit: int,
+    before: Optional[str] = None,
+    after: Optional[str] = None,
+) -> bytes:
+    """Encoded history page; newest-page reads come from recent_messages."""
+    if before or after or limit > recent_messages.per_room:
+        result = await db.execute(keyset_page(query, model, limit, before, after))
+        rows = await _with_archive(model.__tablename__, room, result.all(), limit + 1, before, after)
+        rows, next_cursor = split_page(rows, limit)
+        return page_json([encode(row) for row in rows], next_cursor)
+
+    page = recent_messages.get_page(room, limit)
+    if page is None:
+        token = recent_messages.begin_warm(room)
+        try:
+            result = await db.execute(
+                query.order_by(model.created_at.desc(), model.id.desc()).limit(recent_messages.per_room)
+            )
+            rows = result.all()
+            complete = len(rows) < recent_messages.per_room and not await archived_room(model.__tablename__, room)
+        except BaseException:
+            recent_messages.finish_warm(room, -1, [], False)
+            raise
+        entries = [(row.created_at, row.id, encode(row)) for row in reversed(rows)]
+        recent_messages.finish_warm(room, token, entries, complete)
+        page = _page(entries, complete, limit)
+
+    return page_json(*page)
+
+
+async def _with_archive(table: str, room: str, rows: list, wanted: int, before: Optional[str], after: Optional[str]) -> list:
+    # Archived months are all older than the oldest stored message: they
+    # continue a backwards page that ran out of rows, and come first in a
+    # forwards page that starts before the archive horizon.
+    if after:
+        archived = await archived_page(table, room, wanted, after=decode_cursor(after))
+        return (archived + rows)[:wanted]
+    if len(rows) < wanted:
+        anchor = (rows[-1].created_at, rows[-1].id) if rows else (decode_cursor(before) if before else None)
+        rows = rows + await archived_page(table, room, wanted - len(rows), before=anchor)
+    return rows
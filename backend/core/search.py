@@ -0,0 +1,245 @@
+import asyncio
+import heapq
+import logging
+import math
+import os
+import re
+import time
+from collections import Counter
+from typing import Iterable, Optional
+
+from fastapi import HTTPException
+from sqlalchemy import String, cast, func, literal, literal_column, or_, select, tuple_, union_all
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from core.membership import user_group_ids
+from core.metrics import registry
+from database import AsyncSessionLocal, engine
+from models import GroupMember, GroupMessage, PrivateMessage, content_tsvector
+
+logger = logging.getLogger(__name__)
+
+# postgres -> tsvector/GIN indexes on the message tables (see models.py)
+# memory   -> in-process inverted index, loaded in the background at startup
+#             (searches get 503 until it is ready) and updated as messages are
+#             created. It only sees messages written through this worker, so
+#             it is for SQLite, tests and single-process setups: startup
+#             refuses it when SIO_MESSAGE_QUEUE (multiple workers) is set.
+# auto     -> postgres when the database is Postgres, memory otherwise
+SEARCH_BACKEND = os.getenv("SEARCH_BACKEND", "auto")
+MAX_SEARCH_RESULTS = 50
+REBUILD_BATCH_SIZE = 10_000
+
+if SEARCH_BACKEND not in ("auto", "postgres", "memory"):
+    raise RuntimeError(f"Unsupported SEARCH_BACKEND: {SEARCH_BACKEND}")
+
+_TOKEN = re.compile(r"\w+")
+
+search_latency = registry.histogram("search_duration_seconds", "Search query latency", ("backend",))
+indexed_documents = registry.gauge("search_index_documents", "Messages in the in-process search index")
+
+
+def tokenize(text: str) -> list[str]:
+    return _TOKEN.findall(text.lower())
+
+
+def active_backend() -> str:
+    if SEARCH_BACKEND == "auto":
+        return "postgres" if engine.dialect.name == "postgresql" else "memory"
+    return SEARCH_BACKEND
+
+
+# A hit is (rank, kind, id); kind is "dm" or "group". Results are ordered by
+# that tuple descending, which is also the keyset for the next page.
+Hit = tuple[float, str, int]
+
+
+class InvertedIndex:
+    """Postings are grouped by room, so a query only walks the caller's
+    conversations instead of every message containing the term."""
+
+    def __init__(self):
+        # term -> room -> {(kind, message id): term frequency}
+        self.postings: dict[str, dict[str, dict[tuple[str, int], int]]] = {}
+        self.doc_freq: dict[str, int] = {}
+        self.documents: set[tuple[str, int]] = set()
+        # user id -> DM rooms they take part in (group rooms come from memberships)
+        self.dm_rooms: dict[int, set[str]] = {}
+        self.ready = False  # set once stored history has been loaded
+
+    def __len__(self) -> int:
+        return len(self.documents)
+
+    def add(self, kind: str, message_id: int, room: str, content: str) -> None:
+        doc = (kind, message_id)
+        if doc in self.documents:
+            return
+        self.documents.add(doc)
+        if kind == "dm":
+            for user_id in room.split(":")[1:]:
+                self.dm_rooms.setdefault(int(user_id), set()).add(room)
+        for term, tf in Counter(tokenize(content)).items():
+            self.postings.setdefault(term, {}).setdefault(room, {})[doc] = tf
+            self.doc_freq[term] = self.doc_freq.get(term, 0) + 1
+
+    def clear(self) -> None:
+        self.postings.clear()
+        self.doc_freq.clear()
+        self.documents.clear()
+        self.dm_rooms.clear()
+        self.ready = False
+
+    def search(self, terms: list[str], rooms: Iterable[str], limit: int, after: Optional[Hit] = None) -> list[Hit]:
+        """Documents in `rooms` containing every term, best first (tf-idf)."""
+        terms = sorted(set(terms), key=lambda term: self.doc_freq.get(term, 0))
+        if not terms or not self.doc_freq.get(terms[0]):
+            return []
+        n = len(self.documents)
+        weights = [math.log(1 + n / self.doc_freq[term]) for term in terms]
+        by_term = [self.postings[term] for term in terms]
+
+        hits = []
+        for room in rooms:
+            postings = [p.get(room) for p in by_term]
+            if not all(postings):
+                continue
+            # walk the rarest term, probe the others
+            for doc in postings[0]:
+                if not all(doc in p for p in postings[1:]):
+                    continue
+                # saturating tf so a message repeating a word doesn't dominate
+                rank = sum(w * p[doc] / (p[doc] + 1.2) for w, p in zip(weights, postings))
+                hit = (round(rank, 6), *doc)
+                if after is None or hit < after:
+                    hits.append(hit)
+        return heapq.nlargest(limit, hits)
+
+
+search_index = InvertedIndex()
+
+
+def _room_kind(room: str) -> str:
+    return "dm" if room.startswith("dm:") else "group"
+
+
+def index_message(room: str, row) -> None:
+    if active_backend() == "memory":
+        search_index.add(_room_kind(room), row.id, room, row.content)
+        indexed_documents.set(len(search_index))
+
+
+async def rebuild_index(db: AsyncSession) -> None:
+    """Load every stored message into the in-process index. Messages indexed
+    meanwhile by index_message are kept; the loop yields between batches."""
+    if active_backend() != "memory":
+        return
+    sources = (
+        ("dm", select(PrivateMessage.id, PrivateMessage.conversation_key, PrivateMessage.content)),
+        ("group", select(
+            GroupMessage.id, literal("group:") + cast(GroupMessage.group_id, String), GroupMessage.content,
+        )),
+    )
+    for kind, query in sources:
+        result = await db.stream(query.execution_options(yield_per=REBUILD_BATCH_SIZE))
+        async for batch in result.partitions():
+            for message_id, room, content in batch:
+                search_index.add(kind, message_id, room, content)
+            indexed_documents.set(len(search_index))
+            await asyncio.sleep(0)
+    search_index.ready = True
+
+
+class IndexLoader:
+    """Runs rebuild_index in the background so startup doesn't wait on a
+    full history scan."""
+
+    def __init__(self):
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self) -> None:
+        if active_backend() != "memory":
+            return
+        if os.getenv("SIO_MESSAGE_QUEUE"):
+            raise RuntimeError(
+                "The memory search backend only sees one worker's messages; "
+                "use SEARCH_BACKEND=postgres when running several workers"
+            )
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    async def _run(self) -> None:
+        start = time.perf_counter()
+        try:
+            async with AsyncSessionLocal() as db:
+                await rebuild_index(db)
+        except Exception:
+            logger.exception("Search index load failed")
+            return
+        logger.info("Search index loaded: %d messages in %.1fs", len(search_index), time.perf_counter() - start)
+
+
+index_loader = IndexLoader()
+
+
+async def _search_postgres(db: AsyncSession, user_id: int, q: str, room: Optional[str], limit: int, after: Optional[Hit]) -> list[Hit]:
+    query = func.websearch_to_tsquery(literal_column("'simple'::regconfig"), q)
+
+    def ranked(model, kind: str, scope):
+        vector = content_tsvector(model.content)
+        return select(
+            func.ts_rank(vector, query).label("rank"),
+            literal(kind).label("kind"),
+            model.id.label("id"),
+        ).where(vector.op("@@")(query), scope)
+
+    parts = []
+    if room is None or room.startswith("dm:"):
+        scope = or_(PrivateMessage.sender_id == user_id, PrivateMessage.receiver_id == user_id)
+        if room is not None:
+            scope = scope & (PrivateMessage.conversation_key == room)
+        parts.append(ranked(PrivateMessage, "dm", scope))
+    if room is None or room.startswith("group:"):
+        groups = select(GroupMember.group_id).where(GroupMember.user_id == user_id)
+        scope = GroupMessage.group_id.in_(groups)
+        if room is not None:
+            scope = scope & (GroupMessage.group_id == int(room.partition(":")[2]))
+        parts.append(ranked(GroupMessage, "group", scope))
+
+    hits = union_all(*parts).subquery()
+    stmt = select(hits.c.rank, hits.c.kind, hits.c.id)
+    if after is not None:
+        stmt = stmt.where(tuple_(hits.c.rank, hits.c.kind, hits.c.id) < tuple_(*after))
+    stmt = stmt.order_by(hits.c.rank.desc(), hits.c.kind.desc(), hits.c.id.desc()).limit(limit)
+    return [tuple(row) for row in (await db.execute(stmt)).all()]
+
+
+async def _search_memory(db: AsyncSession, user_id: int, q: str, room: Optional[str], limit: int, after: Optional[Hit]) -> list[Hit]:
+    if not search_index.ready:
+        raise HTTPException(status_code=503, detail="Search index is still loading", headers={"Retry-After": "5"})
+    rooms = {f"group:{group_id}" for group_id in await user_group_ids(db, user_id)}
+    rooms |= search_index.dm_rooms.get(user_id, set())
+    if room is not None:
+        rooms &= {room}
+    return search_index.search(tokenize(q), rooms, limit, after)
+
+
+async def search_messages(
+    db: AsyncSession, user_id: int, q: str, room: Optional[str], limit: int, after: Optional[Hit] = None
+) -> list[Hit]:
+    """Messages matching `q` in the user's conversations (or just `room`)."""
+    backend = active_backend()
+    search = _search_postgres if backend == "postgres" else _search_memory
+    start = time.perf_counter()
+    try:
+        return await search(db, user_id, q, room, limit, after)
+    finally:
+        search_latency.labels(backend).observe(time.perf_counter() - start)
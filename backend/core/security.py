@@ -1,5 +1,6 @@
 from pathlib import Path
 import os
+import time
 from datetime import datetime, timedelta, timezone
 from typing import Optional
 
@@ -30,19 +31,22 @@ def hash_password(password: str) -> str:
 def verify_password(plain: str, hashed: str) -> bool:
     return pwd_context.verify(plain, hashed)
 
-def create_access_token(subject: str, expires_minutes: Optional[int] = None) -> str:
+def create_access_token(
+    subject: str, expires_minutes: Optional[int] = None, claims: Optional[dict] = None
+) -> str:
     expire = datetime.now(timezone.utc) + timedelta(
         minutes=expires_minutes or ACCESS_TOKEN_EXPIRE_MINUTES
     )
-    to_encode = {"sub": subject, "exp": expire}
+    # iat keeps sub-second precision so a login right after a logout is not
+    # mistaken for a token issued before it (see core.principal.revocations)
+    to_encode = {**(claims or {}), "sub": subject, "iat": time.time(), "exp": expire}
     return jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
 
+def decode_access_claims(token: str) -> dict:
+    payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+    if not payload.get("sub"):
+        raise JWTError("Missing subject")
+    return payload
+
 def decode_access_token(token: str) -> str:
-    try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        sub = payload.get("sub")
-        if not sub:
-            raise JWTError("Missing subject")
-        return sub
-    except JWTError as e:
-        raise e
\ No newline at end of file
+    return decode_access_claims(token)["sub"]
\ No newline at end of file
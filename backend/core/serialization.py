@@ -0,0 +1,65 @@
+import json
+from types import SimpleNamespace
+from typing import Any, Optional
+
+from pydantic_core import to_json
+
+from schemas import GroupMessageOut, PrivateMessageOut
+
+PRIVATE_MESSAGE_FIELDS = tuple(PrivateMessageOut.model_fields)
+GROUP_MESSAGE_FIELDS = tuple(GroupMessageOut.model_fields)
+
+
+class RawJSON:
+    """Already-encoded JSON that socket_json splices into a packet verbatim."""
+
+    __slots__ = ("data",)
+
+    def __init__(self, data: bytes):
+        self.data = data
+
+    def __reduce__(self):
+        return RawJSON, (self.data,)
+
+
+# Messages are encoded exactly once, straight from the ORM object or Row, and
+# the bytes are reused for the HTTP body, socket.io payloads and caches.
+def message_json(row: Any, fields: tuple[str, ...]) -> bytes:
+    return to_json({field: getattr(row, field) for field in fields})
+
+
+def private_message_json(row: Any) -> bytes:
+    return message_json(row, PRIVATE_MESSAGE_FIELDS)
+
+
+def group_message_json(row: Any) -> bytes:
+    return message_json(row, GROUP_MESSAGE_FIELDS)
+
+
+def json_array(items: list[bytes]) -> bytes:
+    return b"[" + b",".join(items) + b"]"
+
+
+def page_json(items: list[bytes], next_cursor: Optional[str]) -> bytes:
+    return b'{"items":' + json_array(items) + b',"next_cursor":' + to_json(next_cursor) + b"}"
+
+
+def _encode(obj: Any) -> str:
+    if isinstance(obj, RawJSON):
+        return obj.data.decode()
+    if isinstance(obj, dict):
+        return "{" + ",".join(json.dumps(str(k)) + ":" + _encode(v) for k, v in obj.items()) + "}"
+    if isinstance(obj, (list, tuple)):
+        return "[" + ",".join(_encode(v) for v in obj) + "]"
+    return json.dumps(obj, separators=(",", ":"))
+
+
+def encode_json(obj: Any) -> bytes:
+    return _encode(obj).encode()
+
+
+# json-module stand-in for socket.io that understands RawJSON values
+socket_json = SimpleNamespace(
+    dumps=lambda obj, **kwargs: _encode(obj),
+    loads=json.loads,
+)
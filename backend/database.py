@@ -1,14 +1,92 @@
+import logging
+import os
+import time
+
+from sqlalchemy.engine import make_url
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy.ext.declarative import declarative_base
-import os
+from sqlalchemy.pool import AsyncAdaptedQueuePool
 from dotenv import load_dotenv
 
 load_dotenv()
 
-DATABASE_URL = os.getenv("DATABASE_URL") 
+logger = logging.getLogger(__name__)
+
+
+def _env_bool(name: str, default: str) -> bool:
+    return os.getenv(name, default).lower() in ("1", "true", "yes", "on")
+
+
+DATABASE_URL = os.getenv("DATABASE_URL")
+DB_ECHO = _env_bool("DB_ECHO", "false")
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "20"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+DB_POOL_PRE_PING = _env_bool("DB_POOL_PRE_PING", "true")
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+# asyncpg prepared statement caches; set to 0 behind pgbouncer in transaction mode
+DB_STATEMENT_CACHE_SIZE = int(os.getenv("DB_STATEMENT_CACHE_SIZE", "100"))
+DB_SLOW_CHECKOUT_MS = float(os.getenv("DB_SLOW_CHECKOUT_MS", "100"))
+
+
+class PoolMetrics:
+    def __init__(self):
+        self.checkouts = 0
+        self.slow_checkouts = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    def observe_checkout(self, wait: float, pool) -> None:
+        self.checkouts += 1
+        self.wait_total += wait
+        self.wait_max = max(self.wait_max, wait)
+        if wait * 1000 >= DB_SLOW_CHECKOUT_MS:
+            self.slow_checkouts += 1
+            logger.warning(
+                "Slow DB pool checkout: %.1f ms (in use %d, overflow %d)",
+                wait * 1000, pool.checkedout(), max(0, pool.overflow()),
+            )
+
+
+pool_metrics = PoolMetrics()
+
+
+class MeteredQueuePool(AsyncAdaptedQueuePool):
+    # _do_get blocks until a connection is free (or a new one is opened), so
+    # timing it gives the checkout wait requests actually experience
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            pool_metrics.observe_checkout(time.perf_counter() - start, self)
+
+
+def _engine_options(url: str) -> dict:
+    options = {"echo": DB_ECHO, "pool_pre_ping": DB_POOL_PRE_PING}
+    parsed = make_url(url)
+    if parsed.get_backend_name() == "sqlite" and parsed.database in (None, "", ":memory:"):
+        # in-memory SQLite needs its single StaticPool connection
+        return options
+
+    options.update(
+        poolclass=MeteredQueuePool,
+        pool_size=DB_POOL_SIZE,
+        max_overflow=DB_MAX_OVERFLOW,
+        pool_timeout=DB_POOL_TIMEOUT,
+        pool_recycle=DB_POOL_RECYCLE,
+    )
+    if parsed.drivername == "postgresql+asyncpg":
+        options["connect_args"] = {
+            "prepared_statement_cache_size": DB_STATEMENT_CACHE_SIZE,
+            "statement_cache_size": DB_STATEMENT_CACHE_SIZE,
+        }
+    return options
+
+
 # Async engine
-engine = create_async_engine(DATABASE_URL, echo=True)
+engine = create_async_engine(DATABASE_URL, **_engine_options(DATABASE_URL))
 
 # Async session factory
 AsyncSessionLocal = sessionmaker(
@@ -17,10 +95,41 @@ AsyncSessionLocal = sessionmaker(
     expire_on_commit=False
 )
 
+
+def pool_stats() -> dict:
+    pool = engine.pool
+    stats = {
+        "pool": type(pool).__name__,
+        "checkouts": pool_metrics.checkouts,
+        "slow_checkouts": pool_metrics.slow_checkouts,
+        "wait_ms_avg": pool_metrics.wait_total / pool_metrics.checkouts * 1000 if pool_metrics.checkouts else 0.0,
+        "wait_ms_max": pool_metrics.wait_max * 1000,
+    }
+    if isinstance(pool, AsyncAdaptedQueuePool):
+        stats.update(
+            size=pool.size(),
+            max_overflow=DB_MAX_OVERFLOW,
+            in_use=pool.checkedout(),
+            idle=pool.checkedin(),
+            # QueuePool counts overflow from -pool_size
+            overflow=max(0, pool.overflow()),
+        )
+    return stats
+
+
+def dialect_insert(db: AsyncSession):
+    """insert() of the session's dialect, for ON CONFLICT clauses."""
+    if db.get_bind().dialect.name == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert
+    return insert
+
+
 # Dependency
 async def get_db():
     async with AsyncSessionLocal() as session:
         yield session
 
 # Base class for models
-Base = declarative_base()
\ No newline at end of file
+Base = declarative_base()
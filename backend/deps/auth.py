@@ -1,29 +1,35 @@
 from fastapi import Depends, HTTPException
 from fastapi.security import OAuth2PasswordBearer
-from jose import JWTError
 from sqlalchemy import select
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from core.security import decode_access_token
+from core.principal import Principal, resolve_principal
 from database import get_db
 from models import User
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="auth/login")
 
 
-async def get_current_user(
-    token: str = Depends(oauth2_scheme),
-    db: AsyncSession = Depends(get_db),
-) -> User:
-    try:
-        user_id = decode_access_token(token)
-    except JWTError:
+async def get_current_principal(token: str = Depends(oauth2_scheme)) -> Principal:
+    principal = await resolve_principal(token)
+    if principal is None:
         raise HTTPException(status_code=401, detail="Invalid or expired token")
+    return principal
 
-    result = await db.execute(select(User).where(User.id == int(user_id)))
+
+async def load_user(db: AsyncSession, principal: Principal) -> User:
+    result = await db.execute(select(User).where(User.id == principal.id))
     user = result.scalar_one_or_none()
 
     if not user:
         raise HTTPException(status_code=401, detail="User not found")
 
     return user
+
+
+# Use only when the handler needs the full ORM row
+async def get_current_user(
+    principal: Principal = Depends(get_current_principal),
+    db: AsyncSession = Depends(get_db),
+) -> User:
+    return await load_user(db, principal)
@@ -0,0 +1,35 @@
+import math
+
+from fastapi import Depends, HTTPException, Request
+
+from core.principal import Principal
+from core.ratelimit import rate_limiter
+from deps.auth import get_current_principal
+
+
+async def enforce_rate_limit(policy: str, key, cost: float = 1.0) -> None:
+    wait = await rate_limiter.check(policy, key, cost)
+    if wait:
+        raise HTTPException(
+            status_code=429,
+            detail="Too many requests",
+            headers={"Retry-After": str(max(1, math.ceil(wait)))},
+        )
+
+
+def client_ip(request: Request) -> str:
+    return request.client.host if request.client else "unknown"
+
+
+def limit_user(policy: str):
+    async def dependency(current_user: Principal = Depends(get_current_principal)) -> None:
+        await enforce_rate_limit(policy, current_user.id)
+
+    return Depends(dependency)
+
+
+def limit_ip(policy: str):
+    async def dependency(request: Request) -> None:
+        await enforce_rate_limit(policy, client_ip(request))
+
+    return Depends(dependency)
@@ -1,24 +1,65 @@
+import os
 from contextlib import asynccontextmanager
 
 from fastapi import FastAPI
+from starlette.middleware.gzip import GZipMiddleware
 
-from database import engine, Base
+from core.hashing import hasher_pool
+from core.instrumentation import MetricsMiddleware, instrument_engine
+from core.message_writer import MESSAGE_WRITE_MODE, message_writer
+from core.partitions import MESSAGE_PARTITIONING, check_archive_storage, partition_maintainer
+from core.principal import revocations
+from core.ratelimit import rate_limiter
+from core.search import index_loader
+from database import engine
+from migrate import prepare_schema
+from realtime import fanout
 from realtime.sio import socket_app  # mounts /socket.io
+from realtime.presence import presence  # after realtime.sio, which imports the events
 from routes.auth import router as auth_router
+from routes.conversations import router as conversations_router
 from routes.health import router as health_router
 from routes.messages import router as messages_router
 from routes.groups import router as groups_router
+from routes.search import router as search_router
+
+# Responses at least this large are gzipped for clients that accept it
+# (history pages and batch results; single sends stay below it)
+HTTP_GZIP_MIN_BYTES = int(os.getenv("HTTP_GZIP_MIN_BYTES", "1024"))
+HTTP_GZIP_LEVEL = int(os.getenv("HTTP_GZIP_LEVEL", "5"))
+
+instrument_engine(engine)
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    async with engine.begin() as conn:
-        await conn.run_sync(Base.metadata.create_all)
+    async with engine.connect() as conn:
+        await conn.run_sync(prepare_schema)
+    await check_archive_storage()
+    index_loader.start()
+    await revocations.refresh()
+    revocations.start()
+    rate_limiter.start()
+    if MESSAGE_WRITE_MODE == "batched":
+        message_writer.start()
+    presence.start()
+    if MESSAGE_PARTITIONING == "monthly":
+        partition_maintainer.start()
     yield
+    await partition_maintainer.stop()
+    await index_loader.stop()
+    await revocations.stop()
+    await rate_limiter.stop()
+    await presence.stop()
+    await fanout.drain()
+    await message_writer.stop()
+    hasher_pool.shutdown()
 
 
 def create_app() -> FastAPI:
     app = FastAPI(lifespan=lifespan)
+    app.add_middleware(GZipMiddleware, minimum_size=HTTP_GZIP_MIN_BYTES, compresslevel=HTTP_GZIP_LEVEL)
+    app.add_middleware(MetricsMiddleware)
 
     # realtime
     app.mount("/socket.io", socket_app)
@@ -28,6 +69,8 @@ def create_app() -> FastAPI:
     app.include_router(auth_router, prefix="/auth", tags=["auth"])
     app.include_router(messages_router, prefix="/messages", tags=["messages"])
     app.include_router(groups_router, prefix="/groups", tags=["groups"])
+    app.include_router(conversations_router, prefix="/conversations", tags=["conversations"])
+    app.include_router(search_router, prefix="/search", tags=["search"])
 
     return app
 
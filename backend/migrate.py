@@ -0,0 +1,254 @@
+# create_all only creates missing tables, it never alters existing ones.
+# Each migration is idempotent and recorded in schema_migrations. They are a
+# deploy step, `python migrate.py`, run before starting the new version: the
+# server only creates a fresh database at the current schema and refuses to
+# start while migrations are pending (prepare_schema). On Postgres both hold
+# an advisory lock, so concurrent hosts never run them twice.
+import asyncio
+from contextlib import contextmanager
+
+from sqlalchemy import (
+    Column, DateTime, Integer, MetaData, String, Table, case, cast, func, inspect, literal, select, text, union, update,
+)
+from sqlalchemy.engine import Connection
+
+from database import Base
+from models import GroupMember, GroupMessage, PrivateMessage, ReadCursor, User
+
+BACKFILL_BATCH_SIZE = 10_000
+_ADVISORY_LOCK = 0x6D696772  # "migr"
+
+_meta = MetaData()
+schema_migrations = Table(
+    "schema_migrations",
+    _meta,
+    Column("version", String, primary_key=True),
+    Column("applied_at", DateTime(timezone=True), server_default=func.now()),
+)
+
+
+def _has_column(conn: Connection, table: str, column: str) -> bool:
+    return any(c["name"] == column for c in inspect(conn).get_columns(table))
+
+
+def _has_index(conn: Connection, table: str, name: str) -> bool:
+    inspector = inspect(conn)
+    names = {i["name"] for i in inspector.get_indexes(table)}
+    names |= {u["name"] for u in inspector.get_unique_constraints(table)}
+    return name in names
+
+
+def _0001_conversation_key_and_history_indexes(conn: Connection) -> None:
+    table = PrivateMessage.__table__
+
+    if not _has_column(conn, "private_messages", "conversation_key"):
+        conn.execute(text("ALTER TABLE private_messages ADD COLUMN conversation_key VARCHAR"))
+        conn.commit()
+
+    # Backfill in batches so a large table is not rewritten in one transaction
+    low = case((table.c.sender_id < table.c.receiver_id, table.c.sender_id), else_=table.c.receiver_id)
+    high = case((table.c.sender_id < table.c.receiver_id, table.c.receiver_id), else_=table.c.sender_id)
+    key = literal("dm:") + cast(low, String) + literal(":") + cast(high, String)
+    while True:
+        batch = (
+            select(table.c.id)
+            .where(table.c.conversation_key.is_(None))
+            .limit(BACKFILL_BATCH_SIZE)
+            .scalar_subquery()
+        )
+        result = conn.execute(update(table).where(table.c.id.in_(batch)).values(conversation_key=key))
+        conn.commit()
+        if result.rowcount == 0:
+            break
+
+    if conn.dialect.name == "postgresql":
+        conn.execute(text("ALTER TABLE private_messages ALTER COLUMN conversation_key SET NOT NULL"))
+
+    for index in (*PrivateMessage.__table__.indexes, *GroupMessage.__table__.indexes):
+        if index.name and not _has_index(conn, index.table.name, index.name):
+            index.create(conn)
+
+    if not _has_index(conn, "group_members", "uq_group_members_group_user"):
+        # Drop duplicate memberships first, keeping the oldest row
+        members = GroupMember.__table__
+        keep = (
+            select(func.min(members.c.id))
+            .group_by(members.c.group_id, members.c.user_id)
+            .scalar_subquery()
+        )
+        conn.execute(members.delete().where(members.c.id.not_in(keep)))
+        if conn.dialect.name == "postgresql":
+            conn.execute(text(
+                "ALTER TABLE group_members "
+                "ADD CONSTRAINT uq_group_members_group_user UNIQUE (group_id, user_id)"
+            ))
+        else:
+            conn.execute(text(
+                "CREATE UNIQUE INDEX uq_group_members_group_user ON group_members (group_id, user_id)"
+            ))
+
+
+def _0002_read_cursors(conn: Connection) -> None:
+    # Existing conversations start out fully read instead of with a huge badge
+    cursors = ReadCursor.__table__
+    cursors.create(conn, checkfirst=True)
+    columns = ["user_id", "conversation_key", "last_read_message_id", "unread_count"]
+
+    def missing(user_id, key):
+        return ~select(cursors.c.id).where(cursors.c.user_id == user_id, cursors.c.conversation_key == key).exists()
+
+    members, group_messages = GroupMember.__table__, GroupMessage.__table__
+    group_key = literal("group:") + cast(members.c.group_id, String)
+    last_group_message = (
+        select(func.coalesce(func.max(group_messages.c.id), 0))
+        .where(group_messages.c.group_id == members.c.group_id)
+        .scalar_subquery()
+    )
+    conn.execute(cursors.insert().from_select(
+        columns,
+        select(members.c.user_id, group_key, last_group_message, literal(0))
+        .where(missing(members.c.user_id, group_key)),
+    ))
+
+    private = PrivateMessage.__table__
+    participants = union(
+        select(private.c.sender_id.label("user_id"), private.c.conversation_key),
+        select(private.c.receiver_id.label("user_id"), private.c.conversation_key),
+    ).subquery()
+    last_private_message = (
+        select(func.max(private.c.id))
+        .where(private.c.conversation_key == participants.c.conversation_key)
+        .scalar_subquery()
+    )
+    conn.execute(cursors.insert().from_select(
+        columns,
+        select(participants.c.user_id, participants.c.conversation_key, last_private_message, literal(0))
+        .where(missing(participants.c.user_id, participants.c.conversation_key)),
+    ))
+
+
+def _0003_search_indexes(conn: Connection) -> None:
+    # GIN indexes over to_tsvector(content); elsewhere search uses the in-process index
+    if conn.dialect.name != "postgresql":
+        return
+    for index in (*PrivateMessage.__table__.indexes, *GroupMessage.__table__.indexes):
+        if index.name.endswith("_content_fts") and not _has_index(conn, index.table.name, index.name):
+            index.create(conn)
+
+
+def _0004_conversation_activity(conn: Connection) -> None:
+    # Point every cursor at its conversation's newest message; conversations
+    # without messages keep the cursor's own timestamp
+    cursors = ReadCursor.__table__
+    for column in ("last_message_id INTEGER", "last_activity_at TIMESTAMP WITH TIME ZONE"):
+        if not _has_column(conn, "read_cursors", column.split()[0]):
+            conn.execute(text(f"ALTER TABLE read_cursors ADD COLUMN {column}"))
+    conn.commit()
+
+    private, group_messages = PrivateMessage.__table__, GroupMessage.__table__
+    key = cursors.c.conversation_key
+    sources = (
+        (private, key.like("dm:%"), private.c.conversation_key == key),
+        (group_messages, key.like("group:%"), group_messages.c.group_id == cast(func.substr(key, 7), Integer)),
+    )
+    for messages, is_kind, in_room in sources:
+        conn.execute(
+            update(cursors)
+            .where(is_kind, cursors.c.last_message_id.is_(None))
+            .values(last_message_id=select(func.max(messages.c.id)).where(in_room).scalar_subquery())
+        )
+        created_at = select(messages.c.created_at).where(messages.c.id == cursors.c.last_message_id).scalar_subquery()
+        conn.execute(
+            update(cursors)
+            .where(is_kind, cursors.c.last_activity_at.is_(None))
+            .values(last_activity_at=func.coalesce(created_at, cursors.c.updated_at))
+        )
+        conn.commit()
+
+    if conn.dialect.name == "postgresql":
+        conn.execute(text("ALTER TABLE read_cursors ALTER COLUMN last_activity_at SET NOT NULL"))
+    if not _has_index(conn, "read_cursors", "ix_read_cursors_user_activity"):
+        next(i for i in cursors.indexes if i.name == "ix_read_cursors_user_activity").create(conn)
+
+
+def _0005_token_revocation(conn: Connection) -> None:
+    if not _has_column(conn, "users", "tokens_valid_after"):
+        conn.execute(text("ALTER TABLE users ADD COLUMN tokens_valid_after TIMESTAMP WITH TIME ZONE"))
+    for index in User.__table__.indexes:
+        if index.name == "ix_users_tokens_valid_after" and not _has_index(conn, "users", index.name):
+            index.create(conn)
+
+
+MIGRATIONS = [
+    ("0001_conversation_key_and_history_indexes", _0001_conversation_key_and_history_indexes),
+    ("0002_read_cursors", _0002_read_cursors),
+    ("0003_search_indexes", _0003_search_indexes),
+    ("0004_conversation_activity", _0004_conversation_activity),
+    ("0005_token_revocation", _0005_token_revocation),
+]
+
+
+@contextmanager
+def _schema_lock(conn: Connection):
+    if conn.dialect.name != "postgresql":
+        yield
+        return
+    conn.execute(text("SELECT pg_advisory_lock(:id)"), {"id": _ADVISORY_LOCK})
+    conn.commit()
+    try:
+        yield
+    finally:
+        # A failed migration leaves the transaction aborted, which would
+        # refuse the unlock and keep the lock on the pooled connection
+        conn.rollback()
+        conn.execute(text("SELECT pg_advisory_unlock(:id)"), {"id": _ADVISORY_LOCK})
+        conn.commit()
+
+
+def _pending(conn: Connection) -> list[str]:
+    schema_migrations.create(conn, checkfirst=True)
+    conn.commit()
+    applied = set(conn.execute(select(schema_migrations.c.version)).scalars())
+    return [version for version, _ in MIGRATIONS if version not in applied]
+
+
+def run_migrations(conn: Connection) -> None:
+    with _schema_lock(conn):
+        Base.metadata.create_all(conn)
+        conn.commit()
+        pending = _pending(conn)
+        for version, migration in MIGRATIONS:
+            if version not in pending:
+                continue
+            migration(conn)
+            conn.execute(schema_migrations.insert().values(version=version))
+            conn.commit()
+
+
+def prepare_schema(conn: Connection) -> None:
+    """Server startup: create a fresh database, which is then current, or
+    fail if an existing one has migrations pending."""
+    with _schema_lock(conn):
+        fresh = not inspect(conn).has_table(User.__tablename__)
+        Base.metadata.create_all(conn)
+        conn.commit()
+        pending = _pending(conn)
+        if pending and not fresh:
+            raise RuntimeError(
+                f"Pending migrations: {', '.join(pending)}. Run `python migrate.py` before starting the server."
+            )
+        if pending:
+            conn.execute(schema_migrations.insert(), [{"version": version} for version in pending])
+            conn.commit()
+
+
+async def main() -> None:
+    from database import engine
+
+    async with engine.connect() as conn:
+        await conn.run_sync(run_migrations)
+    await engine.dispose()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
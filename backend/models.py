@@ -1,7 +1,28 @@
 from datetime import datetime, timezone
-from sqlalchemy import Column, Integer, String, ForeignKey, Boolean, DateTime
+from sqlalchemy import Column, Integer, String, ForeignKey, Boolean, DateTime, Index, UniqueConstraint, func, literal_column
 from database import Base
 
+
+def conversation_key(a: int, b: int) -> str:
+    # Canonical, order-independent key for a DM pair (also the socket.io room name)
+    x, y = (a, b) if a < b else (b, a)
+    return f"dm:{x}:{y}"
+
+
+def content_tsvector(column):
+    # Must match the expression of the full-text indexes for Postgres to use them
+    return func.to_tsvector(literal_column("'simple'::regconfig"), column)
+
+
+def _content_search_index(name: str, column) -> Index:
+    # Postgres only; other databases use core.search's in-process index
+    return Index(name, content_tsvector(column), postgresql_using='gin').ddl_if(dialect='postgresql')
+
+
+def _default_conversation_key(context) -> str:
+    params = context.get_current_parameters()
+    return conversation_key(params["sender_id"], params["receiver_id"])
+
 class User(Base):
     __tablename__ = 'users'
     
@@ -11,6 +32,8 @@ class User(Base):
     hashed_password = Column(String)
     is_active = Column(Boolean, default=True) 
     created_at = Column(DateTime(timezone=True), default=lambda: datetime.now(timezone.utc), nullable=False)
+    # Tokens issued at or before this are rejected (logout, deactivation)
+    tokens_valid_after = Column(DateTime(timezone=True), nullable=True, index=True)
 
 class PrivateMessage(Base):
     __tablename__ = 'private_messages'
@@ -18,9 +41,15 @@ class PrivateMessage(Base):
     id = Column(Integer, primary_key=True, index=True) # message ID
     sender_id = Column(Integer, ForeignKey('users.id'), nullable=False)
     receiver_id = Column(Integer, ForeignKey('users.id'), nullable=False)
+    conversation_key = Column(String, nullable=False, default=_default_conversation_key)
     content = Column(String, nullable=False)
     created_at = Column(DateTime(timezone=True), default=lambda: datetime.now(timezone.utc), nullable=False)
 
+    __table_args__ = (
+        Index('ix_private_messages_conversation_created', 'conversation_key', 'created_at', 'id'),
+        _content_search_index('ix_private_messages_content_fts', content),
+    )
+
 class Group(Base):
     __tablename__ = 'groups'
     
@@ -38,6 +67,10 @@ class GroupMember(Base):
     user_id = Column(Integer, ForeignKey('users.id'), nullable=False)
     joined_at = Column(DateTime(timezone=True), default=lambda: datetime.now(timezone.utc), nullable=False)
 
+    __table_args__ = (
+        UniqueConstraint('group_id', 'user_id', name='uq_group_members_group_user'),
+    )
+
 class GroupMessage(Base):
     __tablename__ = 'group_messages'
     
@@ -47,3 +80,47 @@ class GroupMessage(Base):
     content = Column(String, nullable=False)
     created_at = Column(DateTime(timezone=True), default=lambda: datetime.now(timezone.utc), nullable=False)
 
+    __table_args__ = (
+        Index('ix_group_messages_group_created', 'group_id', 'created_at', 'id'),
+        _content_search_index('ix_group_messages_content_fts', content),
+    )
+
+# Per user, per conversation read state. conversation_key is the room name
+# ("dm:1:2" / "group:7"). For DMs unread_count, last_message_id and
+# last_activity_at are maintained on insert. Group cursors only move on the
+# member's own sends and reads; their unread count and newest message are
+# derived when read, so a group send never rewrites every member's row.
+class ReadCursor(Base):
+    __tablename__ = 'read_cursors'
+
+    id = Column(Integer, primary_key=True)
+    user_id = Column(Integer, ForeignKey('users.id'), nullable=False)
+    conversation_key = Column(String, nullable=False)
+    last_read_message_id = Column(Integer, nullable=False, default=0)
+    unread_count = Column(Integer, nullable=False, default=0)
+    last_message_id = Column(Integer, nullable=True)
+    last_activity_at = Column(DateTime(timezone=True), default=lambda: datetime.now(timezone.utc), nullable=False)
+    updated_at = Column(DateTime(timezone=True), default=lambda: datetime.now(timezone.utc), nullable=False)
+
+    __table_args__ = (
+        UniqueConstraint('user_id', 'conversation_key', name='uq_read_cursors_user_conversation'),
+        Index('ix_read_cursors_conversation', 'conversation_key'),
+        Index('ix_read_cursors_user_activity', 'user_id', 'last_activity_at'),
+    )
+
+
+# Months exported by core.partitions and dropped from the message tables.
+# Their rows only exist in ARCHIVE_DIR from then on, so every host serving
+# history must see the same directory (see core.partitions.check_archive_storage).
+class MessageArchive(Base):
+    __tablename__ = 'message_archives'
+
+    id = Column(Integer, primary_key=True)
+    table_name = Column(String, nullable=False)
+    month = Column(String, nullable=False)  # "YYYY-MM"
+    rows = Column(Integer, nullable=False)
+    archived_at = Column(DateTime(timezone=True), default=lambda: datetime.now(timezone.utc), nullable=False)
+
+    __table_args__ = (
+        UniqueConstraint('table_name', 'month', name='uq_message_archives_table_month'),
+    )
@@ -0,0 +1,166 @@
+import logging
+import os
+
+import socketio
+from engineio import packet as eio_packet
+from socketio import packet
+
+from core.metrics import SIZE_BUCKETS, registry
+
+logger = logging.getLogger(__name__)
+
+# Engine.IO gives every socket an unbounded outbound queue, drained by its
+# transport as fast as the client reads. Bound it so one slow client can't
+# hold an unbounded backlog:
+#   drop_oldest -> discard the oldest queued events to make room (never pings
+#                  or other control packets, never part of a binary packet)
+#   disconnect  -> flush the backlog, send a "resync" hint and disconnect; the
+#                  client reconnects and catches up with last_seen_id
+SOCKET_MAX_QUEUE = int(os.getenv("SOCKET_MAX_QUEUE", "256"))  # packets, 0 = unbounded
+SOCKET_OVERFLOW_POLICY = os.getenv("SOCKET_OVERFLOW_POLICY", "drop_oldest")
+
+queue_depth = registry.histogram(
+    "socket_queue_depth", "Outbound queue depth seen when a packet is queued", buckets=SIZE_BUCKETS
+)
+overflows = registry.counter("socket_queue_overflow_total", "Packets hitting a full socket queue", ("action",))
+
+
+def _attachments(eio_pkt) -> int:
+    """Binary attachments announced by a socket.io header packet."""
+    data = eio_pkt.data
+    if eio_pkt.packet_type != eio_packet.MESSAGE or not isinstance(data, str) or data[:1] not in _BINARY_TYPES:
+        return 0
+    return int(data[1:data.index("-")])
+
+
+def _binary_parts(data) -> int:
+    if isinstance(data, (bytes, bytearray)):
+        return 1
+    if isinstance(data, (list, tuple)):
+        return sum(_binary_parts(value) for value in data)
+    if isinstance(data, dict):
+        return sum(_binary_parts(value) for value in data.values())
+    return 0
+
+
+def _droppable(eio_pkt) -> bool:
+    # Only events; pings, connects, acks and the close sentinel always go out
+    return (
+        eio_pkt is not None
+        and eio_pkt.packet_type == eio_packet.MESSAGE
+        and isinstance(eio_pkt.data, str)
+        and eio_pkt.data[:1] in _EVENT_TYPES
+    )
+
+
+_EVENT_TYPES = (str(packet.EVENT), str(packet.BINARY_EVENT))
+_BINARY_TYPES = (str(packet.BINARY_EVENT), str(packet.BINARY_ACK))
+
+
+class BackpressureServer(socketio.AsyncServer):
+    """Admission works on whole socket.io packets: a binary packet's header
+    and attachments are admitted or rejected together, and drop_oldest only
+    ever discards complete event packets."""
+
+    def __init__(self, *args, max_queue: int = SOCKET_MAX_QUEUE, overflow_policy: str = SOCKET_OVERFLOW_POLICY, **kwargs):
+        super().__init__(*args, **kwargs)
+        if overflow_policy not in ("drop_oldest", "disconnect"):
+            raise RuntimeError(f"Unsupported SOCKET_OVERFLOW_POLICY: {overflow_policy}")
+        self.max_queue = max_queue
+        self.overflow_policy = overflow_policy
+        self._evicting: set[str] = set()
+        # eio sid -> (attachments still to come, admitted) after a binary header
+        self._pending: dict[str, tuple[int, bool]] = {}
+
+    # Every outbound packet goes through one of these two. _send_packet gets a
+    # whole socket.io packet; _send_eio_packet gets one piece of it at a time
+    # (room emits), in order, so attachments follow their header's decision.
+    async def _send_packet(self, eio_sid, pkt):
+        if self._admit(eio_sid, 1 + _binary_parts(pkt.data)):
+            await super()._send_packet(eio_sid, pkt)
+
+    async def _send_eio_packet(self, eio_sid, eio_pkt):
+        pending = self._pending.pop(eio_sid, None)
+        if pending is not None and isinstance(eio_pkt.data, bytes):
+            remaining, admitted = pending
+            if remaining > 1:
+                self._pending[eio_sid] = (remaining - 1, admitted)
+        else:
+            attachments = _attachments(eio_pkt)
+            admitted = self._admit(eio_sid, 1 + attachments)
+            if attachments:
+                self._pending[eio_sid] = (attachments, admitted)
+        if admitted:
+            await super()._send_eio_packet(eio_sid, eio_pkt)
+
+    def _admit(self, eio_sid: str, size: int = 1) -> bool:
+        if eio_sid in self._evicting:
+            return False
+        socket = self.eio.sockets.get(eio_sid)
+        if socket is None or not self.max_queue:
+            return True
+
+        depth = socket.queue.qsize()
+        queue_depth.observe(depth)
+        if depth + size <= self.max_queue:
+            return True
+
+        if self.overflow_policy == "drop_oldest":
+            return self._drop_oldest(socket, depth + size - self.max_queue)
+
+        self._evict(eio_sid, socket)
+        return False
+
+    def _drop_oldest(self, socket, needed: int) -> bool:
+        """Make room for `needed` more packets by discarding the oldest queued
+        events, each with its attachments."""
+        queued = []
+        while not socket.queue.empty():
+            queued.append(socket.queue.get_nowait())
+            socket.queue.task_done()
+        if None in queued:
+            # close sentinel: the transport is shutting down anyway
+            keep, admitted = queued, False
+        else:
+            keep, dropped, i = [], 0, 0
+            while i < len(queued):
+                pkt = queued[i]
+                size = 1 + _attachments(pkt)
+                if needed > 0 and _droppable(pkt):
+                    needed -= size
+                    dropped += 1
+                else:
+                    keep.extend(queued[i:i + size])
+                i += size
+            overflows.labels("dropped").inc(dropped)
+            # Only control packets left: let them through rather than stall
+            admitted = True
+        for pkt in keep:
+            socket.queue.put_nowait(pkt)
+        return admitted
+
+    def _evict(self, eio_sid: str, socket) -> None:
+        overflows.labels("disconnected").inc()
+        self._evicting.add(eio_sid)
+        while not socket.queue.empty():
+            socket.queue.get_nowait()
+            socket.queue.task_done()
+        self.start_background_task(self._disconnect_slow, eio_sid)
+
+    async def _disconnect_slow(self, eio_sid: str) -> None:
+        try:
+            sid = self.manager.sid_from_eio_sid(eio_sid, "/")
+            hint = self.packet_class(packet.EVENT, namespace="/", data=["resync", {"reason": "slow_consumer"}])
+            await super()._send_packet(eio_sid, hint)
+            if sid is not None:
+                logger.info("Disconnecting slow consumer %s", sid)
+                await self.disconnect(sid)
+        except Exception:
+            logger.exception("Failed to disconnect slow consumer %s", eio_sid)
+        finally:
+            self._evicting.discard(eio_sid)
+
+    def queue_stats(self) -> tuple[int, int]:
+        """(total, max) queued packets across this worker's sockets."""
+        depths = [socket.queue.qsize() for socket in self.eio.sockets.values()]
+        return sum(depths), max(depths, default=0)
@@ -0,0 +1,60 @@
+import os
+from typing import Optional
+
+from sqlalchemy import select, tuple_
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from core.pagination import encode_cursor
+from core.room_cache import recent_messages
+from core.serialization import (
+    GROUP_MESSAGE_FIELDS, PRIVATE_MESSAGE_FIELDS, group_message_json, private_message_json,
+)
+from models import GroupMessage, PrivateMessage
+
+# Larger gaps are not replayed over the socket; the client is told to page
+# through HTTP history instead
+CATCHUP_MAX_MESSAGES = int(os.getenv("CATCHUP_MAX_MESSAGES", "200"))
+
+
+def _room_source(room: str):
+    kind, _, key = room.partition(":")
+    if kind == "group":
+        return GroupMessage, GROUP_MESSAGE_FIELDS, GroupMessage.group_id == int(key), group_message_json
+    return PrivateMessage, PRIVATE_MESSAGE_FIELDS, PrivateMessage.conversation_key == room, private_message_json
+
+
+async def missed_messages(
+    db: AsyncSession, room: str, last_seen_id: int
+) -> tuple[Optional[list[tuple[int, bytes]]], Optional[str]]:
+    """(id, encoded message) pairs in `room` newer than `last_seen_id`, oldest first.
+
+    Returns (None, cursor) when the gap is larger than CATCHUP_MAX_MESSAGES;
+    `cursor` can then be passed as `after` to the HTTP history endpoint.
+    """
+    cached = recent_messages.entries_after(room, last_seen_id)
+    if cached is not None and len(cached) <= CATCHUP_MAX_MESSAGES:
+        return [(entry[1], entry[2]) for entry in cached], None
+
+    model, fields, in_room, encode = _room_source(room)
+    anchor = (await db.execute(
+        select(model.created_at, model.id).where(in_room, model.id == last_seen_id)
+    )).one_or_none()
+    if anchor is None:
+        # Unknown or deleted id: resume from the closest older message in the
+        # room, or from before its oldest one
+        anchor = (await db.execute(
+            select(model.created_at, model.id).where(in_room, model.id < last_seen_id)
+            .order_by(model.id.desc()).limit(1)
+        )).one_or_none()
+    query = select(*[getattr(model, field) for field in fields]).where(in_room)
+    if anchor is not None:
+        query = query.where(tuple_(model.created_at, model.id) > tuple_(anchor.created_at, anchor.id))
+    rows = (await db.execute(
+        query.order_by(model.created_at, model.id).limit(CATCHUP_MAX_MESSAGES + 1)
+    )).all()
+
+    if len(rows) > CATCHUP_MAX_MESSAGES:
+        if anchor is None:
+            return None, encode_cursor(rows[0].created_at, rows[0].id - 1)
+        return None, encode_cursor(anchor.created_at, anchor.id)
+    return [(row.id, encode(row)) for row in rows], None
@@ -0,0 +1,223 @@
+import json
+import struct
+import weakref
+from datetime import datetime, timedelta, timezone
+from typing import Any
+
+from engineio import packet as eio_packet
+from socketio import packet
+
+from core.serialization import GROUP_MESSAGE_FIELDS, PRIVATE_MESSAGE_FIELDS, RawJSON
+
+# Compact socket encoding, opted into per connection with
+# auth={"encoding": "compact"}. Server -> client events then carry a single
+# binary attachment instead of JSON: the event payload packed as MessagePack,
+# where every message is an array in MESSAGE_FIELDS order ("dm:" rooms use the
+# private layout, "group:" rooms the group one) with created_at as epoch
+# milliseconds. Everything else keeps its keys. Acks stay JSON.
+COMPACT_ENCODING = "compact"
+MESSAGE_FIELDS = {"dm": PRIVATE_MESSAGE_FIELDS, "group": GROUP_MESSAGE_FIELDS}
+_MESSAGE_SHAPES = {fields: fields for fields in MESSAGE_FIELDS.values()}
+
+_EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+_MS = timedelta(milliseconds=1)
+
+
+def _epoch_ms(value: Any) -> Any:
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value)
+    if isinstance(value, datetime):
+        if value.tzinfo is None:
+            value = value.replace(tzinfo=timezone.utc)
+        return (value - _EPOCH) // _MS
+    return value
+
+
+def compact_payload(data: Any) -> Any:
+    """Turn message objects into positional arrays, recursively."""
+    if isinstance(data, RawJSON):
+        data = json.loads(data.data)
+    if isinstance(data, dict):
+        fields = _MESSAGE_SHAPES.get(tuple(data))
+        if fields is not None:
+            return [_epoch_ms(data[f]) if f == "created_at" else data[f] for f in fields]
+        return {key: compact_payload(value) for key, value in data.items()}
+    if isinstance(data, (list, tuple)):
+        return [compact_payload(value) for value in data]
+    return data
+
+
+# MessagePack, the subset JSON payloads need
+def pack(obj: Any) -> bytes:
+    out = bytearray()
+    _pack(obj, out)
+    return bytes(out)
+
+
+def _pack(obj: Any, out: bytearray) -> None:
+    if obj is None:
+        out.append(0xC0)
+    elif obj is True:
+        out.append(0xC3)
+    elif obj is False:
+        out.append(0xC2)
+    elif isinstance(obj, int):
+        if 0 <= obj < 0x80:
+            out.append(obj)
+        elif -32 <= obj < 0:
+            out.append(obj & 0xFF)
+        elif 0 <= obj <= 0xFFFF:
+            out += struct.pack(">BB", 0xCC, obj) if obj <= 0xFF else struct.pack(">BH", 0xCD, obj)
+        elif 0 <= obj <= 0xFFFFFFFF:
+            out += struct.pack(">BI", 0xCE, obj)
+        elif obj > 0:
+            out += struct.pack(">BQ", 0xCF, obj)
+        elif obj >= -0x80000000:
+            out += struct.pack(">Bi", 0xD2, obj)
+        else:
+            out += struct.pack(">Bq", 0xD3, obj)
+    elif isinstance(obj, float):
+        out += struct.pack(">Bd", 0xCB, obj)
+    elif isinstance(obj, str):
+        data = obj.encode()
+        n = len(data)
+        if n < 32:
+            out.append(0xA0 | n)
+        elif n <= 0xFF:
+            out += struct.pack(">BB", 0xD9, n)
+        elif n <= 0xFFFF:
+            out += struct.pack(">BH", 0xDA, n)
+        else:
+            out += struct.pack(">BI", 0xDB, n)
+        out += data
+    elif isinstance(obj, (bytes, bytearray)):
+        n = len(obj)
+        out += struct.pack(">BB", 0xC4, n) if n <= 0xFF else struct.pack(">BI", 0xC6, n)
+        out += obj
+    elif isinstance(obj, (list, tuple)):
+        _header(out, len(obj), 0x90, 0xDC, 0xDD)
+        for value in obj:
+            _pack(value, out)
+    elif isinstance(obj, dict):
+        _header(out, len(obj), 0x80, 0xDE, 0xDF)
+        for key, value in obj.items():
+            _pack(key, out)
+            _pack(value, out)
+    else:
+        raise TypeError(f"Cannot pack {type(obj).__name__}")
+
+
+def _header(out: bytearray, n: int, fix: int, short: int, long: int) -> None:
+    if n < 16:
+        out.append(fix | n)
+    elif n <= 0xFFFF:
+        out += struct.pack(">BH", short, n)
+    else:
+        out += struct.pack(">BI", long, n)
+
+
+def unpack(data: bytes) -> Any:
+    value, _ = _unpack(memoryview(data), 0)
+    return value
+
+
+def _unpack(data: memoryview, i: int) -> tuple[Any, int]:
+    b = data[i]
+    i += 1
+    if b < 0x80:
+        return b, i
+    if b >= 0xE0:
+        return b - 0x100, i
+    if b & 0xE0 == 0xA0:
+        return _str(data, i, b & 0x1F)
+    if b & 0xF0 == 0x90:
+        return _array(data, i, b & 0x0F)
+    if b & 0xF0 == 0x80:
+        return _map(data, i, b & 0x0F)
+    if b == 0xC0:
+        return None, i
+    if b in (0xC2, 0xC3):
+        return b == 0xC3, i
+    fmt, kind = _FORMATS[b]
+    (n,) = struct.unpack_from(fmt, data, i)
+    i += struct.calcsize(fmt)
+    if kind == "str":
+        return _str(data, i, n)
+    if kind == "bin":
+        return bytes(data[i:i + n]), i + n
+    if kind == "array":
+        return _array(data, i, n)
+    if kind == "map":
+        return _map(data, i, n)
+    return n, i
+
+
+_FORMATS = {
+    0xC4: (">B", "bin"), 0xC6: (">I", "bin"), 0xCB: (">d", "num"),
+    0xCC: (">B", "num"), 0xCD: (">H", "num"), 0xCE: (">I", "num"), 0xCF: (">Q", "num"),
+    0xD2: (">i", "num"), 0xD3: (">q", "num"),
+    0xD9: (">B", "str"), 0xDA: (">H", "str"), 0xDB: (">I", "str"),
+    0xDC: (">H", "array"), 0xDD: (">I", "array"), 0xDE: (">H", "map"), 0xDF: (">I", "map"),
+}
+
+
+def _str(data: memoryview, i: int, n: int) -> tuple[str, int]:
+    return bytes(data[i:i + n]).decode(), i + n
+
+
+def _array(data: memoryview, i: int, n: int) -> tuple[list, int]:
+    items = []
+    for _ in range(n):
+        value, i = _unpack(data, i)
+        items.append(value)
+    return items, i
+
+
+def _map(data: memoryview, i: int, n: int) -> tuple[dict, int]:
+    items = {}
+    for _ in range(n):
+        key, i = _unpack(data, i)
+        items[key], i = _unpack(data, i)
+    return items, i
+
+
+class CompactEncodingMixin:
+    """Server mixin re-encoding events for sockets that opted into compact."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._compact: set[str] = set()  # eio sids
+        # A room emit shares one packet object between its recipients, so the
+        # compact form is built once per emit, not per socket
+        self._transcoded = weakref.WeakKeyDictionary()
+
+    def use_compact(self, sid: str, namespace: str = "/") -> None:
+        self._compact.add(self.manager.eio_sid_from_sid(sid, namespace))
+
+    def _compact_packet(self, pkt):
+        event, *args = pkt.data
+        payload = compact_payload(args[0] if len(args) == 1 else args)
+        return self.packet_class(packet.EVENT, namespace=pkt.namespace, data=[event, pack(payload)], id=pkt.id)
+
+    async def _send_packet(self, eio_sid, pkt):
+        if eio_sid in self._compact and pkt.packet_type == packet.EVENT and not pkt.attachment_count:
+            pkt = self._compact_packet(pkt)
+        await super()._send_packet(eio_sid, pkt)
+
+    async def _send_eio_packet(self, eio_sid, eio_pkt):
+        if eio_sid not in self._compact or not isinstance(eio_pkt.data, str) or eio_pkt.data[:1] != "2":
+            # not a plain-JSON event (attachments, binary, or other packet types)
+            await super()._send_eio_packet(eio_sid, eio_pkt)
+            return
+        compact = self._transcoded.get(eio_pkt)
+        if compact is None:
+            encoded = self._compact_packet(self.packet_class(encoded_packet=eio_pkt.data)).encode()
+            compact = self._transcoded[eio_pkt] = [eio_packet.Packet(eio_packet.MESSAGE, p) for p in encoded]
+        for p in compact:
+            await super()._send_eio_packet(eio_sid, p)
+
+    async def _handle_eio_disconnect(self, eio_sid, reason):
+        try:
+            await super()._handle_eio_disconnect(eio_sid, reason)
+        finally:
+            self._compact.discard(eio_sid)
@@ -1,17 +1,27 @@
 from typing import Optional
 
-from sqlalchemy import select, and_
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from database import AsyncSessionLocal
-from models import User, GroupMember
-from core.security import decode_access_token
+from models import conversation_key
+from core.membership import is_member, member_group_ids, user_group_ids
+from core.metrics import registry
+from core.principal import resolve_principal
+from core.ratelimit import rate_limiter
+from core.serialization import RawJSON
+from realtime.catchup import missed_messages
+from realtime.compact import COMPACT_ENCODING
+from realtime.presence import STATUSES, presence, shared_rooms
 from realtime.sio import sio
 
+MAX_ROOMS_PER_SUBSCRIBE = 1000
+
+connected_sockets = registry.gauge("socket_connected", "Sockets connected to this worker")
+socket_connects = registry.counter("socket_connects_total", "Socket connect attempts", ("result",))
+
 
 def dm_room(a: int, b: int) -> str:
-    x, y = (a, b) if a < b else (b, a)
-    return f"dm:{x}:{y}"
+    return conversation_key(a, b)
 
 
 @sio.event
@@ -21,85 +31,235 @@ async def connect(sid, environ, auth):
         token = auth.get("token")
 
     if not token:
+        socket_connects.labels("unauthorized").inc()
         return False
 
-    async with AsyncSessionLocal() as db:
-        try:
-            user_id = decode_access_token(token)
-        except Exception:
-            return False
+    if await rate_limiter.check("socket:connect", _client_ip(environ)):
+        socket_connects.labels("rate_limited").inc()
+        return False
 
-        result = await db.execute(select(User).where(User.id == int(user_id)))
-        user = result.scalar_one_or_none()
-        if not user:
-            return False
+    principal = await resolve_principal(token)
+    if principal is None:
+        socket_connects.labels("unauthorized").inc()
+        return False
+
+    await sio.save_session(sid, {"user_id": principal.id})
+    if isinstance(auth, dict) and auth.get("encoding") == COMPACT_ENCODING:
+        sio.use_compact(sid)
+    await sio.enter_room(sid, f"user:{principal.id}")
 
-        await sio.save_session(sid, {"user_id": user.id})
-        await sio.enter_room(sid, f"user:{user.id}")
+    # Opt-in: join every group room with one query instead of a subscribe per group
+    if isinstance(auth, dict) and auth.get("autojoin"):
+        async with AsyncSessionLocal() as db:
+            group_ids = await user_group_ids(db, principal.id)
+        for group_id in group_ids:
+            await sio.enter_room(sid, f"group:{group_id}")
 
+    socket_connects.labels("ok").inc()
+    connected_sockets.inc()
+    presence.connected(sid, principal.id, shared_rooms(sid))
     return True
 
 
 @sio.event
 async def disconnect(sid):
-    pass
+    connected_sockets.dec()
+    session = await sio.get_session(sid)
+    if "user_id" in session:
+        presence.disconnected(sid, session["user_id"], shared_rooms(sid))
 
 
 @sio.event
 async def subscribe(sid, data):
     session = await sio.get_session(sid)
     user_id = session.get("user_id")
+    if await _rate_limited(sid, user_id):
+        return
 
     room = (data or {}).get("room")
     if not isinstance(room, str):
         await sio.emit("error", {"message": "Missing room"}, to=sid)
         return
 
+    last_seen_id = (data or {}).get("last_seen_id")
+
     async with AsyncSessionLocal() as db:
         if not await _is_allowed_room(db, user_id, room):
             await sio.emit("error", {"message": "Not authorized for room"}, to=sid)
             return
 
-    await sio.enter_room(sid, room)
+        # The catch-up goes out before joining so live messages can't overtake
+        # it; a second, normally empty, delta covers what committed in
+        # between. Overlaps are possible and clients dedupe by id.
+        if isinstance(last_seen_id, int):
+            last_seen_id = await _send_missed(db, sid, room, last_seen_id)
+        await sio.enter_room(sid, room)
+        presence.joined(user_id, room)
+        if isinstance(last_seen_id, int):
+            await _send_missed(db, sid, room, last_seen_id)
+
     await sio.emit("subscribed", {"room": room}, to=sid)
 
 
+async def _send_missed(db: AsyncSession, sid: str, room: str, last_seen_id: int) -> Optional[int]:
+    """Send what the client missed; returns the newest id it now has, or None
+    after a "resync" (the client pages the rest over HTTP)."""
+    missed, cursor = await missed_messages(db, room, last_seen_id)
+    if missed is None:
+        await sio.emit("resync", {"room": room, "after": cursor}, to=sid)
+        return None
+    if missed:
+        await sio.emit(
+            "messages", {"room": room, "data": [RawJSON(body) for _, body in missed], "catchup": True}, to=sid
+        )
+        return missed[-1][0]
+    return last_seen_id
+
+
+@sio.event
+async def subscribe_many(sid, data):
+    session = await sio.get_session(sid)
+    user_id = session.get("user_id")
+    if await _rate_limited(sid, user_id):
+        return
+
+    rooms = (data or {}).get("rooms")
+    if not isinstance(rooms, list) or not all(isinstance(r, str) for r in rooms):
+        await sio.emit("error", {"message": "Missing rooms"}, to=sid)
+        return
+    if len(rooms) > MAX_ROOMS_PER_SUBSCRIBE:
+        await sio.emit("error", {"message": f"At most {MAX_ROOMS_PER_SUBSCRIBE} rooms per call"}, to=sid)
+        return
+    last_seen_ids = (data or {}).get("last_seen_ids") or {}
+
+    async with AsyncSessionLocal() as db:
+        allowed = await _allowed_rooms(db, user_id, rooms)
+        # Same ordering as subscribe: catch-up, join, then the second delta
+        seen = {}
+        for room in allowed:
+            if isinstance(last_seen_ids.get(room), int):
+                seen[room] = await _send_missed(db, sid, room, last_seen_ids[room])
+        for room in allowed:
+            await sio.enter_room(sid, room)
+            presence.joined(user_id, room)
+        for room, last_seen_id in seen.items():
+            if last_seen_id is not None:
+                await _send_missed(db, sid, room, last_seen_id)
+
+    rejected = [room for room in rooms if room not in allowed]
+    await sio.emit("subscribed_many", {"rooms": allowed, "rejected": rejected}, to=sid)
+
+
 @sio.event
 async def unsubscribe(sid, data):
+    session = await sio.get_session(sid)
+    if await _rate_limited(sid, session.get("user_id")):
+        return
+
     room = (data or {}).get("room")
     if not isinstance(room, str):
         await sio.emit("error", {"message": "Missing room"}, to=sid)
         return
 
     await sio.leave_room(sid, room)
+    presence.left(session.get("user_id"), room)
     await sio.emit("unsubscribed", {"room": room}, to=sid)
 
 
+# Ephemeral events: no DB, no persistence. Typing is throttled by the presence
+# registry rather than the shared socket rate limit so it can't starve subscribes.
+@sio.event
+async def typing(sid, data):
+    room = (data or {}).get("room")
+    if not isinstance(room, str) or room not in shared_rooms(sid):
+        await sio.emit("error", {"message": "Not subscribed to room"}, to=sid)
+        return
+
+    session = await sio.get_session(sid)
+    presence.typing(session["user_id"], room, bool((data or {}).get("typing", True)))
+
+
+@sio.on("presence")
+async def set_presence(sid, data):
+    session = await sio.get_session(sid)
+    user_id = session.get("user_id")
+    if await _rate_limited(sid, user_id):
+        return
+
+    status = (data or {}).get("status")
+    if status not in STATUSES:
+        await sio.emit("error", {"message": f"Status must be one of {', '.join(STATUSES)}"}, to=sid)
+        return
+
+    rooms = {room for other in presence.sessions.get(user_id, ()) for room in shared_rooms(other)}
+    presence.set_status(user_id, status, rooms)
+
+
+@sio.event
+async def presence_snapshot(sid, data):
+    # Acknowledged with {"room", "users"}; diffs then arrive as "presence" events
+    room = (data or {}).get("room")
+    if not isinstance(room, str) or room not in shared_rooms(sid):
+        return {"error": "Not subscribed to room"}
+    return {"room": room, "users": presence.snapshot(room)}
+
+
+def _client_ip(environ: dict) -> str:
+    client = environ.get("asgi.scope", {}).get("client")
+    return client[0] if client else environ.get("REMOTE_ADDR", "unknown")
+
+
+async def _rate_limited(sid: str, user_id: int) -> bool:
+    wait = await rate_limiter.check("socket:user", user_id)
+    if wait:
+        await sio.emit("error", {"message": "Rate limited", "retry_after": wait}, to=sid)
+    return bool(wait)
+
+
+def _group_id(room: str) -> Optional[int]:
+    try:
+        return int(room.split(":", 1)[1])
+    except ValueError:
+        return None
+
+
+def _is_allowed_dm(user_id: int, room: str) -> bool:
+    parts = room.split(":")
+    if len(parts) != 3:
+        return False
+    try:
+        a = int(parts[1])
+        b = int(parts[2])
+    except ValueError:
+        return False
+    return user_id in (a, b)
+
+
 async def _is_allowed_room(db: AsyncSession, user_id: int, room: str) -> bool:
     # Group authorization
     if room.startswith("group:"):
-        try:
-            group_id = int(room.split(":", 1)[1])
-        except ValueError:
-            return False
-
-        q = await db.execute(
-            select(GroupMember).where(
-                and_(GroupMember.group_id == group_id, GroupMember.user_id == user_id)
-            )
-        )
-        return q.scalar_one_or_none() is not None
+        group_id = _group_id(room)
+        return group_id is not None and await is_member(db, group_id, user_id)
 
     # DM authorization
     if room.startswith("dm:"):
-        parts = room.split(":")
-        if len(parts) != 3:
-            return False
-        try:
-            a = int(parts[1])
-            b = int(parts[2])
-        except ValueError:
-            return False
-        return user_id in (a, b)
+        return _is_allowed_dm(user_id, room)
 
     return False
+
+
+async def _allowed_rooms(db: AsyncSession, user_id: int, rooms: list[str]) -> list[str]:
+    # Set-based variant of _is_allowed_room: one membership query for all groups
+    group_rooms = {room: _group_id(room) for room in rooms if room.startswith("group:")}
+    member_of = await member_group_ids(
+        db, user_id, [g for g in group_rooms.values() if g is not None]
+    )
+
+    allowed = []
+    for room in dict.fromkeys(rooms):
+        if room in group_rooms:
+            if group_rooms[room] in member_of:
+                allowed.append(room)
+        elif room.startswith("dm:") and _is_allowed_dm(user_id, room):
+            allowed.append(room)
+    return allowed
@@ -0,0 +1,163 @@
+import asyncio
+import logging
+import os
+import time
+
+from core.metrics import SIZE_BUCKETS, registry
+from core.room_cache import recent_messages
+from core.search import index_message
+from core.serialization import RawJSON
+from realtime.sio import sio
+
+logger = logging.getLogger(__name__)
+
+# Outbound coalescing: with SOCKET_COALESCE_MS > 0, messages for a room are
+# held for up to that window and sent as one "messages" event instead of one
+# "message" event each. Rooms matching SOCKET_COALESCE_BYPASS (comma separated
+# prefixes, e.g. "dm:,group:42") keep immediate per-message emits.
+SOCKET_COALESCE_MS = float(os.getenv("SOCKET_COALESCE_MS", "0"))
+SOCKET_COALESCE_MAX_BATCH = int(os.getenv("SOCKET_COALESCE_MAX_BATCH", "100"))
+SOCKET_COALESCE_BYPASS = tuple(p for p in os.getenv("SOCKET_COALESCE_BYPASS", "dm:").split(",") if p)
+
+emit_recipients = registry.histogram(
+    "socket_emit_recipients", "Local sockets reached per room emit", ("event",), SIZE_BUCKETS
+)
+emit_latency = registry.histogram("socket_emit_duration_seconds", "Room emit latency", ("event",))
+coalesced_batch = registry.histogram(
+    "socket_coalesced_batch_size", "Messages per coalesced room emit", buckets=SIZE_BUCKETS
+)
+
+
+class RoomCoalescer:
+    def __init__(self, window: float, max_batch: int, bypass: tuple[str, ...]):
+        self.window = window
+        self.max_batch = max_batch
+        self.bypass = bypass
+        self._pending: dict[str, list[bytes]] = {}
+        self._timers: dict[str, asyncio.TimerHandle] = {}
+
+    @property
+    def enabled(self) -> bool:
+        return self.window > 0
+
+    def applies_to(self, room: str) -> bool:
+        return self.enabled and not room.startswith(self.bypass)
+
+    def add(self, room: str, bodies: list[bytes]) -> None:
+        pending = self._pending.get(room)
+        if pending is None:
+            pending = self._pending[room] = []
+            self._timers[room] = asyncio.get_running_loop().call_later(self.window, self._due, room)
+        pending.extend(bodies)
+        if len(pending) >= self.max_batch:
+            self._due(room)
+
+    def _due(self, room: str) -> None:
+        _spawn(self._flush(room))
+
+    async def _flush(self, room: str) -> None:
+        bodies = self._pending.pop(room, None)
+        timer = self._timers.pop(room, None)
+        if timer is not None:
+            timer.cancel()
+        if not bodies:
+            return
+        # Over-full batches (a bulk send) still go out in max_batch slices
+        for start in range(0, len(bodies), self.max_batch):
+            chunk = bodies[start:start + self.max_batch]
+            coalesced_batch.observe(len(chunk))
+            try:
+                await _emit("messages", {"room": room, "data": [RawJSON(body) for body in chunk]}, room)
+            except Exception:
+                logger.exception("Coalesced emit to %s failed", room)
+
+    async def flush_all(self) -> None:
+        for room in list(self._pending):
+            await self._flush(room)
+
+
+coalescer = RoomCoalescer(SOCKET_COALESCE_MS / 1000, SOCKET_COALESCE_MAX_BATCH, SOCKET_COALESCE_BYPASS)
+
+# Room emits run as background tasks so a request never waits on fan-out
+_emits: set[asyncio.Task] = set()
+
+
+def _spawn(coro) -> None:
+    task = asyncio.get_running_loop().create_task(coro)
+    _emits.add(task)
+    task.add_done_callback(_emit_done)
+
+
+def _emit_done(task: asyncio.Task) -> None:
+    _emits.discard(task)
+    if not task.cancelled() and task.exception() is not None:
+        logger.error("Room emit failed", exc_info=task.exception())
+
+
+async def drain() -> None:
+    """Send everything still buffered or in flight (shutdown)."""
+    await coalescer.flush_all()
+    if _emits:
+        await asyncio.wait(list(_emits))
+
+
+# Everything that must happen once a message row is durable. `body` is the
+# message already encoded by core.serialization.
+async def message_created(room: str, row, body: bytes) -> None:
+    recent_messages.append(room, row.created_at, row.id, body)
+    index_message(room, row)
+    if coalescer.applies_to(room):
+        coalescer.add(room, [body])
+        return
+    _spawn(_emit("message", {"room": room, "data": RawJSON(body)}, room))
+
+
+async def messages_created(room: str, items: list[tuple]) -> None:
+    for row, body in items:
+        recent_messages.append(room, row.created_at, row.id, body)
+        index_message(room, row)
+    if coalescer.applies_to(room):
+        coalescer.add(room, [body for _, body in items])
+        return
+    _spawn(_emit("messages", {"room": room, "data": [RawJSON(body) for _, body in items]}, room))
+
+
+async def unread_updated(room: str, counts: list[tuple[int, int]]) -> None:
+    """Push unread badge counts to each user's personal room. Group sends
+    report none: clients count a group's unread from its room "message" and
+    "messages" events, and get their own count back after a read."""
+    if counts:
+        _spawn(_emit_badges(room, counts))
+
+
+async def _emit_badges(room: str, counts: list[tuple[int, int]]) -> None:
+    for user_id, unread in counts:
+        await sio.emit("unread", {"room": room, "unread": unread}, room=f"user:{user_id}")
+
+
+async def _emit(event: str, data: dict, room: str) -> None:
+    # Only this worker's sockets are counted; other workers get it via pub/sub
+    emit_recipients.labels(event).observe(len(sio.manager.rooms.get("/", {}).get(room, ())))
+    start = time.perf_counter()
+    await sio.emit(event, data, room=room)
+    emit_latency.labels(event).observe(time.perf_counter() - start)
+
+
+async def members_changed(group_id: int, user_ids: list[int], joined: bool) -> None:
+    """Move the users' connected sockets in or out of the group room on every
+    worker, then tell them with "group_joined" / "group_left"."""
+    if not user_ids:
+        return
+    room = f"group:{group_id}"
+    await sio.manager.sync_user_rooms(user_ids, room, joined)
+    if joined:
+        # Imported here: realtime.presence imports realtime.sio, which imports realtime.events
+        from realtime.presence import presence
+
+        # Tell the room which of the new members are online
+        for user_id in user_ids:
+            if presence.status_of(user_id) != "offline":
+                presence.joined(user_id, room)
+    # One packet for all of them; sio.emit accepts a list of rooms
+    event = "group_joined" if joined else "group_left"
+    _spawn(sio.emit(event, {"room": room, "group_id": group_id}, room=[f"user:{u}" for u in user_ids]))
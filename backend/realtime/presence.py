@@ -0,0 +1,261 @@
+import asyncio
+import logging
+import os
+import time
+from typing import Iterable, Optional
+
+from core.metrics import registry
+from realtime.sio import sio
+
+logger = logging.getLogger(__name__)
+
+# Presence and typing never touch the database. Each worker tracks its own
+# sockets, collects changes per room and emits them once per tick. With a
+# message queue (realtime/pubsub.py) workers also publish their users' status,
+# room occupancy and typing each tick, plus their full state every
+# PRESENCE_SYNC_SECONDS, so a user is shown as online while any worker holds
+# one of their sockets. A worker silent for three syncs is forgotten.
+PRESENCE_TICK_MS = float(os.getenv("PRESENCE_TICK_MS", "500"))
+PRESENCE_SYNC_SECONDS = float(os.getenv("PRESENCE_SYNC_SECONDS", "15"))
+TYPING_TTL_SECONDS = float(os.getenv("TYPING_TTL_SECONDS", "6"))  # typing expires unless refreshed
+TYPING_MIN_INTERVAL = float(os.getenv("TYPING_MIN_INTERVAL", "1"))  # accepted typing events per user+room
+
+STATUSES = ("online", "in_match", "away")
+SHARED_ROOM_PREFIXES = ("group:", "dm:")
+
+online_users = registry.gauge("presence_online_users", "Users with at least one socket on this worker")
+presence_emits = registry.counter("presence_emits_total", "Batched presence/typing emits", ("event",))
+typing_dropped = registry.counter("typing_dropped_total", "Typing events dropped by the server-side throttle")
+
+
+def shared_rooms(sid: str) -> list[str]:
+    return [room for room in sio.rooms(sid) if room.startswith(SHARED_ROOM_PREFIXES)]
+
+
+class PresenceRegistry:
+    def __init__(self, tick: float, typing_ttl: float, typing_interval: float, sync_interval: float):
+        self.tick = tick
+        self.sync_interval = sync_interval
+        self.typing_ttl = typing_ttl
+        self.typing_interval = typing_interval
+        self.sessions: dict[int, set[str]] = {}
+        self.sid_users: dict[str, int] = {}
+        self.status: dict[int, str] = {}
+        # room -> {user_id: status} changed since the last tick ("offline" included)
+        self._changed: dict[str, dict[int, str]] = {}
+        # room -> {user_id: typing expiry}
+        self._typing: dict[str, dict[int, float]] = {}
+        self._typing_changed: set[str] = set()
+        self._typing_accepted: dict[tuple[int, str], float] = {}
+        # Local users whose status changed, and rooms whose local occupants
+        # changed, since the last publish
+        self._dirty: set[int] = set()
+        self._rooms_changed: set[str] = set()
+        self._last_sync = float("-inf")
+        # host_id -> {"users": {user_id: status}, "rooms": {room: [user_id]},
+        #             "typing": {room: [user_id]}, "seen": monotonic}
+        self._remote: dict[str, dict] = {}
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self) -> None:
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    def connected(self, sid: str, user_id: int, rooms: Iterable[str]) -> None:
+        sids = self.sessions.setdefault(user_id, set())
+        sids.add(sid)
+        self.sid_users[sid] = user_id
+        if len(sids) == 1:
+            self.status[user_id] = "online"
+            self._dirty.add(user_id)
+            online_users.set(len(self.sessions))
+        rooms = list(rooms)
+        self._rooms_changed.update(rooms)
+        self._announce(user_id, rooms)
+
+    def disconnected(self, sid: str, user_id: int, rooms: Iterable[str]) -> None:
+        self.sid_users.pop(sid, None)
+        sids = self.sessions.get(user_id)
+        if not sids:
+            return
+        sids.discard(sid)
+        rooms = list(rooms)
+        self._rooms_changed.update(rooms)
+        if not sids:
+            del self.sessions[user_id]
+            self.status.pop(user_id, None)
+            self._dirty.add(user_id)
+            online_users.set(len(self.sessions))
+            for room in rooms:
+                self._stop_typing(user_id, room)
+        self._announce(user_id, rooms)
+
+    def joined(self, user_id: int, room: str) -> None:
+        self._rooms_changed.add(room)
+        self._announce(user_id, [room])
+
+    def left(self, user_id: int, room: str) -> None:
+        """A socket of the user left `room`: their typing there ends unless
+        another of their sockets is still in it."""
+        self._rooms_changed.add(room)
+        if not any(room in shared_rooms(sid) for sid in self.sessions.get(user_id, ())):
+            self._typing_accepted.pop((user_id, room), None)
+            self._stop_typing(user_id, room)
+
+    def set_status(self, user_id: int, status: str, rooms: Iterable[str]) -> None:
+        if user_id in self.sessions and self.status.get(user_id) != status:
+            self.status[user_id] = status
+            self._dirty.add(user_id)
+            self._announce(user_id, rooms)
+
+    def moved(self, room: str) -> None:
+        """Sockets on this worker were moved in or out of `room` (membership sync)."""
+        self._rooms_changed.add(room)
+
+    def status_of(self, user_id: int) -> str:
+        """Status on this worker, else on any other worker, else offline."""
+        status = self.status.get(user_id)
+        if status is None:
+            status = next((host["users"][user_id] for host in self._remote.values() if user_id in host["users"]), None)
+        return status or "offline"
+
+    def typers(self, room: str) -> list[int]:
+        user_ids = set(self._typing.get(room, ()))
+        for host in self._remote.values():
+            user_ids.update(host["typing"].get(room, ()))
+        return list(user_ids)
+
+    def remote_update(self, host_id: str, data: dict) -> None:
+        """Apply another worker's published state (see flush)."""
+        host = self._remote.get(host_id)
+        if host is None or data.get("full"):
+            host = self._remote[host_id] = {"users": {}, "rooms": {}, "typing": {}}
+        host["seen"] = time.monotonic()
+        for user_id, status in data.get("users", ()):
+            if status == "offline":
+                host["users"].pop(user_id, None)
+            else:
+                host["users"][user_id] = status
+        for key in ("rooms", "typing"):
+            for room, user_ids in (data.get(key) or {}).items():
+                if user_ids:
+                    host[key][room] = user_ids
+                else:
+                    host[key].pop(room, None)
+
+    def typing(self, user_id: int, room: str, active: bool) -> bool:
+        """Record a typing start/stop; returns False if it was throttled away."""
+        if not active:
+            self._typing_accepted.pop((user_id, room), None)
+            self._stop_typing(user_id, room)
+            return True
+
+        now = time.monotonic()
+        key = (user_id, room)
+        if now - self._typing_accepted.get(key, float("-inf")) < self.typing_interval:
+            typing_dropped.inc()
+            return False
+        self._typing_accepted[key] = now
+
+        typers = self._typing.setdefault(room, {})
+        if user_id not in typers:
+            self._typing_changed.add(room)
+        typers[user_id] = now + self.typing_ttl  # a refresh alone is not a change
+        return True
+
+    def snapshot(self, room: str) -> dict[int, str]:
+        """Status of the users with a socket in `room` on any worker."""
+        user_ids = set(self._local_occupants(room))
+        for host in self._remote.values():
+            user_ids.update(host["rooms"].get(room, ()))
+        statuses = {user_id: self.status_of(user_id) for user_id in user_ids}
+        return {user_id: status for user_id, status in statuses.items() if status != "offline"}
+
+    def _local_occupants(self, room: str) -> list[int]:
+        sids = sio.manager.rooms.get("/", {}).get(room, {})
+        return list({self.sid_users[sid] for sid in sids if sid in self.sid_users})
+
+    def _announce(self, user_id: int, rooms: Iterable[str]) -> None:
+        status = self.status_of(user_id)
+        for room in rooms:
+            self._changed.setdefault(room, {})[user_id] = status
+
+    def _stop_typing(self, user_id: int, room: str) -> None:
+        typers = self._typing.get(room)
+        if typers and typers.pop(user_id, None) is not None:
+            self._typing_changed.add(room)
+            if not typers:
+                del self._typing[room]
+
+    def _expire_typing(self, now: float) -> None:
+        for room, typers in list(self._typing.items()):
+            expired = [user_id for user_id, expires in typers.items() if expires <= now]
+            for user_id in expired:
+                self._stop_typing(user_id, room)
+        cutoff = now - self.typing_interval
+        self._typing_accepted = {k: t for k, t in self._typing_accepted.items() if t > cutoff}
+
+    def _expire_hosts(self, now: float) -> None:
+        for host_id, host in list(self._remote.items()):
+            if now - host["seen"] > 3 * self.sync_interval:
+                del self._remote[host_id]
+                self._typing_changed.update(host["typing"])
+
+    async def flush(self) -> None:
+        now = time.monotonic()
+        self._expire_typing(now)
+        self._expire_hosts(now)
+
+        changed, self._changed = self._changed, {}
+        for room, users in changed.items():
+            await sio.emit("presence", {"room": room, "users": users}, room=room)
+            presence_emits.labels("presence").inc()
+
+        typing_rooms, self._typing_changed = self._typing_changed, set()
+        for room in typing_rooms:
+            await sio.emit("typing", {"room": room, "user_ids": self.typers(room)}, room=room)
+            presence_emits.labels("typing").inc()
+
+        await self._publish(now, typing_rooms)
+
+    async def _publish(self, now: float, typing_rooms: set[str]) -> None:
+        dirty, self._dirty = self._dirty, set()
+        rooms_changed, self._rooms_changed = self._rooms_changed, set()
+        if now - self._last_sync >= self.sync_interval:
+            self._last_sync = now
+            rooms = (room for room in sio.manager.rooms.get("/", {}) if room.startswith(SHARED_ROOM_PREFIXES))
+            data = {
+                "full": True,
+                "users": list(self.status.items()),
+                "rooms": {room: occupants for room in rooms if (occupants := self._local_occupants(room))},
+                "typing": {room: list(typers) for room, typers in self._typing.items()},
+            }
+        elif dirty or rooms_changed or typing_rooms:
+            data = {
+                "users": [(user_id, self.status.get(user_id, "offline")) for user_id in dirty],
+                "rooms": {room: self._local_occupants(room) for room in rooms_changed},
+                "typing": {room: list(self._typing.get(room, ())) for room in typing_rooms},
+            }
+        else:
+            return
+        await sio.manager.publish_presence(data)
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.tick)
+            try:
+                await self.flush()
+            except Exception:
+                logger.exception("Presence flush failed")
+
+
+presence = PresenceRegistry(PRESENCE_TICK_MS / 1000, TYPING_TTL_SECONDS, TYPING_MIN_INTERVAL, PRESENCE_SYNC_SECONDS)
@@ -0,0 +1,219 @@
+import asyncio
+import os
+import time
+from datetime import datetime
+from typing import Optional
+
+import socketio
+from pydantic_core import to_json
+from socketio.async_pubsub_manager import AsyncPubSubManager
+
+from core.membership import invalidate_membership
+from core.room_cache import recent_messages
+
+# Cross-worker fan-out for room emits and room membership changes.
+#   unset          -> in-process only (single worker)
+#   redis://...    -> socketio.AsyncRedisManager (any Redis-compatible server)
+#   postgresql://  -> AsyncPostgresManager below (LISTEN/NOTIFY)
+#   database       -> LISTEN/NOTIFY on the same Postgres as DATABASE_URL
+SIO_MESSAGE_QUEUE = os.getenv("SIO_MESSAGE_QUEUE", "")
+SIO_CHANNEL = os.getenv("SIO_CHANNEL", "socketio")
+
+# NOTIFY payloads are capped at 8000 bytes; larger ones are parked in a table
+NOTIFY_MAX_BYTES = 7500
+PAYLOAD_TTL_SECONDS = 300
+
+
+# Internal event moving a user's sockets in or out of a room on every worker.
+# It travels as a regular pub/sub emit and is consumed by RoomSyncMixin, so it
+# is never delivered to clients.
+ROOM_SYNC_EVENT = "__room_sync"
+# Internal event carrying a worker's presence and typing state to the others
+# (consumed by realtime.presence, never delivered to clients).
+PRESENCE_SYNC_EVENT = "__presence_sync"
+
+
+class RoomSyncMixin:
+    """Client manager mixin: change the rooms of users' connected sockets,
+    found through their personal "user:{id}" room, on whichever worker holds
+    them. Other workers also drop their cached membership of those users.
+    The same channel carries presence state between workers."""
+
+    async def sync_user_rooms(self, user_ids: list[int], room: str, join: bool) -> None:
+        await self._sync_local_rooms(user_ids, room, join)
+        if isinstance(self, AsyncPubSubManager):
+            await self._publish({
+                "method": "emit", "event": ROOM_SYNC_EVENT, "namespace": "/", "host_id": self.host_id,
+                "data": {"user_ids": list(user_ids), "room": room, "join": join},
+            })
+
+    async def publish_presence(self, data: dict) -> None:
+        if isinstance(self, AsyncPubSubManager):
+            await self._publish({
+                "method": "emit", "event": PRESENCE_SYNC_EVENT, "namespace": "/", "host_id": self.host_id,
+                "data": data,
+            })
+
+    async def _sync_local_rooms(self, user_ids: list[int], room: str, join: bool) -> None:
+        # Imported here: realtime.presence imports realtime.sio, which imports this module
+        from realtime.presence import presence
+
+        for user_id in user_ids:
+            for sid, eio_sid in list(self.get_participants("/", f"user:{user_id}")):
+                if join:
+                    self.basic_enter_room(sid, "/", room, eio_sid=eio_sid)
+                else:
+                    self.basic_leave_room(sid, "/", room)
+        presence.moved(room)
+
+    async def _handle_emit(self, message):
+        if message.get("event") == PRESENCE_SYNC_EVENT:
+            # Imported here: realtime.presence imports realtime.sio, which imports this module
+            from realtime.presence import presence
+
+            presence.remote_update(message.get("host_id"), message.get("data") or {})
+            return
+        if message.get("event") != ROOM_SYNC_EVENT:
+            if message.get("host_id") != getattr(self, "host_id", None):
+                _mirror_messages(message)
+            await super()._handle_emit(message)
+            return
+        data = message.get("data") or {}
+        user_ids, room = data.get("user_ids", []), data.get("room")
+        if isinstance(room, str) and room.startswith("group:"):
+            # The writing worker invalidated its own cache; this clears every
+            # other worker's, so a removed member loses access everywhere
+            group_id = int(room.partition(":")[2])
+            for user_id in user_ids:
+                invalidate_membership(group_id, user_id)
+        await self._sync_local_rooms(user_ids, room, bool(data.get("join")))
+
+
+def _mirror_messages(message: dict) -> None:
+    # New messages reach every worker as the room's "message"/"messages" emit;
+    # replaying them into recent_messages keeps each worker's newest page current
+    if message.get("event") not in ("message", "messages") or message.get("binary"):
+        return
+    args = message.get("data") or [None]
+    payload = args[0] if isinstance(args, list) else args
+    if not isinstance(payload, dict) or payload.get("room") != message.get("room"):
+        return  # direct emits to one socket (catch-up) are not new messages
+    items = payload.get("data")
+    for item in items if isinstance(items, list) else [items]:
+        if isinstance(item, dict) and "id" in item and "created_at" in item:
+            recent_messages.append(payload["room"], datetime.fromisoformat(item["created_at"]), item["id"], to_json(item))
+
+
+class LocalManager(RoomSyncMixin, socketio.AsyncManager):
+    pass
+
+
+class RedisManager(RoomSyncMixin, socketio.AsyncRedisManager):
+    pass
+
+
+class AsyncPostgresManager(RoomSyncMixin, AsyncPubSubManager):
+    name = "asyncpg"
+
+    def __init__(self, url: str, channel: str = "socketio", write_only: bool = False, logger=None, json=None):
+        super().__init__(channel=channel, write_only=write_only, logger=logger, json=json)
+        self.url = url
+        self._pool = None
+        self._pool_lock = asyncio.Lock()
+        self._last_cleanup = 0.0
+
+    async def _get_pool(self):
+        import asyncpg
+
+        async with self._pool_lock:
+            if self._pool is None:
+                self._pool = await asyncpg.create_pool(self.url, min_size=1, max_size=4)
+                await self._pool.execute(
+                    "CREATE UNLOGGED TABLE IF NOT EXISTS socketio_payloads ("
+                    "id BIGSERIAL PRIMARY KEY, payload TEXT NOT NULL, "
+                    "created_at TIMESTAMPTZ NOT NULL DEFAULT now())"
+                )
+        return self._pool
+
+    async def _publish(self, data):
+        payload = self.json.dumps(data)
+        for retries_left in (1, 0):
+            try:
+                pool = await self._get_pool()
+                async with pool.acquire() as conn:
+                    if len(payload.encode()) > NOTIFY_MAX_BYTES:
+                        payload_id = await conn.fetchval(
+                            "INSERT INTO socketio_payloads (payload) VALUES ($1) RETURNING id", payload
+                        )
+                        await conn.execute("SELECT pg_notify($1, $2)", self.channel, f"@{payload_id}")
+                        await self._cleanup(conn)
+                    else:
+                        await conn.execute("SELECT pg_notify($1, $2)", self.channel, payload)
+                return
+            except Exception as exc:
+                self._get_logger().error(
+                    "Cannot publish to postgres%s", "... retrying" if retries_left else "... giving up",
+                    extra={"postgres_exception": str(exc)},
+                )
+
+    async def _cleanup(self, conn) -> None:
+        now = time.monotonic()
+        if now - self._last_cleanup < 60:
+            return
+        self._last_cleanup = now
+        await conn.execute(
+            "DELETE FROM socketio_payloads WHERE created_at < now() - make_interval(secs => $1)",
+            PAYLOAD_TTL_SECONDS,
+        )
+
+    async def _listen(self):
+        import asyncpg
+
+        retry_sleep = 1
+        while True:
+            queue: asyncio.Queue = asyncio.Queue()
+            conn: Optional[asyncpg.Connection] = None
+            try:
+                conn = await asyncpg.connect(self.url)
+                await conn.add_listener(self.channel, lambda _c, _pid, _ch, payload: queue.put_nowait(payload))
+                retry_sleep = 1
+                while not conn.is_closed():
+                    try:
+                        payload = await asyncio.wait_for(queue.get(), timeout=5)
+                    except asyncio.TimeoutError:
+                        continue
+                    if payload.startswith("@"):
+                        payload = await conn.fetchval(
+                            "SELECT payload FROM socketio_payloads WHERE id = $1", int(payload[1:])
+                        )
+                        if payload is None:
+                            continue
+                    yield payload
+            except (OSError, asyncpg.PostgresError) as exc:
+                self._get_logger().error(
+                    "Cannot receive from postgres... retrying in %s secs", retry_sleep,
+                    extra={"postgres_exception": str(exc)},
+                )
+            finally:
+                if conn is not None and not conn.is_closed():
+                    await conn.close()
+            await asyncio.sleep(retry_sleep)
+            retry_sleep = min(retry_sleep * 2, 60)
+
+
+def _asyncpg_url(url: str) -> str:
+    # DATABASE_URL is an SQLAlchemy URL ("postgresql+asyncpg://"), asyncpg wants a plain DSN
+    scheme, rest = url.split("://", 1)
+    return "postgresql://" + rest if scheme.startswith("postgres") else url
+
+
+def create_client_manager(url: str = SIO_MESSAGE_QUEUE, channel: str = SIO_CHANNEL):
+    if not url:
+        return LocalManager()
+    if url == "database":
+        url = os.getenv("DATABASE_URL", "")
+    if url.startswith(("redis://", "rediss://", "unix://")):
+        return RedisManager(url, channel=channel)
+    if url.startswith("postgres"):
+        return AsyncPostgresManager(_asyncpg_url(url), channel=channel)
+    raise RuntimeError(f"Unsupported SIO_MESSAGE_QUEUE: {url}")
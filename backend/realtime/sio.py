@@ -1,8 +1,29 @@
 import socketio
 
-sio = socketio.AsyncServer(
+from core.serialization import socket_json
+from realtime.backpressure import BackpressureServer
+from realtime.compact import CompactEncodingMixin
+from realtime.pubsub import create_client_manager
+
+# Running more than one worker/node:
+#   - set SIO_MESSAGE_QUEUE (see realtime/pubsub.py) so room emits reach
+#     sockets connected to every worker, not only the one that handled the POST;
+#   - socket.io's long-polling transport needs sticky sessions: every request of
+#     a session must hit the worker that created it. Either give each worker its
+#     own port behind a proxy with affinity (nginx `ip_hash`/`hash $cookie_io`),
+#     or have clients connect with `transports: ["websocket"]` only.
+#     `uvicorn --workers N` on a single port is NOT sticky.
+
+
+class ChatServer(CompactEncodingMixin, BackpressureServer):
+    pass
+
+
+sio = ChatServer(
     async_mode="asgi",
     cors_allowed_origins=[],  # tighten later
+    json=socket_json,
+    client_manager=create_client_manager(),
 )
 
 socket_app = socketio.ASGIApp(sio)
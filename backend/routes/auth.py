@@ -1,17 +1,20 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Response
 from sqlalchemy import select
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from core.security import hash_password, verify_password, create_access_token
+from core.principal import Principal, revoke_user, token_claims
+from core.hashing import hash_password_async, verify_password_async
+from core.security import create_access_token
 from database import get_db
-from deps.auth import get_current_user
+from deps.auth import get_current_principal, get_current_user
+from deps.ratelimit import limit_ip
 from models import User
 from schemas import UserCreate, UserLogin, UserOut
 
 router = APIRouter()
 
 
-@router.post("/register")
+@router.post("/register", dependencies=[limit_ip("auth:ip")])
 async def register(user: UserCreate, db: AsyncSession = Depends(get_db)):
     result = await db.execute(select(User).where(User.username == user.username))
     existing_user = result.scalar_one_or_none()
@@ -21,7 +24,7 @@ async def register(user: UserCreate, db: AsyncSession = Depends(get_db)):
     new_user = User(
         username=user.username,
         email=user.email,
-        hashed_password=hash_password(user.password),
+        hashed_password=await hash_password_async(user.password),
     )
 
     db.add(new_user)
@@ -30,18 +33,39 @@ async def register(user: UserCreate, db: AsyncSession = Depends(get_db)):
     return {"message": "User registered successfully", "id": new_user.id}
 
 
-@router.post("/login")
+@router.post("/login", dependencies=[limit_ip("auth:ip")])
 async def login_user(user: UserLogin, db: AsyncSession = Depends(get_db)):
     result = await db.execute(select(User).where(User.username == user.username))
     existing_user = result.scalar_one_or_none()
 
-    if not existing_user or not verify_password(user.password, existing_user.hashed_password):
+    if not existing_user or not await verify_password_async(user.password, existing_user.hashed_password):
         raise HTTPException(status_code=400, detail="Invalid username or password")
+    if existing_user.is_active is False:
+        raise HTTPException(status_code=403, detail="Account is deactivated")
 
-    token = create_access_token(subject=str(existing_user.id))
+    token = create_access_token(subject=str(existing_user.id), claims=token_claims(existing_user))
     return {"access_token": token, "token_type": "bearer"}
 
 
 @router.get("/me", response_model=UserOut)
 async def read_current_user(current_user: User = Depends(get_current_user)):
     return current_user
+
+
+# Both revoke every token issued to the user so far, on every device
+@router.post("/logout", status_code=204)
+async def logout(
+    current_user: Principal = Depends(get_current_principal),
+    db: AsyncSession = Depends(get_db),
+):
+    await revoke_user(db, current_user.id)
+    return Response(status_code=204)
+
+
+@router.post("/deactivate", status_code=204)
+async def deactivate(
+    current_user: Principal = Depends(get_current_principal),
+    db: AsyncSession = Depends(get_db),
+):
+    await revoke_user(db, current_user.id, deactivate=True)
+    return Response(status_code=204)
@@ -0,0 +1,80 @@
+from fastapi import APIRouter, Depends
+from sqlalchemy import Integer, and_, case, cast, func, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from core.principal import Principal
+from core.read_state import unread_after
+from database import get_db
+from deps.auth import get_current_principal
+from models import GroupMessage, PrivateMessage, ReadCursor
+from schemas import ConversationOut
+
+router = APIRouter()
+
+PREVIEW_CHARS = 100
+
+
+def _conversation(cursor, user_id: int) -> dict:
+    kind, _, rest = cursor.conversation_key.partition(":")
+    item = {
+        "conversation_key": cursor.conversation_key,
+        "kind": kind,
+        "last_read_message_id": cursor.last_read_message_id,
+        "unread_count": cursor.unread_count,
+        "last_activity_at": cursor.last_activity_at,
+        "last_message_id": cursor.last_message_id,
+        "last_sender_id": cursor.last_sender_id,
+        "last_message_preview": cursor.last_message_preview,
+    }
+    if kind == "group":
+        item["group_id"] = int(rest)
+    else:
+        a, b = (int(part) for part in rest.split(":"))
+        item["peer_id"] = b if a == user_id else a
+    return item
+
+
+@router.get("", response_model=list[ConversationOut])
+async def list_conversations(
+    current_user: Principal = Depends(get_current_principal),
+    db: AsyncSession = Depends(get_db),
+):
+    # DM cursors carry their unread count and newest message id, maintained on
+    # insert. Group cursors are not written per message (core.read_state), so
+    # their newest message and capped unread count come from the
+    # (group_id, created_at, id) index: two index probes per group.
+    is_group = ReadCursor.conversation_key.startswith("group:")
+    group_id = cast(func.substr(ReadCursor.conversation_key, len("group:") + 1), Integer)
+    newest_group_message = (
+        select(GroupMessage.id)
+        .where(GroupMessage.group_id == group_id)
+        .order_by(GroupMessage.created_at.desc(), GroupMessage.id.desc())
+        .limit(1)
+        .correlate(ReadCursor)
+        .scalar_subquery()
+    )
+    private = and_(
+        ReadCursor.conversation_key.startswith("dm:"), PrivateMessage.id == ReadCursor.last_message_id,
+    )
+    group = and_(is_group, GroupMessage.id == newest_group_message)
+    last_activity_at = func.coalesce(GroupMessage.created_at, ReadCursor.last_activity_at)
+    result = await db.execute(
+        select(
+            ReadCursor.conversation_key,
+            ReadCursor.last_read_message_id,
+            case(
+                (is_group, unread_after(GroupMessage, GroupMessage.group_id == group_id, ReadCursor.last_read_message_id)),
+                else_=ReadCursor.unread_count,
+            ).label("unread_count"),
+            case((is_group, GroupMessage.id), else_=ReadCursor.last_message_id).label("last_message_id"),
+            last_activity_at.label("last_activity_at"),
+            func.coalesce(PrivateMessage.sender_id, GroupMessage.sender_id).label("last_sender_id"),
+            func.substr(func.coalesce(PrivateMessage.content, GroupMessage.content), 1, PREVIEW_CHARS)
+            .label("last_message_preview"),
+        )
+        .outerjoin(PrivateMessage, private)
+        .outerjoin(GroupMessage, group)
+        .where(ReadCursor.user_id == current_user.id)
+        .order_by(last_activity_at.desc(), ReadCursor.conversation_key)
+    )
+    return [_conversation(cursor, current_user.id) for cursor in result.all()]
@@ -1,90 +1,259 @@
-from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy import select, and_, desc
+from datetime import datetime, timezone
+from typing import Optional
+
+from fastapi import APIRouter, Depends, HTTPException, Query, Response
+from sqlalchemy import DateTime, Integer, delete, literal, select
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from database import get_db
-from deps.auth import get_current_user
-from models import User, Group, GroupMember, GroupMessage
-from schemas import GroupCreate, GroupOut, GroupMessageCreate, GroupMessageOut
-from realtime.sio import sio
+from core.membership import invalidate_membership, is_member
+from core.message_writer import persist_message
+from core.pagination import MAX_PAGE_SIZE, decode_token, encode_token
+from core.read_state import mark_read
+from core.room_cache import history_page
+from core.serialization import GROUP_MESSAGE_FIELDS, group_message_json
+from database import dialect_insert, get_db
+from core.principal import Principal
+from deps.auth import get_current_principal
+from deps.ratelimit import enforce_rate_limit, limit_ip, limit_user
+from models import Group, GroupMember, GroupMessage, ReadCursor, User
+from schemas import (
+    GroupCreate, GroupMemberPage, GroupMembersResult, GroupMembersUpdate, GroupOut, GroupMessageCreate,
+    GroupMessageOut, GroupMessagePage, ReadCursorOut, ReadCursorUpdate,
+)
+from realtime.fanout import members_changed, message_created, unread_updated
 
 router = APIRouter()
 
+GROUP_MESSAGE_COLUMNS = [getattr(GroupMessage, field) for field in GROUP_MESSAGE_FIELDS]
+
 
 async def _require_membership(db: AsyncSession, group_id: int, user_id: int) -> None:
-    membership_query = await db.execute(
-        select(GroupMember).where(
-            and_(GroupMember.group_id == group_id, GroupMember.user_id == user_id)
-        )
-    )
-    if not membership_query.scalar_one_or_none():
+    if not await is_member(db, group_id, user_id):
         raise HTTPException(status_code=403, detail="Not a member of the group")
 
 
+async def _require_creator(db: AsyncSession, group_id: int, user_id: int) -> None:
+    # Adding or removing other people is limited to the group creator
+    created_by = (await db.execute(select(Group.created_by).where(Group.id == group_id))).scalar_one_or_none()
+    if created_by != user_id:
+        raise HTTPException(status_code=403, detail="Only the group creator can change other members")
+
+
+def _member_cursor(cursor: str) -> int:
+    try:
+        (user_id,) = decode_token(cursor)
+        return int(user_id)
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
 @router.post("", response_model=GroupOut)
 async def create_group(
     group: GroupCreate,
-    current_user: User = Depends(get_current_user),
+    current_user: Principal = Depends(get_current_principal),
     db: AsyncSession = Depends(get_db),
 ):
     new_group = Group(name=group.name, created_by=current_user.id)
     db.add(new_group)
-    await db.commit()
-    await db.refresh(new_group)
+    await db.flush()  # assigns the id; group and membership commit together
 
     db.add(GroupMember(group_id=new_group.id, user_id=current_user.id))
+    db.add(ReadCursor(user_id=current_user.id, conversation_key=f"group:{new_group.id}"))
     await db.commit()
+    invalidate_membership(new_group.id, current_user.id)
+    await members_changed(new_group.id, [current_user.id], True)
 
     return new_group
 
 
-@router.post("/{group_id}/messages", response_model=GroupMessageOut)
+@router.post(
+    "/{group_id}/members",
+    response_model=GroupMembersResult,
+    dependencies=[limit_user("members:user")],
+)
+async def add_group_members(
+    group_id: int,
+    update: GroupMembersUpdate,
+    current_user: Principal = Depends(get_current_principal),
+    db: AsyncSession = Depends(get_db),
+):
+    await _require_creator(db, group_id, current_user.id)
+    user_ids = list(dict.fromkeys(update.user_ids))
+    now = datetime.now(timezone.utc)
+
+    # One INSERT ... SELECT: unknown users are filtered by the join against
+    # users, existing members by ON CONFLICT DO NOTHING
+    insert = dialect_insert(db)
+    stmt = insert(GroupMember).from_select(
+        ["group_id", "user_id", "joined_at"],
+        select(literal(group_id), User.id, literal(now, DateTime(timezone=True))).where(User.id.in_(user_ids)),
+    )
+    stmt = stmt.on_conflict_do_nothing(index_elements=[GroupMember.group_id, GroupMember.user_id])
+    added = list((await db.execute(stmt.returning(GroupMember.user_id))).scalars())
+
+    if added:
+        # New members start with the history read
+        room = f"group:{group_id}"
+        newest = (
+            await db.execute(
+                select(GroupMessage.id)
+                .where(GroupMessage.group_id == group_id)
+                .order_by(GroupMessage.created_at.desc(), GroupMessage.id.desc())
+                .limit(1)
+            )
+        ).scalar_one_or_none()
+        stmt = insert(ReadCursor).from_select(
+            ["user_id", "conversation_key", "last_read_message_id", "unread_count",
+             "last_message_id", "last_activity_at", "updated_at"],
+            select(
+                User.id, literal(room), literal(newest or 0), literal(0),
+                literal(newest, Integer), literal(now, DateTime(timezone=True)), literal(now, DateTime(timezone=True)),
+            ).where(User.id.in_(added)),
+        )
+        await db.execute(stmt.on_conflict_do_nothing(index_elements=[ReadCursor.user_id, ReadCursor.conversation_key]))
+    await db.commit()
+
+    for user_id in added:
+        invalidate_membership(group_id, user_id)
+    await members_changed(group_id, added, True)
+    unchanged = set(user_ids) - set(added)
+    return {"changed": added, "unchanged": [u for u in user_ids if u in unchanged]}
+
+
+@router.post(
+    "/{group_id}/members/remove",
+    response_model=GroupMembersResult,
+    dependencies=[limit_user("members:user")],
+)
+async def remove_group_members(
+    group_id: int,
+    update: GroupMembersUpdate,
+    current_user: Principal = Depends(get_current_principal),
+    db: AsyncSession = Depends(get_db),
+):
+    await _require_membership(db, group_id, current_user.id)
+    user_ids = list(dict.fromkeys(update.user_ids))
+    if user_ids != [current_user.id]:
+        # Anyone may leave; removing others is the creator's call
+        await _require_creator(db, group_id, current_user.id)
+
+    result = await db.execute(
+        delete(GroupMember)
+        .where(GroupMember.group_id == group_id, GroupMember.user_id.in_(user_ids))
+        .returning(GroupMember.user_id)
+    )
+    removed = list(result.scalars())
+    if removed:
+        await db.execute(
+            delete(ReadCursor)
+            .where(ReadCursor.conversation_key == f"group:{group_id}", ReadCursor.user_id.in_(removed))
+        )
+    await db.commit()
+
+    for user_id in removed:
+        invalidate_membership(group_id, user_id)
+    await members_changed(group_id, removed, False)
+    unchanged = set(user_ids) - set(removed)
+    return {"changed": removed, "unchanged": [u for u in user_ids if u in unchanged]}
+
+
+@router.get("/{group_id}/members", response_model=GroupMemberPage)
+async def list_group_members(
+    group_id: int,
+    current_user: Principal = Depends(get_current_principal),
+    limit: int = Query(50, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    db: AsyncSession = Depends(get_db),
+):
+    await _require_membership(db, group_id, current_user.id)
+
+    # Keyset on user_id, served by uq_group_members_group_user
+    query = (
+        select(GroupMember.user_id, User.username, GroupMember.joined_at)
+        .join(User, User.id == GroupMember.user_id)
+        .where(GroupMember.group_id == group_id)
+    )
+    if cursor is not None:
+        query = query.where(GroupMember.user_id > _member_cursor(cursor))
+    rows = (await db.execute(query.order_by(GroupMember.user_id).limit(limit + 1))).all()
+
+    next_cursor = encode_token([rows[limit - 1].user_id]) if len(rows) > limit else None
+    return {"items": [row._asdict() for row in rows[:limit]], "next_cursor": next_cursor}
+
+
+@router.post(
+    "/{group_id}/messages",
+    response_model=GroupMessageOut,
+    dependencies=[limit_ip("message:ip"), limit_user("message:user")],
+)
 async def create_group_message(
     group_id: int,
     message: GroupMessageCreate,
-    current_user: User = Depends(get_current_user),
+    current_user: Principal = Depends(get_current_principal),
     db: AsyncSession = Depends(get_db),
 ):
+    # Membership first, so outsiders cannot drain the room's bucket
     await _require_membership(db, group_id, current_user.id)
+    await enforce_rate_limit("message:room", f"group:{group_id}")
 
-    new_message = GroupMessage(
+    room = f"group:{group_id}"
+    new_message, unread = await persist_message(
+        db,
+        GroupMessage,
+        room,
         group_id=group_id,
         sender_id=current_user.id,
         content=message.content,
     )
 
-    db.add(new_message)
-    await db.commit()
-    await db.refresh(new_message)
-
-    room = f"group:{group_id}"
-    payload = GroupMessageOut.model_validate(new_message).model_dump(mode="json")
-    await sio.emit("message", {"room": room, "data": payload}, room=room)
+    body = group_message_json(new_message)
+    await message_created(room, new_message, body)
+    await unread_updated(room, unread)
 
-    return new_message
+    return Response(body, media_type="application/json")
 
 
-@router.get("/{group_id}/messages", response_model=list[GroupMessageOut])
+@router.get("/{group_id}/messages", response_model=GroupMessagePage)
 async def get_group_messages(
     group_id: int,
-    current_user: User = Depends(get_current_user),
-    limit: int = 50,
+    current_user: Principal = Depends(get_current_principal),
+    limit: int = Query(50, ge=1, le=MAX_PAGE_SIZE),
+    before: Optional[str] = None,
+    after: Optional[str] = None,
     db: AsyncSession = Depends(get_db),
 ):
     await _require_membership(db, group_id, current_user.id)
 
-    messages_query = await db.execute(
-        select(GroupMessage)
-        .where(GroupMessage.group_id == group_id)
-        .order_by(desc(GroupMessage.created_at))
-        .limit(limit)
+    query = select(*GROUP_MESSAGE_COLUMNS).where(GroupMessage.group_id == group_id)
+    body = await history_page(
+        db, f"group:{group_id}", query, GroupMessage, group_message_json, limit, before, after
     )
-    return messages_query.scalars().all()
+    return Response(body, media_type="application/json")
+
+
+@router.post("/{group_id}/read", response_model=ReadCursorOut)
+async def mark_group_read(
+    group_id: int,
+    update: ReadCursorUpdate,
+    current_user: Principal = Depends(get_current_principal),
+    db: AsyncSession = Depends(get_db),
+):
+    await _require_membership(db, group_id, current_user.id)
+
+    room = f"group:{group_id}"
+    cursor = await mark_read(
+        db, current_user.id, room, GroupMessage, GroupMessage.group_id == group_id, update.message_id
+    )
+    if cursor is None:
+        raise HTTPException(status_code=404, detail="Message not found in group")
+
+    await unread_updated(room, [(current_user.id, cursor.unread_count)])
+    return cursor
 
 
 @router.get("", response_model=list[GroupOut])
 async def list_user_groups(
-    current_user: User = Depends(get_current_user),
+    current_user: Principal = Depends(get_current_principal),
     db: AsyncSession = Depends(get_db),
 ):
     memberships_query = await db.execute(
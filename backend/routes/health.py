@@ -1,11 +1,71 @@
-from fastapi import APIRouter, Depends
+import time
+
+from fastapi import APIRouter, Depends, Response
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import text
 
-from database import get_db
+from core.hashing import hasher_pool
+from core.membership import membership_cache
+from core.message_writer import message_writer
+from core.metrics import registry
+from core.principal import user_cache
+from core.ratelimit import rate_limiter
+from core.room_cache import recent_messages
+from database import get_db, pool_stats
+from realtime.sio import sio
 
 router = APIRouter()
 
+# Gauges mirrored from the component stats() at scrape time
+pool_gauge = registry.gauge("db_pool", "DB pool state", ("field",))
+cache_entries = registry.gauge("cache_entries", "Cached entries", ("cache",))
+cache_lookups = registry.counter("cache_lookups_total", "Cache lookups", ("cache", "result"))
+room_cache_bytes = registry.gauge("room_cache_bytes", "Bytes held by the recent message cache")
+socket_rooms = registry.gauge("socket_rooms", "Rooms with local members, excluding per-socket rooms")
+ratelimit_decisions = registry.counter("ratelimit_decisions_total", "Rate limit checks", ("policy", "result"))
+hasher_pending = registry.gauge("password_hash_pending", "argon2 jobs queued or running")
+hasher_rejected = registry.counter("password_hash_rejected_total", "argon2 jobs rejected with 503")
+writer_rows = registry.counter("message_writer_rows_total", "Rows flushed by the batched message writer")
+writer_batches = registry.counter("message_writer_batches_total", "Batches flushed by the message writer")
+socket_queued = registry.gauge("socket_queued_packets", "Outbound packets queued across sockets", ("stat",))
+process_cpu = registry.counter("process_cpu_seconds_total", "CPU time used by this worker process")
+
+
+@registry.on_collect
+def _collect() -> None:
+    for field, value in pool_stats().items():
+        if isinstance(value, (int, float)):
+            pool_gauge.labels(field).set(value)
+
+    for name, cache in (("membership", membership_cache), ("user", user_cache), ("recent_messages", recent_messages)):
+        stats = cache.stats()
+        cache_entries.labels(name).set(stats.get("rooms", stats.get("size", 0)))
+        cache_lookups.labels(name, "hit").set(stats["hits"])
+        cache_lookups.labels(name, "miss").set(stats["misses"])
+    room_cache_bytes.set(recent_messages.size)
+
+    total, deepest = sio.queue_stats()
+    socket_queued.labels("total").set(total)
+    socket_queued.labels("max").set(deepest)
+
+    rooms = sio.manager.rooms.get("/", {})
+    socket_rooms.set(sum(1 for room in rooms if room is not None and room not in rooms.get(room, ())))
+
+    for result, counts in (("allowed", rate_limiter.allowed), ("rejected", rate_limiter.rejected)):
+        for policy, count in counts.items():
+            ratelimit_decisions.labels(policy, result).set(count)
+
+    hasher_pending.set(hasher_pool.pending)
+    hasher_rejected.labels().set(hasher_pool.rejected)
+    writer_rows.labels().set(message_writer.rows)
+    writer_batches.labels().set(message_writer.batches)
+    process_cpu.labels().set(time.process_time())
+
+
+@router.get("/metrics", include_in_schema=False)
+async def metrics():
+    return Response(registry.render(), media_type="text/plain; version=0.0.4")
+
 
 @router.get("/health")
 async def health():
@@ -19,3 +79,23 @@ async def db_health(db: AsyncSession = Depends(get_db)):
         return {"database": "ok"}
     except Exception as e:
         return {"database": "error", "details": str(e)}
+
+
+@router.get("/health/pool")
+async def pool_health():
+    return pool_stats()
+
+
+@router.get("/health/cache")
+async def cache_health():
+    return {"membership": membership_cache.stats(), "recent_messages": recent_messages.stats()}
+
+
+@router.get("/health/hasher")
+async def hasher_health():
+    return hasher_pool.stats()
+
+
+@router.get("/health/ratelimit")
+async def ratelimit_health():
+    return rate_limiter.stats()
@@ -1,21 +1,44 @@
-from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy import select, and_, or_
+from collections import Counter, defaultdict
+from typing import Optional
+
+from fastapi import APIRouter, Depends, HTTPException, Query, Response
+from sqlalchemy import insert, select
 from sqlalchemy.ext.asyncio import AsyncSession
 
+from core.membership import member_group_ids
+from core.message_writer import persist_message
+from core.pagination import MAX_PAGE_SIZE
+from core.ratelimit import rate_limiter
+from core.read_state import mark_read, record_messages
+from core.room_cache import history_page
+from core.serialization import (
+    GROUP_MESSAGE_FIELDS, PRIVATE_MESSAGE_FIELDS, RawJSON, encode_json, message_json, private_message_json,
+)
 from database import get_db
-from deps.auth import get_current_user
-from models import User, PrivateMessage
-from schemas import PrivateMessageCreate, PrivateMessageOut
-from realtime.sio import sio
+from core.principal import Principal
+from deps.auth import get_current_principal
+from deps.ratelimit import enforce_rate_limit, limit_ip, limit_user
+from models import User, PrivateMessage, GroupMessage
+from schemas import (
+    PrivateMessageCreate, PrivateMessageOut, PrivateMessagePage, BatchMessageCreate, BatchMessageResult,
+    ReadCursorOut, ReadCursorUpdate,
+)
+from realtime.fanout import message_created, messages_created, unread_updated
 from realtime.events import dm_room
 
 router = APIRouter()
 
+PRIVATE_MESSAGE_COLUMNS = [getattr(PrivateMessage, field) for field in PRIVATE_MESSAGE_FIELDS]
+
 
-@router.post("/private", response_model=PrivateMessageOut)
+@router.post(
+    "/private",
+    response_model=PrivateMessageOut,
+    dependencies=[limit_ip("message:ip"), limit_user("message:user")],
+)
 async def create_private_message(
     message: PrivateMessageCreate,
-    current_user: User = Depends(get_current_user),
+    current_user: Principal = Depends(get_current_principal),
     db: AsyncSession = Depends(get_db),
 ):
     if message.receiver_id == current_user.id:
@@ -25,46 +48,145 @@ async def create_private_message(
     receiver = receiver_query.scalar_one_or_none()
     if not receiver:
         raise HTTPException(status_code=404, detail="Receiver not found")
+    room = dm_room(current_user.id, message.receiver_id)
+    # Only charged once the room is known to be valid for the sender
+    await enforce_rate_limit("message:room", room)
 
-    new_message = PrivateMessage(
+    new_message, unread = await persist_message(
+        db,
+        PrivateMessage,
+        room,
         sender_id=current_user.id,
         receiver_id=message.receiver_id,
         content=message.content,
     )
 
-    db.add(new_message)
+    body = private_message_json(new_message)
+    await message_created(room, new_message, body)
+    await unread_updated(room, unread)
+
+    return Response(body, media_type="application/json")
+
+
+@router.post(
+    "/batch",
+    response_model=list[BatchMessageResult],
+    dependencies=[limit_ip("message:ip"), limit_user("batch:user")],
+)
+async def create_messages_batch(
+    batch: BatchMessageCreate,
+    current_user: Principal = Depends(get_current_principal),
+    db: AsyncSession = Depends(get_db),
+):
+    items = batch.messages
+    receiver_ids = {m.receiver_id for m in items if m.receiver_id is not None}
+    group_ids = {m.group_id for m in items if m.group_id is not None}
+
+    # One query per target kind, no matter how many items
+    existing_receivers = set()
+    if receiver_ids:
+        receivers_query = await db.execute(select(User.id).where(User.id.in_(receiver_ids)))
+        existing_receivers = set(receivers_query.scalars())
+    allowed_groups = await member_group_ids(db, current_user.id, group_ids) if group_ids else set()
+
+    results = [{"index": i, "ok": False, "error": None, "message": None} for i in range(len(items))]
+    valid = []  # (index, room)
+    for i, item in enumerate(items):
+        if (item.receiver_id is None) == (item.group_id is None):
+            results[i]["error"] = "Exactly one of receiver_id or group_id is required"
+        elif item.group_id is not None:
+            if item.group_id not in allowed_groups:
+                results[i]["error"] = "Not a member of the group"
+                continue
+            valid.append((i, f"group:{item.group_id}"))
+        elif item.receiver_id == current_user.id:
+            results[i]["error"] = "Cannot message yourself"
+        elif item.receiver_id not in existing_receivers:
+            results[i]["error"] = "Receiver not found"
+        else:
+            valid.append((i, dm_room(current_user.id, item.receiver_id)))
+
+    # Every item costs one message:batch token (a bulk budget of its own, so bots
+    # can post full batches) and one message:room token from its room's bucket
+    _, batch_burst = rate_limiter.policies["message:batch"]
+    if len(valid) > batch_burst:
+        raise HTTPException(status_code=400, detail=f"At most {int(batch_burst)} messages per batch")
+    if valid:
+        await enforce_rate_limit("message:batch", current_user.id, cost=len(valid))
+    per_room = Counter(room for _, room in valid)
+    limited = {room for room, n in per_room.items() if await rate_limiter.check("message:room", room, n)}
+
+    private_rows, private_index = [], []
+    group_rows, group_index = [], []
+    for i, room in valid:
+        item = items[i]
+        if room in limited:
+            results[i]["error"] = "Rate limited"
+        elif item.group_id is not None:
+            group_rows.append({"group_id": item.group_id, "sender_id": current_user.id, "content": item.content})
+            group_index.append(i)
+        else:
+            private_rows.append({"sender_id": current_user.id, "receiver_id": item.receiver_id, "content": item.content})
+            private_index.append(i)
+
+    by_room = defaultdict(list)
+    for model, fields, rows, index in (
+        (PrivateMessage, PRIVATE_MESSAGE_FIELDS, private_rows, private_index),
+        (GroupMessage, GROUP_MESSAGE_FIELDS, group_rows, group_index),
+    ):
+        if not rows:
+            continue
+        table = model.__table__
+        stmt = insert(table).returning(*table.c, sort_by_parameter_order=True)
+        inserted = (await db.execute(stmt, rows)).all()
+        for i, row in zip(index, inserted):
+            body = message_json(row, fields)
+            results[i]["ok"] = True
+            results[i]["message"] = RawJSON(body)
+            room = row.conversation_key if model is PrivateMessage else f"group:{row.group_id}"
+            by_room[room].append((row, body))
+
+    unread = {}
+    for room, created in by_room.items():
+        unread[room] = await record_messages(db, room, [row for row, _ in created])
     await db.commit()
-    await db.refresh(new_message)
 
-    room = dm_room(current_user.id, message.receiver_id)
-    payload = PrivateMessageOut.model_validate(new_message).model_dump(mode="json")
-    await sio.emit("message", {"room": room, "data": payload}, room=room)
+    for room, created in by_room.items():
+        await messages_created(room, created)
+        await unread_updated(room, unread[room])
 
-    return new_message
+    return Response(encode_json(results), media_type="application/json")
 
 
-@router.get("/private/{other_user_id}", response_model=list[PrivateMessageOut])
+@router.get("/private/{other_user_id}", response_model=PrivateMessagePage)
 async def get_private_messages(
     other_user_id: int,
-    current_user: User = Depends(get_current_user),
-    limit: int = 50,
+    current_user: Principal = Depends(get_current_principal),
+    limit: int = Query(50, ge=1, le=MAX_PAGE_SIZE),
+    before: Optional[str] = None,
+    after: Optional[str] = None,
+    db: AsyncSession = Depends(get_db),
+):
+    room = dm_room(current_user.id, other_user_id)
+    query = select(*PRIVATE_MESSAGE_COLUMNS).where(PrivateMessage.conversation_key == room)
+    body = await history_page(db, room, query, PrivateMessage, private_message_json, limit, before, after)
+    return Response(body, media_type="application/json")
+
+
+@router.post("/private/{other_user_id}/read", response_model=ReadCursorOut)
+async def mark_private_read(
+    other_user_id: int,
+    update: ReadCursorUpdate,
+    current_user: Principal = Depends(get_current_principal),
     db: AsyncSession = Depends(get_db),
 ):
-    messages_query = await db.execute(
-        select(PrivateMessage)
-        .where(
-            or_(
-                and_(
-                    PrivateMessage.sender_id == current_user.id,
-                    PrivateMessage.receiver_id == other_user_id,
-                ),
-                and_(
-                    PrivateMessage.sender_id == other_user_id,
-                    PrivateMessage.receiver_id == current_user.id,
-                ),
-            )
-        )
-        .order_by(PrivateMessage.created_at)
-        .limit(limit)
+    room = dm_room(current_user.id, other_user_id)
+    cursor = await mark_read(
+        db, current_user.id, room, PrivateMessage, PrivateMessage.conversation_key == room, update.message_id
     )
-    return messages_query.scalars().all()
+    if cursor is None:
+        raise HTTPException(status_code=404, detail="Message not found in conversation")
+
+    # Other devices of the same user clear their badge too
+    await unread_updated(room, [(current_user.id, cursor.unread_count)])
+    return cursor
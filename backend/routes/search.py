@@ -0,0 +1,84 @@
+from typing import Optional
+
+from fastapi import APIRouter, Depends, HTTPException, Query, Response
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from core.pagination import decode_token, encode_token
+from core.principal import Principal
+from core.search import MAX_SEARCH_RESULTS, search_messages, tokenize
+from core.serialization import (
+    GROUP_MESSAGE_FIELDS, PRIVATE_MESSAGE_FIELDS, RawJSON, encode_json, message_json,
+)
+from database import get_db
+from deps.auth import get_current_principal
+from deps.ratelimit import limit_user
+from models import GroupMessage, PrivateMessage, conversation_key
+from schemas import SearchPage
+
+router = APIRouter()
+
+_SOURCES = {
+    "dm": (PrivateMessage, PRIVATE_MESSAGE_FIELDS),
+    "group": (GroupMessage, GROUP_MESSAGE_FIELDS),
+}
+
+
+def _check_room(room: str) -> None:
+    kind, _, rest = room.partition(":")
+    parts = rest.split(":")
+    expected = 2 if kind == "dm" else 1 if kind == "group" else 0
+    if not expected or len(parts) != expected or not all(p.isdigit() for p in parts):
+        raise HTTPException(status_code=400, detail="Invalid room")
+
+
+def _decode_after(cursor: str) -> tuple[float, str, int]:
+    try:
+        rank, kind, message_id = decode_token(cursor)
+        if kind not in _SOURCES:
+            raise ValueError(kind)
+        return float(rank), kind, int(message_id)
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+@router.get("", response_model=SearchPage, dependencies=[limit_user("search:user")])
+async def search(
+    q: str = Query(..., min_length=1, max_length=256),
+    room: Optional[str] = None,
+    limit: int = Query(20, ge=1, le=MAX_SEARCH_RESULTS),
+    cursor: Optional[str] = None,
+    current_user: Principal = Depends(get_current_principal),
+    db: AsyncSession = Depends(get_db),
+):
+    if not tokenize(q):
+        raise HTTPException(status_code=400, detail="Query has no searchable terms")
+    if room is not None:
+        _check_room(room)
+    after = _decode_after(cursor) if cursor else None
+
+    hits = await search_messages(db, current_user.id, q, room, limit + 1, after)
+    next_cursor = encode_token(list(hits[limit - 1])) if len(hits) > limit else None
+    hits = hits[:limit]
+
+    # Hydrate the page: one query per message table
+    rows = {}
+    for kind, (model, fields) in _SOURCES.items():
+        ids = [message_id for _, hit_kind, message_id in hits if hit_kind == kind]
+        if ids:
+            result = await db.execute(select(*(getattr(model, f) for f in fields)).where(model.id.in_(ids)))
+            rows.update({(kind, row.id): row for row in result.all()})
+
+    items = []
+    for rank, kind, message_id in hits:
+        row = rows.get((kind, message_id))
+        if row is None:
+            continue
+        key = f"group:{row.group_id}" if kind == "group" else conversation_key(row.sender_id, row.receiver_id)
+        items.append({
+            "kind": kind,
+            "conversation_key": key,
+            "rank": rank,
+            "message": RawJSON(message_json(row, _SOURCES[kind][1])),
+        })
+    return Response(encode_json({"items": items, "next_cursor": next_cursor}), media_type="application/json")
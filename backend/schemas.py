@@ -1,5 +1,6 @@
 from datetime import datetime
-from pydantic import BaseModel, EmailStr
+from typing import Optional, Union
+from pydantic import BaseModel, EmailStr, Field
 
 # This defines what the client must send to create a new user
 class UserCreate(BaseModel):
@@ -40,6 +41,10 @@ class PrivateMessageOut(BaseModel):
     class Config:
         from_attributes = True
 
+class PrivateMessagePage(BaseModel):
+    items: list[PrivateMessageOut]
+    next_cursor: Optional[str] = None
+
 class GroupCreate(BaseModel):
     name: str
 
@@ -52,6 +57,23 @@ class GroupOut(BaseModel):
     class Config:
         from_attributes = True
 
+# Bulk membership changes; each call is one set-based statement
+class GroupMembersUpdate(BaseModel):
+    user_ids: list[int] = Field(min_length=1, max_length=5000)
+
+class GroupMembersResult(BaseModel):
+    changed: list[int]  # added / removed by this call
+    unchanged: list[int]  # already (not) members, or unknown users
+
+class GroupMemberOut(BaseModel):
+    user_id: int
+    username: str
+    joined_at: datetime
+
+class GroupMemberPage(BaseModel):
+    items: list[GroupMemberOut]
+    next_cursor: Optional[str] = None
+
 class GroupMessageCreate(BaseModel):
     content: str
 
@@ -63,4 +85,53 @@ class GroupMessageOut(BaseModel):
     created_at: datetime
 
     class Config:
-        from_attributes = True
\ No newline at end of file
+        from_attributes = True
+
+class GroupMessagePage(BaseModel):
+    items: list[GroupMessageOut]
+    next_cursor: Optional[str] = None
+
+
+# Bulk send: each item targets exactly one of receiver_id / group_id
+class BatchMessageItem(BaseModel):
+    receiver_id: Optional[int] = None
+    group_id: Optional[int] = None
+    content: str
+
+class BatchMessageCreate(BaseModel):
+    messages: list[BatchMessageItem] = Field(min_length=1, max_length=500)
+
+class BatchMessageResult(BaseModel):
+    index: int
+    ok: bool
+    error: Optional[str] = None
+    message: Optional[Union[PrivateMessageOut, GroupMessageOut]] = None
+
+
+class ReadCursorUpdate(BaseModel):
+    message_id: int
+
+class ReadCursorOut(BaseModel):
+    conversation_key: str
+    last_read_message_id: int
+    unread_count: int
+
+class ConversationOut(ReadCursorOut):
+    kind: str  # "dm" | "group"
+    group_id: Optional[int] = None
+    peer_id: Optional[int] = None
+    last_activity_at: datetime
+    last_message_id: Optional[int] = None  # None until the first message
+    last_sender_id: Optional[int] = None
+    last_message_preview: Optional[str] = None
+
+
+class SearchHit(BaseModel):
+    kind: str  # "dm" | "group"
+    conversation_key: str
+    rank: float
+    message: Union[PrivateMessageOut, GroupMessageOut]
+
+class SearchPage(BaseModel):
+    items: list[SearchHit]
+    next_cursor: Optional[str] = None
@@ -0,0 +1,8 @@
+import os
+import sys
+
+# The app reads its configuration at import time
+os.environ.setdefault("SECRET_KEY", "test")
+os.environ.setdefault("DATABASE_URL", "sqlite+aiosqlite://")
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,63 @@
+from datetime import datetime
+
+import pytest
+from sqlalchemy import create_engine, select, text
+
+from core.pagination import encode_cursor, keyset_page
+from database import Base
+from models import GroupMember, GroupMessage, PrivateMessage, conversation_key
+from routes.groups import GROUP_MESSAGE_COLUMNS
+from routes.messages import PRIVATE_MESSAGE_COLUMNS
+
+CURSOR = encode_cursor(datetime(2026, 1, 1), 1000)
+
+
+@pytest.fixture(scope="module")
+def conn():
+    engine = create_engine("sqlite://")
+    Base.metadata.create_all(engine)
+    with engine.connect() as conn:
+        yield conn
+    engine.dispose()
+
+
+def query_plan(conn, query) -> str:
+    sql = query.compile(conn, compile_kwargs={"literal_binds": True})
+    return "\n".join(row.detail for row in conn.execute(text(f"EXPLAIN QUERY PLAN {sql}")))
+
+
+HISTORY = {
+    "group": (
+        select(*GROUP_MESSAGE_COLUMNS).where(GroupMessage.group_id == 1),
+        GroupMessage,
+        "ix_group_messages_group_created",
+    ),
+    "dm": (
+        select(*PRIVATE_MESSAGE_COLUMNS).where(PrivateMessage.conversation_key == conversation_key(1, 2)),
+        PrivateMessage,
+        "ix_private_messages_conversation_created",
+    ),
+}
+
+
+@pytest.mark.parametrize("room", HISTORY)
+@pytest.mark.parametrize(
+    "window, bound", [({}, "=?)"), ({"before": CURSOR}, "created_at<?"), ({"after": CURSOR}, "created_at>?")]
+)
+def test_history_page_is_an_index_range_scan(conn, room, window, bound):
+    query, model, index = HISTORY[room]
+    plan = query_plan(conn, keyset_page(query, model, 50, **window))
+
+    assert f"SEARCH {model.__tablename__} USING INDEX {index}" in plan
+    assert bound in plan
+    assert "SCAN" not in plan  # no full table or full index scan
+    assert "TEMP B-TREE" not in plan  # rows come out of the index already ordered
+
+
+def test_membership_lookup_uses_unique_index(conn):
+    plan = query_plan(
+        conn, select(GroupMember.id).where(GroupMember.group_id == 1, GroupMember.user_id == 2)
+    )
+
+    assert "SEARCH group_members USING" in plan
+    assert "group_id=? AND user_id=?" in plan